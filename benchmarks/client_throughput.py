@@ -0,0 +1,142 @@
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import tempfile
+from datetime import datetime
+import pandas as pd
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, '..', 'src'))
+import synthetic
+from fake_servers import FaultConfig, SnodasArchive, FakeFTPServer, FeatureLayer, FakeArcGISServer
+from definitions import IOWA_UPPER_LEFT, IOWA_BOTTOM_RIGHT, NAR_CRS
+from roads_client import Roads_client
+from salt_client import Salt_client
+from snodas_client import snodas_download_quarter
+
+'''
+Throughput and latency of the download clients (Roads_client, Salt_client, snodas_client) against the local stand-in
+servers of fake_servers.py. Client pauses between requests are set with --pause (the clients default to the polite
+pauses used against the live servers). Results are written to benchmarks/results/ in the run report format of
+profiling.py, with server-side request counts, bytes, injected errors and latency percentiles
+'''
+def attempt(download):
+    '''
+    Run a client download, catching its exception so that a client failing under injected errors is reported as a
+    failed run instead of aborting the benchmark
+    :param download: Function without arguments
+    :return: (result of download or None, error message or None)
+    '''
+    try:
+        return download(), None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+def run_roads_client(n_records, faults, pause):
+    '''
+    Download synthetic NAR roads for one state through Roads_client
+    :return: (number of records downloaded, server stats summary, error message or None)
+    '''
+    roads_df = synthetic.synthetic_roads(n_records, IOWA_UPPER_LEFT, IOWA_BOTTOM_RIGHT)
+    with FakeArcGISServer(FeatureLayer(roads_df), faults) as server:
+        def download():
+            client = Roads_client(server.link, "Iowa", NAR_CRS, pause=pause)
+            client.add_params(where=["COUNTRY=2", "JURISNAME='Iowa'"])
+            client.get_record_count()
+            return client.build_df()
+        roads_df, error = attempt(download)
+        return 0 if roads_df is None else len(roads_df), server.stats.summary(), error
+
+def run_salt_client(n_records, faults, pause):
+    '''
+    Download synthetic Iowa DOT salt passes through Salt_client
+    :return: (number of records downloaded, server stats summary, error message or None)
+    '''
+    salt_df = synthetic.synthetic_salt(n_records, IOWA_UPPER_LEFT, IOWA_BOTTOM_RIGHT, '2018-11-01', '2019-03-31')
+    with FakeArcGISServer(FeatureLayer(salt_df), faults) as server:
+        def download():
+            client = Salt_client(server.link, pause=pause)
+            client.get_record_count()
+            return client.build_df()
+        salt_df, error = attempt(download)
+        return 0 if salt_df is None else len(salt_df), server.stats.summary(), error
+
+def run_snodas_client(n_days, file_size, faults, pause):
+    '''
+    Download n_days of SNODAS tar files through snodas_client.snodas_download_quarter into a temporary directory
+    :return: (number of non-empty files downloaded, server stats summary, error message or None)
+    '''
+    start = pd.Timestamp('2019-01-01')
+    end = start + pd.Timedelta(days=n_days - 1)
+    with FakeFTPServer(SnodasArchive(start, end, file_size), faults) as server, \
+            tempfile.TemporaryDirectory() as dest_dir:
+        #snodas_client does not retry; an injected RETR error aborts the quarter
+        _, error = attempt(lambda: snodas_download_quarter(start, end, dest_dir, host=server.host, port=server.port,
+                                                           pause=pause))
+        files = [f for f in os.listdir(dest_dir) if os.path.getsize(os.path.join(dest_dir, f))]
+        return len(files), server.stats.summary(), error
+
+def client_throughput(clients, records, days, file_size, latency, throttle, error_rate, pause, seed=0):
+    '''
+    Run download clients against stand-in servers
+    :param clients: List. Any of 'roads', 'salt', 'snodas'
+    :param records: Int. Number of features served by the ArcGIS stand-in
+    :param days: Int. Number of daily SNODAS files served by the FTP stand-in
+    :param file_size: Int. Bytes of each SNODAS file
+    :param latency: Float. Seconds added before every server reply
+    :param throttle: Float. Bytes per second of server transfers. None for unthrottled
+    :param error_rate: Float. Probability that a feature page or file transfer fails
+    :param pause: Float. Seconds clients pause between requests
+    :param seed: Int. Random seed of error injection
+    :return: List of stage records. Runs of clients that raised have failed set and their error message
+    '''
+    stages = []
+    for client in clients:
+        faults = FaultConfig(latency, throttle, error_rate, seed)
+        start_wall, start_cpu = time.perf_counter(), time.process_time()
+        if client == 'snodas':
+            rows_out, stats, error = run_snodas_client(days, file_size, faults, pause)
+        elif client == 'roads':
+            rows_out, stats, error = run_roads_client(records, faults, pause)
+        else:
+            rows_out, stats, error = run_salt_client(records, faults, pause)
+        wall = time.perf_counter() - start_wall
+        stages.append({'stage': f"{client}_client", 'parent': None, 'depth': 0, 'rows_in': None,
+                       'rows_out': rows_out, 'wall_s': wall, 'cpu_s': time.process_time() - start_cpu,
+                       'peak_rss_mb': None, 'rows_per_s': rows_out / wall,
+                       'mb_per_s': stats['bytes_sent'] / wall / 2 ** 20, **stats,
+                       'failed': error is not None, 'error': error})
+        print(f"{client + '_client':<16} {wall:>8.2f} s {rows_out:>8} rows {stats['requests']:>6} requests "
+              f"{stats['errors']:>4} errors  p95 {stats['latency_p95_s'] * 1000:>8.1f} ms"
+              f"{f'  FAILED {error}' if error else ''}")
+    return stages
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Throughput and latency of download clients against local stand-in '
+                                                 'FTP and ArcGIS servers')
+    # CLI arguments with short and long flags
+    parser.add_argument('-c', '--clients', nargs='+', default=['roads', 'salt', 'snodas'],
+                        choices=['roads', 'salt', 'snodas'], help='Clients to run')
+    parser.add_argument('-n', '--records', type=int, default=10000, help='Features served by ArcGIS stand-in')
+    parser.add_argument('-d', '--days', type=int, default=10, help='Daily SNODAS files served by FTP stand-in')
+    parser.add_argument('-fs', '--filesize', type=int, default=1 << 22, help='Bytes of each SNODAS file')
+    parser.add_argument('--latency', type=float, default=0., help='Seconds added before every server reply')
+    parser.add_argument('--throttle', type=float, default=None, help='Bytes per second of server transfers')
+    parser.add_argument('--errorrate', type=float, default=0., help='Probability that a transfer fails')
+    parser.add_argument('-p', '--pause', type=float, default=0., help='Seconds clients pause between requests')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed of error injection')
+    parser.add_argument('-l', '--label', default='client_throughput', help='Label of run report')
+    args = parser.parse_args()
+
+    run_stages = client_throughput(args.clients, args.records, args.days, args.filesize, args.latency, args.throttle,
+                                   args.errorrate, args.pause, args.seed)
+    report = {'label': args.label, 'argv': sys.argv, 'finished': datetime.now().isoformat(timespec='seconds'),
+              'host': socket.gethostname(), 'python': sys.version.split()[0], 'config': vars(args),
+              'stages': run_stages}
+    os.makedirs(os.path.join(BENCHMARK_DIR, 'results'), exist_ok=True)
+    report_file = os.path.join(BENCHMARK_DIR, 'results', f"{args.label}_{datetime.now():%Y%m%dT%H%M%S}.json")
+    with open(report_file, 'w') as f:
+        json.dump(report, f, indent=1)
+    print(report_file)
@@ -0,0 +1,405 @@
+import os
+import re
+import sys
+import json
+import time
+import random
+import socket
+import hashlib
+import threading
+import socketserver
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import numpy as np
+import pandas as pd
+import shapely
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from utility import to_month_tag
+
+'''
+Local stand-ins for the live endpoints used by snodas_client (NSIDC FTP) and Roads_client/Salt_client (ArcGIS REST
+query endpoints). Both serve synthetic data and share a FaultConfig:
+    latency: seconds added before every reply (FTP control reply, HTTP response)
+    throttle: bytes per second of data transfers (FTP data connection, HTTP body). None for unthrottled
+    error_rate: probability that a transfer fails. FTP RETR replies 451, ArcGIS feature pages reply 500. Record count
+    requests are never failed, since the clients do not retry them
+Servers bind to 127.0.0.1 on an ephemeral port by default and run in a daemon thread: use them as context managers
+'''
+class FaultConfig(object):
+    '''
+    FaultConfig class holds latency, throttling and error injection settings of a stand-in server
+    '''
+    def __init__(self, latency=0., throttle=None, error_rate=0., seed=0):
+        '''
+        Initialize FaultConfig object
+        :param latency: Float. Seconds added before every reply
+        :param throttle: Float. Bytes per second of data transfers. None for unthrottled
+        :param error_rate: Float. Probability that a transfer fails
+        :param seed: Int. Random seed of error injection
+        '''
+        self.latency = latency
+        self.throttle = throttle
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def fail(self):
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+    def send(self, write, data, chunk_size=1 << 16):
+        '''
+        Write data in chunks, sleeping as needed to hold the throttled rate
+        :param write: Function writing bytes
+        :param data: Bytes
+        :param chunk_size: Int. Bytes per write
+        :return: None
+        '''
+        start = time.perf_counter()
+        for offset in range(0, len(data), chunk_size):
+            write(data[offset:offset + chunk_size])
+            if self.throttle:
+                ahead = (offset + chunk_size) / self.throttle - (time.perf_counter() - start)
+                if ahead > 0:
+                    time.sleep(ahead)
+
+class ServerStats(object):
+    '''
+    ServerStats class counts requests, bytes sent and injected errors, and records request durations
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.bytes_sent = 0
+        self.errors = 0
+        self.durations = []
+
+    def record(self, duration, bytes_sent=0, error=False):
+        with self._lock:
+            self.requests += 1
+            self.bytes_sent += bytes_sent
+            self.errors += int(error)
+            self.durations.append(duration)
+
+    def summary(self):
+        durations = np.array(self.durations) if self.durations else np.array([np.nan])
+        return {'requests': self.requests, 'bytes_sent': self.bytes_sent, 'errors': self.errors,
+                'latency_p50_s': float(np.percentile(durations, 50)),
+                'latency_p95_s': float(np.percentile(durations, 95))}
+
+class _BackgroundServer(object):
+    '''
+    Base class of stand-in servers. Runs a socketserver server in a daemon thread
+    '''
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+'''
+FTP stand-in
+'''
+def synthetic_file(name, size):
+    '''
+    Deterministic content of a served file: size bytes derived from the file name
+    :param name: String. File name
+    :param size: Int. Number of bytes
+    :return: Bytes
+    '''
+    block = hashlib.sha256(name.encode()).digest() * 2048 #64 KiB
+    return (block * (size // len(block) + 1))[:size]
+
+class SnodasArchive(object):
+    '''
+    SnodasArchive class is the virtual file system of the FTP stand-in: one SNODAS_unmasked_<date>.tar per day in
+    /DATASETS/NOAA/G02158/unmasked/<year>/<MM_Mon>/, as on the NSIDC server. Content is read from tar_dir when a tar
+    file of that name exists there (see synthetic.write_snodas_tar), otherwise synthesized with file_size bytes
+    '''
+    root = '/DATASETS/NOAA/G02158/unmasked'
+
+    def __init__(self, start, end, file_size=1 << 20, tar_dir=None):
+        '''
+        Initialize SnodasArchive object
+        :param start: Datetime. First day in archive
+        :param end: Datetime. Last day in archive
+        :param file_size: Int. Bytes of synthesized tar files
+        :param tar_dir: String. Directory of tar files served in place of synthesized content
+        '''
+        self.file_size = file_size
+        self.tar_dir = tar_dir
+        self.directories = {}
+        for date in pd.date_range(start, end):
+            directory = f"{self.root}/{date.year}/{to_month_tag(date.month)}"
+            self.directories.setdefault(directory, []).append(
+                f"SNODAS_unmasked_{date.year}{date.month:02d}{date.day:02d}.tar")
+
+    def listing(self, directory):
+        return self.directories.get(directory.rstrip('/'))
+
+    def read(self, directory, name):
+        if name not in (self.listing(directory) or []):
+            return None
+        if self.tar_dir and os.path.exists(os.path.join(self.tar_dir, name)):
+            with open(os.path.join(self.tar_dir, name), 'rb') as f:
+                return f.read()
+        return synthetic_file(name, self.file_size)
+
+class _FTPHandler(socketserver.StreamRequestHandler):
+    '''
+    Control connection of the FTP stand-in. Supports the commands issued by ftplib for login, cwd, dir, nlst and
+    retrbinary: USER, PASS, SYST, PWD, CWD, TYPE, PASV, LIST, NLST, RETR, NOOP, QUIT
+    '''
+    def reply(self, line):
+        self.server.faults.wait()
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        self.cwd = '/'
+        self.data_listener = None
+        self.reply("220 SNODAS stand-in FTP server ready")
+        for raw in self.rfile:
+            command, _, argument = raw.decode().strip().partition(' ')
+            command = command.upper()
+            if command == 'QUIT':
+                self.reply("221 Goodbye")
+                break
+            handler = getattr(self, f"ftp_{command}", None)
+            if handler is None:
+                self.reply(f"502 Command {command} not implemented")
+            else:
+                handler(argument)
+
+    def ftp_USER(self, argument):
+        self.reply("331 Please specify the password")
+
+    def ftp_PASS(self, argument):
+        self.reply("230 Login successful")
+
+    def ftp_SYST(self, argument):
+        self.reply("215 UNIX Type: L8")
+
+    def ftp_NOOP(self, argument):
+        self.reply("200 NOOP ok")
+
+    def ftp_TYPE(self, argument):
+        self.reply(f"200 Switching to {'Binary' if argument.upper().startswith('I') else 'ASCII'} mode")
+
+    def ftp_PWD(self, argument):
+        self.reply(f'257 "{self.cwd}" is the current directory')
+
+    def ftp_CWD(self, argument):
+        path = argument if argument.startswith('/') else f"{self.cwd.rstrip('/')}/{argument}"
+        if self.server.archive.listing(path) is None:
+            self.reply("550 Failed to change directory")
+        else:
+            self.cwd = path.rstrip('/')
+            self.reply("250 Directory successfully changed")
+
+    def ftp_PASV(self, argument):
+        if self.data_listener:
+            self.data_listener.close()
+        self.data_listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.data_listener.bind((self.server.server_address[0], 0))
+        self.data_listener.listen(1)
+        host, port = self.data_listener.getsockname()
+        self.reply(f"227 Entering Passive Mode ({host.replace('.', ',')},{port >> 8},{port & 0xFF})")
+
+    def transfer(self, data, start):
+        '''
+        Send data over passive data connection, throttled. The request is recorded in the server stats before the final
+        reply, so a client that returns on the reply never sees stats without its request
+        :param data: Bytes
+        :param start: Float. perf_counter at the start of the request
+        :return: None
+        '''
+        if self.data_listener is None:
+            self.server.stats.record(time.perf_counter() - start)
+            self.reply("425 Use PASV first")
+            return
+        self.reply("150 Opening data connection")
+        connection, _ = self.data_listener.accept()
+        try:
+            self.server.faults.send(connection.sendall, data)
+        finally:
+            connection.close()
+            self.data_listener.close()
+            self.data_listener = None
+        self.server.stats.record(time.perf_counter() - start, len(data))
+        self.reply("226 Transfer complete")
+
+    def ftp_LIST(self, argument):
+        start = time.perf_counter()
+        names = self.server.archive.listing(self.cwd) or []
+        lines = [f"-rw-r--r--    1 ftp      ftp      {self.server.archive.file_size:>10} Jan 01 00:00 {name}"
+                 for name in names]
+        self.transfer(("\r\n".join(lines) + "\r\n").encode(), start)
+
+    def ftp_NLST(self, argument):
+        #the NSIDC server lists . and .. first; snodas_download_day drops the first two entries
+        start = time.perf_counter()
+        names = ['.', '..'] + (self.server.archive.listing(self.cwd) or [])
+        self.transfer(("\r\n".join(names) + "\r\n").encode(), start)
+
+    def ftp_RETR(self, argument):
+        start = time.perf_counter()
+        data = self.server.archive.read(self.cwd, argument)
+        if data is None:
+            self.server.stats.record(time.perf_counter() - start)
+            self.reply("550 Failed to open file")
+        elif self.server.faults.fail():
+            self.server.stats.record(time.perf_counter() - start, error=True)
+            self.reply("451 Requested action aborted: local error in processing")
+        else:
+            self.transfer(data, start)
+
+class _ThreadingTCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class FakeFTPServer(_BackgroundServer):
+    '''
+    FakeFTPServer class serves a SnodasArchive over FTP with passive-mode data connections
+    '''
+    def __init__(self, archive, faults=None, host='127.0.0.1', port=0):
+        '''
+        Initialize FakeFTPServer object
+        :param archive: SnodasArchive
+        :param faults: FaultConfig
+        :param host: String. Bind address
+        :param port: Int. Bind port. 0 for an ephemeral port
+        '''
+        self.server = _ThreadingTCPServer((host, port), _FTPHandler)
+        self.server.archive = archive
+        self.server.faults = faults or FaultConfig()
+        self.server.stats = ServerStats()
+        self.host, self.port = self.server.server_address
+        self.stats = self.server.stats
+
+'''
+ArcGIS stand-in
+'''
+def _where_mask(data_frame, where):
+    '''
+    Rows of data_frame satisfying an ArcGIS where clause of the form used by the clients: "1=1", or column=value
+    comparisons joined by AND. String values are single-quoted
+    :param data_frame: DataFrame
+    :param where: String. where clause
+    :return: Ndarray of booleans
+    '''
+    mask = np.ones(len(data_frame), dtype=bool)
+    for clause in re.split(r"\s+AND\s+", where.strip(), flags=re.IGNORECASE):
+        column, _, value = (part.strip() for part in clause.partition('='))
+        if column == '1' and value == '1':
+            continue
+        if value.startswith("'"):
+            mask &= (data_frame[column].astype(str) == value.strip("'")).to_numpy()
+        else:
+            mask &= (data_frame[column] == float(value)).to_numpy()
+    return mask
+
+class FeatureLayer(object):
+    '''
+    FeatureLayer class holds the features served by the ArcGIS stand-in. Each feature is serialized to GeoJSON once
+    '''
+    def __init__(self, data_frame, max_record_count=2000):
+        '''
+        Initialize FeatureLayer object
+        :param data_frame: DataFrame with geometry in wkt format, e.g. from synthetic.synthetic_roads
+        :param max_record_count: Int. Maximum number of features returned per page, as configured on ArcGIS servers
+        '''
+        self.attributes = data_frame.drop(columns='geometry').reset_index(drop=True)
+        self.max_record_count = max_record_count
+        geometries = shapely.to_geojson(shapely.from_wkt(data_frame['geometry'].to_numpy()))
+        properties = self.attributes.to_dict(orient='records')
+        self.features = [f'{{"type":"Feature","geometry":{g},"properties":{json.dumps(p, default=str)}}}'
+                         for g, p in zip(geometries, properties)]
+
+    def query(self, params):
+        '''
+        Response body of a query request
+        :param params: Dictionary. Query string parameters
+        :return: (Bytes, number of features returned)
+        '''
+        rows = np.flatnonzero(_where_mask(self.attributes, params.get('where', '1=1')))
+        if params.get('returnCountOnly', 'false').lower() == 'true':
+            return json.dumps({'count': int(rows.size)}).encode(), 0
+        offset = int(params.get('resultOffset', 0))
+        count = min(int(params.get('resultRecordCount', self.max_record_count)), self.max_record_count)
+        page = rows[offset:offset + count]
+        exceeded = 'true' if offset + count < rows.size else 'false'
+        body = (f'{{"type":"FeatureCollection","exceededTransferLimit":{exceeded},"features":['
+                + ",".join(self.features[i] for i in page) + ']}')
+        return body.encode(), int(page.size)
+
+class _ArcGISHandler(BaseHTTPRequestHandler):
+    '''
+    Query endpoint of the ArcGIS stand-in: GET <any path>/query
+    '''
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        start = time.perf_counter()
+        url = urlparse(self.path)
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        faults = self.server.faults
+        faults.wait()
+        if not url.path.endswith('/query'):
+            self.server.stats.record(time.perf_counter() - start)
+            self.respond(404, b'{"error":{"code":400,"message":"Invalid URL"}}')
+            return
+        counting = params.get('returnCountOnly', 'false').lower() == 'true'
+        if not counting and faults.fail():
+            self.server.stats.record(time.perf_counter() - start, error=True)
+            self.respond(500, b'{"error":{"code":500,"message":"Injected error"}}')
+            return
+        body, _ = self.server.layer.query(params)
+        self.respond(200, body)
+        self.server.stats.record(time.perf_counter() - start, len(body))
+
+    def respond(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.server.faults.send(self.wfile.write, body)
+
+class _ThreadingHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class FakeArcGISServer(_BackgroundServer):
+    '''
+    FakeArcGISServer class serves a FeatureLayer through an ArcGIS REST compatible query endpoint
+    '''
+    def __init__(self, layer, faults=None, host='127.0.0.1', port=0):
+        '''
+        Initialize FakeArcGISServer object
+        :param layer: FeatureLayer
+        :param faults: FaultConfig
+        :param host: String. Bind address
+        :param port: Int. Bind port. 0 for an ephemeral port
+        '''
+        self.server = _ThreadingHTTPServer((host, port), _ArcGISHandler)
+        self.server.layer = layer
+        self.server.faults = faults or FaultConfig()
+        self.server.stats = ServerStats()
+        self.host, self.port = self.server.server_address
+        self.stats = self.server.stats
+        self.link = f"http://{self.host}:{self.port}/arcgis/rest/services/FeatureServer/0/query"
@@ -0,0 +1,311 @@
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import subprocess
+import multiprocessing
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+import dill
+import pandas as pd
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, '..', 'src'))
+import synthetic
+from definitions import IOWA_UPPER_LEFT, IOWA_BOTTOM_RIGHT, REGIONAL_UPPER_LEFT, REGIONAL_BOTTOM_RIGHT, MIN_SOLID
+from grid import Grid, Point
+from storage import read_frame, write_frame
+from profiling import PROFILE_ENV, peak_rss_mb, count_rows
+
+'''
+Benchmarks of pipeline stages on synthetic data. Each (stage, scale) runs in a fresh process so that peak RSS is that of
+the stage alone. Synthetic inputs are generated once per scale and seed into benchmarks/data/. Results are written to
+benchmarks/results/ in the run report format of profiling.py, so two runs are compared with src/compare_profiles.py
+    small: Iowa grid, production poly_size
+    medium: regional grid, poly_size 20
+    large: regional grid, production poly_size
+'''
+SCALES = {
+    'small': dict(upper_left=IOWA_UPPER_LEFT, bottom_right=IOWA_BOTTOM_RIGHT, poly_size=10, snodas_days=1,
+                  pixel_days=1, n_roads=2000, n_salt=5000, storm_days=30, salt_rows=20000, quarter_days=30,
+                  quarters=4),
+    'medium': dict(upper_left=REGIONAL_UPPER_LEFT, bottom_right=REGIONAL_BOTTOM_RIGHT, poly_size=20, snodas_days=2,
+                   pixel_days=1, n_roads=20000, n_salt=50000, storm_days=90, salt_rows=200000, quarter_days=91,
+                   quarters=18),
+    'large': dict(upper_left=REGIONAL_UPPER_LEFT, bottom_right=REGIONAL_BOTTOM_RIGHT, poly_size=10, snodas_days=7,
+                  pixel_days=3, n_roads=100000, n_salt=250000, storm_days=180, salt_rows=1000000, quarter_days=91,
+                  quarters=18),
+}
+START_DATE = pd.Timestamp('2019-12-01')
+
+class Fixtures(object):
+    '''
+    Fixtures class generates, or locates previously generated, synthetic input files of a benchmark scale
+    '''
+    def __init__(self, scale, data_dir=os.path.join(BENCHMARK_DIR, 'data'), seed=0):
+        '''
+        Initialize Fixtures object
+        :param scale: String. Key of SCALES
+        :param data_dir: String. Directory of generated data
+        :param seed: Int. Random seed of generators
+        '''
+        self.scale = scale
+        self.params = SCALES[scale]
+        self.seed = seed
+        self.data_dir = os.path.join(data_dir, f"{scale}_seed{seed}")
+        self.upper_left = Point(*self.params['upper_left'])
+        self.bottom_right = Point(*self.params['bottom_right'])
+        os.makedirs(self.data_dir, exist_ok=True)
+
+    def path(self, name):
+        return os.path.join(self.data_dir, name)
+
+    def grid(self):
+        return Grid(self.upper_left, self.bottom_right, self.params['poly_size'])
+
+    def grid_file(self):
+        if not os.path.exists(self.path('grid.csv')):
+            write_frame(self.grid().grid_df(), self.path('grid.csv'), schema='grid')
+        return self.path('grid.csv')
+
+    def snodas_dates(self):
+        return pd.date_range(START_DATE, periods=self.params['snodas_days'])
+
+    def snodas_dir(self):
+        for date in self.snodas_dates():
+            tar_path = synthetic.write_snodas_tar(date, self.path('snodas_tar_files'), self.seed)
+            synthetic.unpack_snodas_tar(tar_path, self.path('snodas_params'))
+        return self.path('snodas_params')
+
+    def roads_file(self):
+        if not os.path.exists(self.path('roads.csv')):
+            write_frame(synthetic.synthetic_roads(self.params['n_roads'], self.upper_left, self.bottom_right,
+                                                  self.seed), self.path('roads.csv'))
+        return self.path('roads.csv')
+
+    def salt_storm_dates_file(self):
+        if not os.path.exists(self.path('salt_storm_dates.csv')):
+            from salt import parse_dates
+            salt_df = synthetic.synthetic_salt(self.params['n_salt'], self.upper_left, self.bottom_right,
+                                               START_DATE - pd.Timedelta(days=365), START_DATE, self.seed)
+            write_frame(salt_df, self.path('salt.csv'))
+            write_frame(parse_dates(self.path('salt.csv')), self.path('salt_storm_dates.csv'),
+                        schema='salt_storm_dates')
+        return self.path('salt_storm_dates.csv')
+
+    def poly_index(self):
+        return read_frame(self.grid_file(), schema='grid', columns=['poly_index'])['poly_index'].to_numpy()
+
+    def iowa_files(self):
+        '''
+        Salt overlay, SNODAS and road feature files of the training data set, in the argument order of
+        join_it_iowawinter
+        :return: (salt overlay file, snodas file, road features file)
+        '''
+        files = (self.path('salt_overlay.csv'), self.path('snodas_storm.csv'), self.path('road_features.csv'))
+        if not all(os.path.exists(f) for f in files):
+            poly_index = self.poly_index()
+            snodas_df = synthetic.synthetic_snodas_params(
+                pd.date_range(START_DATE, periods=self.params['storm_days']), poly_index, self.seed)
+            write_frame(snodas_df, files[1], schema='snodas_params')
+            write_frame(synthetic.synthetic_salt_overlay(snodas_df, self.params['salt_rows'], self.seed), files[0],
+                        schema='salt_overlay')
+            write_frame(synthetic.synthetic_road_features(poly_index, self.seed), files[2], schema='road_features')
+        return files
+
+    def joined_file(self):
+        if not os.path.exists(self.path('joined.csv')):
+            from salt import join_it_iowawinter
+            write_frame(join_it_iowawinter(*self.iowa_files()), self.path('joined.csv'), schema='winter_iowa_joined')
+        return self.path('joined.csv')
+
+    def model_file(self):
+        if not os.path.exists(self.path('fitted_salt_model.pkd')):
+            from salt_model import total_salt_per_polygon
+            with open(self.path('fitted_salt_model.pkd'), 'wb') as f:
+                dill.dump(total_salt_per_polygon(self.joined_file(), MIN_SOLID), f)
+        return self.path('fitted_salt_model.pkd')
+
+    def quarter_snodas_file(self):
+        if not os.path.exists(self.path('snodas_params_Q12020.csv')):
+            write_frame(synthetic.synthetic_snodas_params(
+                pd.date_range('2019-12-31', periods=self.params['quarter_days']), self.poly_index(), self.seed),
+                self.path('snodas_params_Q12020.csv'), schema='snodas_params')
+        return self.path('snodas_params_Q12020.csv')
+
+    def market(self):
+        years = range(2014, 2014 + self.params['quarters'] // 2 + 1)
+        quarters = [f"Q{q}{year}" for year in years for q in (1, 4)][:self.params['quarters']]
+        return synthetic.synthetic_market(quarters, self.poly_index(), self.seed)
+
+'''
+Benchmarks. Each takes Fixtures and returns (function timed with no arguments, rows in)
+'''
+def bench_grid(fixtures):
+    def run():
+        return fixtures.grid().grid_df()
+    return run, None
+
+def bench_join_snodas_folder(fixtures):
+    from snodas import join_snodas_folder, SNODAS_FILES
+    grid = fixtures.grid()
+    snodas_dir = fixtures.snodas_dir()
+    y_slice = slice(grid.y_start, grid.y_height + grid.y_start)
+    x_slice = slice(grid.x_start, grid.x_width + grid.x_start)
+    flat_size = grid.y_height * grid.x_width
+
+    def run():
+        return [join_snodas_folder(date, v, x_slice, y_slice, flat_size, snodas_dir, fixtures.path('binary_files'))
+                for date in fixtures.snodas_dates() for v in SNODAS_FILES.values()]
+    return run, None
+
+def bench_agg_by_poly_index(fixtures):
+    from snodas import agg_by_poly_index
+    pixels_df = synthetic.synthetic_snodas_pixels(fixtures.grid(),
+                                                  pd.date_range(START_DATE, periods=fixtures.params['pixel_days']),
+                                                  fixtures.seed)
+
+    def run():
+        return agg_by_poly_index(pixels_df.copy())
+    return run, len(pixels_df)
+
+def bench_nar_overlay(fixtures):
+    from roads import nar_overlay
+    roads_file, grid_file = fixtures.roads_file(), fixtures.grid_file()
+
+    def run():
+        return nar_overlay('IA', roads_file, grid_file)
+    return run, fixtures.params['n_roads']
+
+def bench_build_iowa_winter(fixtures):
+    from salt import build_iowa_winter
+    salt_file, grid_file = fixtures.salt_storm_dates_file(), fixtures.grid_file()
+
+    def run():
+        return build_iowa_winter(salt_file, grid_file)
+    return run, fixtures.params['n_salt']
+
+def bench_join_it_iowawinter(fixtures):
+    from salt import join_it_iowawinter
+    files = fixtures.iowa_files()
+
+    def run():
+        return join_it_iowawinter(*files)
+    return run, fixtures.params['salt_rows']
+
+def bench_fit(fixtures):
+    from salt_model import total_salt_per_polygon
+    joined_file = fixtures.joined_file()
+
+    def run():
+        return total_salt_per_polygon(joined_file, MIN_SOLID)
+    return run, fixtures.params['salt_rows']
+
+def bench_predict(fixtures):
+    from salt_model import build_quarterly_storm_dataset
+    with open(fixtures.model_file(), 'rb') as f:
+        fitted_salt_model = dill.load(f)
+    snodas_file, road_features_file = fixtures.quarter_snodas_file(), fixtures.iowa_files()[2]
+
+    def run():
+        return build_quarterly_storm_dataset(fitted_salt_model, snodas_file, road_features_file, 'Q12020')
+    return run, None
+
+def bench_company_model(fixtures):
+    from salt_model import company_model
+    market_df = fixtures.market()
+
+    def run():
+        return company_model(market_df)
+    return run, len(market_df)
+
+BENCHMARKS = {
+    'grid': bench_grid,
+    'join_snodas_folder': bench_join_snodas_folder,
+    'agg_by_poly_index': bench_agg_by_poly_index,
+    'nar_overlay': bench_nar_overlay,
+    'build_iowa_winter': bench_build_iowa_winter,
+    'join_it_iowawinter': bench_join_it_iowawinter,
+    'fit': bench_fit,
+    'predict': bench_predict,
+    'company_model': bench_company_model,
+}
+
+def run_benchmark(name, scale, seed, repeat):
+    '''
+    Run one benchmark. Called in a fresh process
+    :param name: String. Key of BENCHMARKS
+    :param scale: String. Key of SCALES
+    :param seed: Int. Random seed of generators
+    :param repeat: Int. Number of timed runs
+    :return: Dictionary. Stage record in the format of profiling.py. wall_s and cpu_s are of the fastest run
+    '''
+    os.environ.pop(PROFILE_ENV, None)
+    func, rows_in = BENCHMARKS[name](Fixtures(scale, seed=seed))
+    start_rss = peak_rss_mb()
+    walls, cpus, rows_out = [], [], None
+    for _ in range(repeat):
+        start_wall, start_cpu = time.perf_counter(), time.process_time()
+        result = func()
+        walls.append(time.perf_counter() - start_wall)
+        cpus.append(time.process_time() - start_cpu)
+        rows_out = count_rows(result)
+        del result
+    best = min(range(repeat), key=walls.__getitem__)
+    return {'stage': f"{name}[{scale}]", 'parent': None, 'depth': 0, 'rows_in': rows_in, 'rows_out': rows_out,
+            'wall_s': walls[best], 'cpu_s': cpus[best], 'wall_s_all': walls, 'peak_rss_mb': peak_rss_mb(),
+            'peak_rss_growth_mb': None if start_rss is None else peak_rss_mb() - start_rss}
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCHMARK_DIR, capture_output=True,
+                              text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+def run_benchmarks(names, scales, seed=0, repeat=3, label='benchmarks',
+                   output_dir=os.path.join(BENCHMARK_DIR, 'results')):
+    '''
+    Run benchmarks at each scale and write run report
+    :param names: List. Keys of BENCHMARKS
+    :param scales: List. Keys of SCALES
+    :param seed: Int. Random seed of generators
+    :param repeat: Int. Number of timed runs of each benchmark
+    :param label: String. Label of run report
+    :param output_dir: String. Directory of run reports
+    :return: String. Path of run report
+    '''
+    context = multiprocessing.get_context('spawn')
+    started = datetime.now().isoformat(timespec='seconds')
+    stages = []
+    for scale in scales:
+        for name in names:
+            #fresh process per benchmark so peak RSS is not inherited from earlier benchmarks
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                record = executor.submit(run_benchmark, name, scale, seed, repeat).result()
+            print(f"{record['stage']:<32} {record['wall_s']:>10.3f} s {record['peak_rss_mb'] or 0:>10.1f} MB")
+            stages.append(record)
+    report = {'label': label, 'argv': sys.argv, 'started': started,
+              'finished': datetime.now().isoformat(timespec='seconds'),
+              'host': socket.gethostname(), 'cpu_count': os.cpu_count(), 'python': sys.version.split()[0],
+              'commit': git_commit(), 'seed': seed, 'repeat': repeat, 'scales': {s: SCALES[s] for s in scales},
+              'stages': stages}
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, f"{label}_{datetime.now():%Y%m%dT%H%M%S}.json")
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=1, default=str)
+    return path
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark pipeline stages on synthetic data')
+    # CLI arguments with short and long flags
+    parser.add_argument('-b', '--benchmarks', nargs='+', default=list(BENCHMARKS), choices=list(BENCHMARKS),
+                        help='Benchmarks to run')
+    parser.add_argument('-s', '--scales', nargs='+', default=['small'], choices=list(SCALES), help='Scales to run')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='Number of timed runs of each benchmark')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed of synthetic data generators')
+    parser.add_argument('-l', '--label', default='benchmarks', help='Label of run report')
+    args = parser.parse_args()
+
+    print(run_benchmarks(args.benchmarks, args.scales, args.seed, args.repeat, args.label))
@@ -0,0 +1,257 @@
+import os
+import sys
+import gzip
+import tarfile
+import numpy as np
+import pandas as pd
+import shapely
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from snodas import SNODAS_FILES
+from definitions import SNODAS_VARIABLES
+from utility import to_padded_num
+
+'''
+Deterministic synthetic data sets shaped like the pipeline's live sources (SNODAS, North American Roads, Iowa DOT
+Winter Operations), for benchmarking without network access. Every generator takes a seed; the same arguments always
+produce the same data
+'''
+SNODAS_SHAPE = (4096, 8192) #rows, columns of unmasked SNODAS grid
+SNODAS_NODATA = -9999
+
+#(low, high) of synthetic values of each SNODAS variable, in SNODAS integer units
+SNODAS_RANGES = {"solid_precip": (0, 120), "liquid_precip": (0, 60), "SWE": (0, 400), "snow_depth": (0, 900),
+                 "runoff": (0, 30), "sub_pack": (-20, 5), "sub_blow": (-10, 0), "sp_temp": (2500, 2740)}
+
+def _date_tag(date):
+    date = pd.Timestamp(date)
+    return f"{date.year}{to_padded_num(date.month)}{to_padded_num(date.day)}"
+
+def _seed(seed, *keys):
+    '''
+    Seed derived from a base seed and keys, so each (date, variable) raster is independent of generation order
+    '''
+    return [seed] + [int.from_bytes(str(k).encode(), 'little') % (2 ** 32) for k in keys]
+
+def snodas_raster(date, variable, seed=0, block=64):
+    '''
+    Synthetic SNODAS raster for one date and variable. Values are constant over blocks of block x block SNODAS polygons
+    so the raster compresses like the smooth fields of real SNODAS files. The westernmost eighth of the grid (Pacific)
+    is set to the SNODAS no-data value
+    :param date: Datetime
+    :param variable: String. SNODAS variable name
+    :param seed: Int. Random seed
+    :param block: Int. Width and height of constant blocks in SNODAS polygons
+    :return: Ndarray of int16. Shape SNODAS_SHAPE
+    '''
+    rng = np.random.default_rng(_seed(seed, _date_tag(date), variable))
+    low, high = SNODAS_RANGES[variable]
+    coarse = rng.integers(low, high, size=(SNODAS_SHAPE[0] // block, SNODAS_SHAPE[1] // block), dtype=np.int16)
+    if variable == "solid_precip":
+        #snow falls on a minority of polygons on a given day
+        coarse[rng.random(coarse.shape) < .6] = 0
+    raster = np.repeat(np.repeat(coarse, block, axis=0), block, axis=1)
+    raster[:, :SNODAS_SHAPE[1] // 8] = SNODAS_NODATA
+    return raster
+
+def write_snodas_tar(date, tar_dir, seed=0):
+    '''
+    Write SNODAS_unmasked_<date>.tar containing a big-endian int16 .dat.gz raster for each SNODAS variable, named as
+    in the NSIDC unmasked archive. Existing tar files are kept
+    :param date: Datetime
+    :param tar_dir: String. Directory of tar file
+    :param seed: Int. Random seed
+    :return: String. Path of tar file
+    '''
+    tag = _date_tag(date)
+    tar_path = os.path.join(tar_dir, f"SNODAS_unmasked_{tag}.tar")
+    if os.path.exists(tar_path):
+        return tar_path
+    os.makedirs(tar_dir, exist_ok=True)
+    with tarfile.open(tar_path + '.part', 'w') as tf:
+        for variable, (prefix, suffix) in SNODAS_FILES.items():
+            member_path = os.path.join(tar_dir, f"zz_ssmv{prefix}TNATS{tag}{suffix}.dat.gz")
+            with gzip.open(member_path, 'wb', compresslevel=1) as gf:
+                gf.write(snodas_raster(date, variable, seed).astype('>i2').tobytes())
+            tf.add(member_path, arcname=os.path.basename(member_path))
+            os.remove(member_path)
+    os.replace(tar_path + '.part', tar_path)
+    return tar_path
+
+def unpack_snodas_tar(tar_path, unpacked_dir):
+    '''
+    Unpack .dat.gz members of a SNODAS tar file into <unpacked_dir>/<date>/, the layout read by join_snodas_folder.
+    Unlike snodas_client.save_tar the tar file is kept
+    :param tar_path: String. Path of SNODAS tar file
+    :param unpacked_dir: String. Directory of unpacked SNODAS files
+    :return: String. Directory of unpacked date
+    '''
+    tag = os.path.basename(tar_path)[len("SNODAS_unmasked_"):-len(".tar")]
+    save_dir = os.path.join(unpacked_dir, tag)
+    if not os.path.exists(save_dir):
+        with tarfile.open(tar_path, 'r') as tf:
+            tf.extractall(save_dir, members=[m for m in tf.getmembers() if m.name.endswith('.dat.gz')])
+    return save_dir
+
+def _random_lines(rng, n_lines, upper_left, bottom_right, min_vertices, max_vertices, step):
+    '''
+    GeoSeries-ready array of random-walk LineStrings starting inside a bounding box
+    :param step: Float. Maximum length, in degrees, of each line segment in each direction
+    :return: Ndarray of shapely LineStrings
+    '''
+    n_vertices = rng.integers(min_vertices, max_vertices + 1, size=n_lines)
+    line_index = np.repeat(np.arange(n_lines), n_vertices)
+    starts = np.column_stack([rng.uniform(upper_left[0], bottom_right[0], n_lines),
+                              rng.uniform(bottom_right[1], upper_left[1], n_lines)])
+    steps = rng.uniform(-step, step, size=(line_index.size, 2))
+    #restart the cumulative walk at the first vertex of each line
+    first = np.r_[0, np.cumsum(n_vertices)[:-1]]
+    steps[first] = 0
+    walk = np.cumsum(steps, axis=0)
+    walk -= np.repeat(walk[first], n_vertices, axis=0)
+    coords = np.repeat(starts, n_vertices, axis=0) + walk
+    return shapely.linestrings(coords, indices=line_index)
+
+def synthetic_roads(n_roads, upper_left, bottom_right, seed=0, state="Iowa"):
+    '''
+    DataFrame shaped like a state North American Roads download: road LineStrings with CLASS and LANES
+    :param n_roads: Int. Number of roads
+    :param upper_left: Point. Upper left coordinates of coverage area
+    :param bottom_right: Point. Bottom right coordinates of coverage area
+    :param seed: Int. Random seed
+    :param state: String. Full state name
+    :return: DataFrame with geometry in wkt format
+    '''
+    rng = np.random.default_rng(_seed(seed, 'roads', n_roads))
+    lines = _random_lines(rng, n_roads, upper_left, bottom_right, 2, 12, .02)
+    return pd.DataFrame({'OBJECTID': np.arange(1, n_roads + 1), 'COUNTRY': 2, 'JURISNAME': state,
+                         'CLASS': rng.choice([1, 2, 3, 4, 5], size=n_roads, p=[.05, .05, .2, .3, .4]),
+                         'LANES': rng.choice([1, 2, 4, 6], size=n_roads, p=[.1, .6, .25, .05]).astype('float64'),
+                         'geometry': shapely.to_wkt(lines)})
+
+def synthetic_salt(n_events, upper_left, bottom_right, start, end, seed=0):
+    '''
+    DataFrame shaped like the Iowa DOT Winter Operations download: one row per plow truck pass with the salt applied
+    along a LineString. LAST_PASS is in epoch milliseconds as returned by the ArcGIS API
+    :param n_events: Int. Number of truck passes
+    :param upper_left: Point. Upper left coordinates of coverage area
+    :param bottom_right: Point. Bottom right coordinates of coverage area
+    :param start: Datetime. First day of events
+    :param end: Datetime. Last day of events
+    :param seed: Int. Random seed
+    :return: DataFrame with geometry in wkt format
+    '''
+    rng = np.random.default_rng(_seed(seed, 'salt', n_events))
+    lines = _random_lines(rng, n_events, upper_left, bottom_right, 2, 6, .01)
+    #winter days only: passes concentrate on a set of storm days
+    days = pd.date_range(start, end)
+    days = days[days.month.isin([11, 12, 1, 2, 3])]
+    storm_days = rng.choice(days.to_numpy(), size=max(1, len(days) // 6), replace=False)
+    last_pass = (rng.choice(storm_days, size=n_events).astype('datetime64[ms]')
+                 + rng.integers(0, 24 * 3600 * 1000, size=n_events).astype('timedelta64[ms]'))
+    solid = rng.gamma(2., 400., size=n_events).round(1)
+    return pd.DataFrame({'OBJECTID': np.arange(1, n_events + 1),
+                         'LAST_PASS': last_pass.astype('int64'),
+                         'QUANTITY_SOLID': solid,
+                         'TOTAL_SALT_QUANTITY': (solid * rng.uniform(1., 1.3, size=n_events)).round(1),
+                         'geometry': shapely.to_wkt(lines)})
+
+def synthetic_snodas_pixels(grid, dates, seed=0):
+    '''
+    DataFrame of SNODAS variables by SNODAS polygon, shaped like the per-day frames built in snodas.py before
+    aggregation by agg_by_poly_index
+    :param grid: Grid object
+    :param dates: Array-like of datetimes
+    :param seed: Int. Random seed
+    :return: DataFrame
+    '''
+    rng = np.random.default_rng(_seed(seed, 'pixels', len(dates)))
+    flat_size = grid.poly_index.size
+    dates = pd.DatetimeIndex(dates)
+    data_frame = pd.DataFrame({'poly_index': np.tile(grid.poly_index, len(dates)),
+                               'snodas': np.tile(grid.reference_index, len(dates)),
+                               'date': np.repeat(dates.to_numpy(), flat_size)})
+    for variable in SNODAS_VARIABLES:
+        low, high = SNODAS_RANGES[variable]
+        values = rng.integers(low, high, size=len(data_frame)).astype('int32')
+        values[rng.random(len(data_frame)) < .01] = SNODAS_NODATA
+        data_frame[variable] = values
+    return data_frame
+
+def synthetic_snodas_params(dates, poly_index, seed=0):
+    '''
+    DataFrame of SNODAS variables aggregated by Grid polygon, shaped like the output of agg_by_poly_index
+    :param dates: Array-like of datetimes
+    :param poly_index: Array-like of poly_index values
+    :param seed: Int. Random seed
+    :return: DataFrame
+    '''
+    rng = np.random.default_rng(_seed(seed, 'snodas_params', len(dates), len(poly_index)))
+    dates = pd.DatetimeIndex(dates)
+    poly_index = np.asarray(poly_index)
+    data_frame = pd.DataFrame({'date': np.repeat(dates.to_numpy(), poly_index.size),
+                               'poly_index': np.tile(poly_index, len(dates))})
+    for variable in SNODAS_VARIABLES:
+        low, high = SNODAS_RANGES[variable]
+        data_frame[variable] = rng.uniform(low, high, size=len(data_frame))
+    data_frame.loc[rng.random(len(data_frame)) < .6, 'solid_precip'] = 0.
+    return data_frame
+
+def synthetic_salt_overlay(snodas_params_df, n_rows, seed=0):
+    '''
+    DataFrame of salt by storm date and Grid polygon, shaped like the output of groupby_poly_iowawinter. Keys are
+    sampled from the (date, poly_index) keys of a SNODAS data set, excluding its first date so every storm date has a
+    previous date
+    :param snodas_params_df: DataFrame. SNODAS variables by date and poly_index
+    :param n_rows: Int. Number of rows
+    :param seed: Int. Random seed
+    :return: DataFrame
+    '''
+    rng = np.random.default_rng(_seed(seed, 'salt_overlay', n_rows))
+    keys = snodas_params_df.loc[snodas_params_df['date'] > snodas_params_df['date'].min(), ['date', 'poly_index']]
+    keys = keys.iloc[rng.choice(len(keys), size=min(n_rows, len(keys)), replace=False)]
+    solid = rng.gamma(2., 2000., size=len(keys))
+    return pd.DataFrame({'STORM_DATE': keys['date'].to_numpy(),
+                         'PREV_DATE': keys['date'].to_numpy() - np.timedelta64(1, 'D'),
+                         'poly_index': keys['poly_index'].to_numpy(),
+                         'WITHIN_POLY_SOLIDSALT': solid,
+                         'WITHIN_POLY_TOTALSALT': solid * rng.uniform(1., 1.3, size=len(keys))})
+
+def synthetic_road_features(poly_index, seed=0, state="IA"):
+    '''
+    DataFrame of road features by Grid polygon, shaped like the output of regional_nar_overlay_road_features
+    :param poly_index: Array-like of poly_index values
+    :param seed: Int. Random seed
+    :param state: String. Two-letter state abbreviation
+    :return: DataFrame
+    '''
+    rng = np.random.default_rng(_seed(seed, 'road_features', len(poly_index)))
+    poly_index = np.asarray(poly_index)
+    data_frame = pd.DataFrame({'poly_index': poly_index, 'STATE': state})
+    kms = rng.gamma(2., 20., size=(poly_index.size, 5))
+    lanes = rng.choice([1, 2, 4], size=(poly_index.size, 5))
+    data_frame['WITHIN_POLY_KMS'] = kms.sum(axis=1)
+    data_frame['WITHIN_POLY_LANE_KMS'] = (kms * lanes).sum(axis=1)
+    for n in range(1, 6):
+        data_frame[f'WITHIN_POLY_KMS_{n}'] = kms[:, n - 1]
+        data_frame[f'WITHIN_POLY_LANE_KMS_{n}'] = kms[:, n - 1] * lanes[:, n - 1]
+    return data_frame
+
+def synthetic_market(quarters, poly_index, seed=0):
+    '''
+    DataFrame shaped like the output of sales_model: predicted salt by quarter and polygon, with actual company volume
+    and distance to the closest depot
+    :param quarters: List. Quarter tags, e.g. Q12019
+    :param poly_index: Array-like of poly_index values
+    :param seed: Int. Random seed
+    :return: DataFrame
+    '''
+    rng = np.random.default_rng(_seed(seed, 'market', len(quarters), len(poly_index)))
+    poly_index = np.asarray(poly_index)
+    volume = dict(zip(quarters, rng.integers(2000, 10000, size=len(quarters))))
+    distance = dict(zip(poly_index, rng.uniform(1000., 400000., size=poly_index.size)))
+    data_frame = pd.DataFrame({'quarter': np.repeat(quarters, poly_index.size),
+                               'poly_index': np.tile(poly_index, len(quarters)),
+                               'salt': rng.gamma(1., 1e6, size=len(quarters) * poly_index.size)})
+    data_frame['volume'] = data_frame['quarter'].map(volume)
+    data_frame['min_depot_distance'] = data_frame['poly_index'].map(distance)
+    return data_frame
@@ -3,6 +3,7 @@ import streamlit as st
 from visualizations import solid_plots, salt_plots, sales_growth
 import os
 from definitions import ROOT_DIR
+from storage import read_frame, find_frame
 
 def app():
     if 'quarterly_df' not in st.session_state:
@@ -12,7 +13,8 @@ def app():
     if 'solid_df' not in st.session_state:
         st.session_state['solid_df'] = pd.read_csv(os.path.join(ROOT_DIR, 'data/processed/quarterly_solid_precip.csv'))
     if 'grid_df' not in st.session_state:
-        st.session_state['grid_df'] = pd.read_csv(os.path.join(ROOT_DIR, 'data/processed/regional_poly10_grid.csv'))
+        st.session_state['grid_df'] = read_frame(find_frame(os.path.join(ROOT_DIR,
+                                                                    'data/processed/regional_poly10_grid.csv')))
     if 'predictions' not in st.session_state:
        st.session_state['predictions'] = pd.read_csv(os.path.join(ROOT_DIR, 'models/sales_estimates.csv'))
     quarters = st.session_state.predictions[(st.session_state.predictions['quarter'] != 'Q12014') &
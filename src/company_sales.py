@@ -1,15 +1,31 @@
 import argparse
-from salt_model import sales_model, company_model
+from salt_model import sales_model, company_model, calibrate_company_model
 import os
 from definitions import ROOT_DIR
+from grid import load_depot_distance_matrix
 
-def company_sales(predictions_file, actual_sales_file, distances_file, output_file):
+def company_sales(predictions_file, actual_sales_file, distances_file, output_file, exp=-.5, cutoff=None,
+                  calibrate=False, calibration_file=None, cutoffs=(None,), distance_matrix_file=None, outside=1.,
+                  distance_column='min_depot_distance', n_boot=2000):
     '''Using salt predictions by polygon for each quarter, estimate company sales using economics gravity formula to
-    weight by distance to closest CMP depot'''
+    weight by distance to closest CMP depot. With calibrate, the distance-decay exponent and cutoff with the lowest
+    quarterly error are used, and the errors of all candidates are written to calibration_file. With
+    distance_matrix_file, polygon salt is allocated by the Huff share of every CMP depot within the cutoff. Otherwise
+    distance_column selects straight-line (min_depot_distance) or road-network (network_depot_distance) distance.
+    Bootstrap percentile bands of n_boot resamples of polygon predictions and quarters are written next to predicted'''
+    depot_distances = None
+    if distance_matrix_file:
+        depot_distances = load_depot_distance_matrix(os.path.join(ROOT_DIR, distance_matrix_file))
     sales_df = sales_model(os.path.join(ROOT_DIR, predictions_file), os.path.join(ROOT_DIR, actual_sales_file),
                            os.path.join(ROOT_DIR, distances_file))
     sales_df.to_csv('final_sales_df.csv', index=False)
-    company_model(sales_df).to_csv(os.path.join(ROOT_DIR, output_file))
+    if calibrate:
+        calibration_df = calibrate_company_model(sales_df, cutoffs=cutoffs, depot_distances=depot_distances,
+                                                 outside=outside, distance_column=distance_column)
+        if calibration_file:
+            calibration_df.to_csv(os.path.join(ROOT_DIR, calibration_file), index=False)
+        exp, cutoff = calibration_df['exp'].iloc[0], calibration_df['cutoff'].iloc[0]
+    company_model(sales_df, exp, cutoff, depot_distances, outside, distance_column, n_boot).to_csv(os.path.join(ROOT_DIR, output_file))
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Derive company estimates from market estimates')
@@ -18,10 +34,28 @@ if __name__ == "__main__":
     parser.add_argument('-p', '--predictions', help='Predictions file')
     parser.add_argument('-a', '--actualsales', help='Actual sales file')
     parser.add_argument('-d', '--distances', help='Depot distance file')
+    parser.add_argument('-e', '--exp', type=float, default=-.5,
+                        help='Negative distance-decay exponent, weights are distance ** exp')
+    parser.add_argument('-c', '--cutoff', type=float, default=None, help='Depot distance cutoff in km')
+    parser.add_argument('-cal', '--calibrate', action='store_true',
+                        help='Use the exponent and cutoff with the lowest quarterly error')
+    parser.add_argument('-cf', '--calibrationfile', default=None, help='Calibration results file')
+    parser.add_argument('-cs', '--cutoffs', type=float, nargs='+', default=None,
+                        help='Distance cutoffs in km searched by calibration, in addition to no cutoff')
+    parser.add_argument('-dm', '--distancematrix', default=None,
+                        help='Polygon x depot distance matrix file. Allocates salt by Huff share of all depots')
+    parser.add_argument('-out', '--outside', type=float, default=1.,
+                        help='Attraction of competing suppliers in the Huff share')
+    parser.add_argument('-dc', '--distancecolumn', default='min_depot_distance',
+                        choices=['min_depot_distance', 'network_depot_distance'], help='Depot distance column')
+    parser.add_argument('-b', '--bootstrap', type=int, default=2000,
+                        help='Bootstrap resamples of the 5th-95th percentile band of predicted. No band if 0')
     args = parser.parse_args()
     output_file = args.output
     predictions_file = args.predictions
     actual_sales_file = args.actualsales
     distances_file = args.distances
 
-    company_sales(predictions_file, actual_sales_file, distances_file, output_file)
\ No newline at end of file
+    company_sales(predictions_file, actual_sales_file, distances_file, output_file, args.exp, args.cutoff,
+                  args.calibrate, args.calibrationfile, (None,) + tuple(args.cutoffs or ()), args.distancematrix,
+                  args.outside, args.distancecolumn, args.bootstrap)
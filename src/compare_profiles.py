@@ -0,0 +1,51 @@
+import json
+import argparse
+import pandas as pd
+
+def stage_summary(report_file):
+    '''
+    Summarize stages of a profiling run report by stage name
+    :param report_file: String. Path of JSON run report written by profiling.write_run_report
+    :return: DataFrame. calls, wall_s, cpu_s, rows_in and rows_out are summed, peak_rss_mb is the maximum
+    '''
+    with open(report_file) as f:
+        stages = pd.DataFrame(json.load(f)['stages'])
+    if stages.empty:
+        return pd.DataFrame(columns=['calls', 'wall_s', 'cpu_s', 'peak_rss_mb', 'rows_in', 'rows_out'])
+    stages['calls'] = 1
+    return stages.groupby('stage').aggregate({'calls': 'sum', 'wall_s': 'sum', 'cpu_s': 'sum', 'peak_rss_mb': 'max',
+                                              'rows_in': 'sum', 'rows_out': 'sum'})
+
+def compare_profiles(base_file, new_file, threshold=1.1, min_seconds=0.1):
+    '''
+    Compare two profiling run reports stage by stage
+    :param base_file: String. Path of baseline run report
+    :param new_file: String. Path of new run report
+    :param threshold: Float. Ratio of new to base wall time, CPU time or peak RSS above which a stage is flagged
+    :param min_seconds: Float. Stages whose new wall time is below min_seconds are not flagged, to ignore timer noise
+    :return: DataFrame. Base and new metrics, new/base ratios and regression flag for each stage
+    '''
+    base, new = stage_summary(base_file), stage_summary(new_file)
+    comparison = base.join(new, how='outer', lsuffix='_base', rsuffix='_new')
+    for metric in ['wall_s', 'cpu_s', 'peak_rss_mb']:
+        comparison[f'{metric}_ratio'] = comparison[f'{metric}_new'] / comparison[f'{metric}_base']
+    comparison['regression'] = ((comparison[['wall_s_ratio', 'cpu_s_ratio', 'peak_rss_mb_ratio']] > threshold).any(axis=1)
+                                & (comparison['wall_s_new'] >= min_seconds))
+    return comparison.sort_values('wall_s_new', ascending=False)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare stage metrics of two profiling run reports')
+    # CLI arguments with short and long flags
+    parser.add_argument('-b', '--base', help='Baseline run report')
+    parser.add_argument('-n', '--new', help='New run report')
+    parser.add_argument('-t', '--threshold', type=float, default=1.1,
+                        help='Ratio of new to base metric above which a stage is flagged')
+    parser.add_argument('-m', '--minseconds', type=float, default=0.1,
+                        help='Minimum wall time, in seconds, of a flagged stage')
+    args = parser.parse_args()
+
+    with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'display.width', 250,
+                           'display.float_format', '{:.3f}'.format):
+        print(compare_profiles(args.base, args.new, args.threshold, args.minseconds)[
+            ['calls_base', 'calls_new', 'wall_s_base', 'wall_s_new', 'wall_s_ratio', 'cpu_s_ratio',
+             'peak_rss_mb_base', 'peak_rss_mb_new', 'peak_rss_mb_ratio', 'rows_out_new', 'regression']])
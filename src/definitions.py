@@ -38,12 +38,40 @@ NAR_CRS = "4326"
 #Link for Iowa DOT historical winter operations API
 SALT_LINK = "https://services.arcgis.com/8lRhdTsQyJpO52F1/arcgis/rest/services/Winter_Storm_Analysis_" \
             "Historic_View/FeatureServer/0/query"
+#seconds between consecutive page requests to an ArcGIS API
+ARCGIS_PAUSE = 5
+#NSIDC FTP server hosting SNODAS archive, and seconds between consecutive daily downloads
+SNODAS_FTP_HOST = "sidads.colorado.edu"
+SNODAS_FTP_PORT = 21
+SNODAS_FTP_PAUSE = 10
 IOWA_UPPER_LEFT = (-96.639704, 43.501196)
 IOWA_BOTTOM_RIGHT = (-90.140061, 40.375501)
 REGIONAL_UPPER_LEFT = (-97.239209, 49.384358)
 REGIONAL_BOTTOM_RIGHT = (-77.719519, 34.982972)
 POLY_SIZE = 10
+#version of the numbering of Grid polygons (poly_index). Version 2 numbers polygons row by row, which changed
+#poly_index of non-square grids; grids and SNODAS files built with another version are rebuilt by the pipeline
+POLY_INDEX_VERSION = 2
+#polygon sizes, in SNODAS units, of the levels of the regional grid pyramid. Each size divides the next
+PYRAMID_SIZES = (5, 10, 20)
+#width and height, in grid polygons, of the tiles of the chunked regional run
+TILE_POLYS = 256
 END_YEAR = 2022
 START_YEAR = 2014
 MIN_SOLID = 2
+#SNODAS variables aggregated by Grid polygon
+SNODAS_VARIABLES = ["solid_precip", "liquid_precip", "SWE", "snow_depth", "runoff", "sub_pack", "sub_blow", "sp_temp"]
+#lags, in days prior to storm date, of SNODAS features joined to storm rows. Lag 1 is the _PREV feature set
+SNODAS_LAGS = (1,)
+#windows, in days ending on storm date, of rolling SNODAS features: solid_precip_<w>D and freeze_thaw_<w>D
+ROLLING_WINDOWS = (3, 7)
+#snowpack average temperature (sp_temp), in K, at or above which the snowpack is isothermal, i.e. thawing. Days on which
+#sp_temp crosses this temperature are counted as freeze-thaw transitions
+THAW_SP_TEMP = 273.
+#version of the assembly of storm features from SNODAS, road and storm event files. Increase it when the features of
+#unchanged files change, so that cached predictions made with the earlier features are recomputed
+STORM_FEATURES_VERSION = 1
+#cost per meter of each North American Roads CLASS in road-network depot distances, relative to a freeway (CLASS 1).
+#Legs from a depot or polygon centroid to the closest road node are costed as the highest CLASS
+ROAD_CLASS_WEIGHTS = {1: 1., 2: 1.2, 3: 1.4, 4: 1.7, 5: 2.}
 
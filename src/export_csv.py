@@ -0,0 +1,24 @@
+import argparse
+import os
+from definitions import ROOT_DIR
+from storage import read_frame, write_frame
+
+def export_csv(input_file, output_file):
+    '''
+    Export a pipeline target, in any supported format, to csv. Geometry is exported in wkt format
+    :param input_file: String. Relative path of pipeline target
+    :param output_file: String. Relative path of output .csv file
+    :return: None
+    '''
+    write_frame(read_frame(os.path.join(ROOT_DIR, input_file)), os.path.join(ROOT_DIR, output_file))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Export a pipeline target to csv')
+    # CLI arguments with short and long flags
+    parser.add_argument('-i', '--input', help='Input file')
+    parser.add_argument('-o', '--output', help='Output .csv file')
+    args = parser.parse_args()
+    input_file = args.input
+    output_file = args.output
+
+    export_csv(input_file, output_file)
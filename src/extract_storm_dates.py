@@ -1,17 +1,24 @@
 import os
 from salt import unique_salt_dates
 import argparse
-from definitions import ROOT_DIR
+from definitions import ROOT_DIR, SNODAS_LAGS, ROLLING_WINDOWS
+from snodas_store import window_lags
 import dill
 
-def add_storm_dates(input_file, output_file):
+#days prior to each storm date covering the SNODAS lags and the rolling windows of the joined Iowa features
+LOOKBACK = max(window_lags(SNODAS_LAGS, ROLLING_WINDOWS))
+
+def add_storm_dates(input_file, output_file, lookback=LOOKBACK):
     '''
-    Extract set of unique dates, including storm dates and 1 day priors, to specify range of SNODAS variable downloads
+    Extract set of unique dates, including storm dates and lookback day priors, to specify range of SNODAS variable
+    downloads
     :param input_file: String. Relative path to file containing winter Iowa salt data with storm dates
     :param output_file: String. Relative path to output file in .pkd format
+    :param lookback: Int. Number of days prior to each storm date to include. Must cover the largest SNODAS lag and
+    the days of the largest rolling window
     :return: None
     '''
-    all_dates = unique_salt_dates(salt_input=input_file)
+    all_dates = unique_salt_dates(salt_input=input_file, lookback=lookback)
     unique_dates_path = os.path.join(ROOT_DIR, output_file)
     with open(unique_dates_path, 'wb') as f:
         dill.dump(all_dates, f)
@@ -21,8 +28,10 @@ if __name__ == "__main__":
     #input/output arguments with short and long flags
     parser.add_argument('-i', '--input', help='Input file')
     parser.add_argument('-o', '--output', help='Output file')
+    parser.add_argument('-l', '--lookback', type=int, default=LOOKBACK, help='Days prior to each storm date to include')
     args = parser.parse_args()
     output_file = args.output
     input_file = args.input
+    lookback = args.lookback
 
-    add_storm_dates(input_file, output_file)
+    add_storm_dates(input_file, output_file, lookback)
@@ -1,6 +1,9 @@
 from snodas_client import snodas_download_quarter, snodas_unpack_tar_quarter
 from definitions import ROOT_DIR, START_YEAR, END_YEAR
+from utility import configure_logging
 import argparse
+import logging
+import os
 
 def download_snodas_regional(tar_dir, unpacked_dir, start_year, end_year):
     '''
@@ -31,5 +34,7 @@ if __name__ == "__main__":
     tar_dir = args.tardir
     unpacked_dir = args.unpackeddir
 
+    configure_logging(os.path.join(ROOT_DIR, 'snodas_client.log'), logging.DEBUG)
+
     download_snodas_regional(tar_dir, unpacked_dir, start_year=START_YEAR, end_year=END_YEAR)
 
@@ -1,5 +1,9 @@
 from snodas_client import snodas_download, snodas_unpack_all
+from definitions import ROOT_DIR
+from utility import configure_logging
 import argparse
+import logging
+import os
 
 def download_snodas_winter_iowa(input_file, tar_dir, unpacked_dir):
     '''
@@ -24,5 +28,7 @@ if __name__ == "__main__":
     tar_dir = args.tardir
     unpacked_dir = args.unpackeddir
 
+    configure_logging(os.path.join(ROOT_DIR, 'snodas_client.log'), logging.DEBUG)
+
     download_snodas_winter_iowa(input_file, tar_dir, unpacked_dir)
 
@@ -1,10 +1,15 @@
 import pandas as pd
 import numpy as np
 import geopandas as gpd
-import shapely.geometry as sgeom
+import shapely
 import math
+import os
 from collections import namedtuple
 from pyproj import Geod
+from storage import read_frame, FORMATS
+from roads import road_network, network_distances
+from definitions import ROAD_CLASS_WEIGHTS
+from profiling import profiled
 
 '''
 SNODAS grid parameters: 
@@ -19,15 +24,80 @@ Iowa state grid coordinates:
 '''
 Increment = namedtuple("Increment", ['degrees', 'direction'])
 Point = namedtuple("Point", ['lon', 'lat'])
+#distances, in meters, from centroid of each grid polygon (rows) to each depot (columns)
+DepotDistances = namedtuple("DepotDistances", ['poly_index', 'centroid_lon', 'centroid_lat', 'depot_lon', 'depot_lat',
+                                               'distances'])
+#square block of Grid polygons processed as one chunk. rows and columns are slices of polygon rows and columns
+Tile = namedtuple("Tile", ['tile_id', 'rows', 'columns'])
+
+#number of polygon boxes tested against a mask at a time, bounding memory of fine Grids
+MASK_CHUNK = 2 ** 20
+
+@profiled
+def load_mask(mask_input):
+    '''
+    Mask polygon of a coverage area, the union of the geometries of a file, e.g. the boundaries of the states in the
+    market or a market footprint, in longitude and latitude. csv and parquet files are read with read_frame, other
+    vector formats (GeoJSON, shapefile, ...) with geopandas and reprojected to longitude and latitude
+    :param mask_input: String. Path of file with geometry column
+    :return: Shapely geometry
+    '''
+    if os.path.splitext(mask_input)[1].lstrip('.').lower() in FORMATS:
+        return read_frame(mask_input, geometry=True)['geometry'].unary_union
+    mask_df = gpd.read_file(mask_input)
+    if mask_df.crs is not None:
+        mask_df = mask_df.to_crs(epsg=4326)
+    return mask_df['geometry'].unary_union
+
+@profiled
+def grid_pyramid(upper_left, bottom_right, poly_sizes, mask=None):
+    '''
+    Grids of several polygon sizes over the same SNODAS polygons, from finest to coarsest. Every size divides the next
+    one, so each polygon of a level is a block of polygons of the level below and SNODAS variables and road features
+    can be reduced level by level. Grids are aligned on the coarsest size, so a level's poly_index matches the one of a
+    standalone Grid of that size only when the coarsest size is the standalone one
+    :param upper_left: Point. Upper left coordinates of coverage area
+    :param bottom_right: Point. Bottom right coordinates of coverage area
+    :param poly_sizes: Iterable of Int. Sizes of Grid polygons in SNODAS units
+    :param mask: Shapely geometry. Mask of every level. A polygon is kept if it intersects the mask, so a kept polygon
+    has a kept parent
+    :return: List of Grid objects, sorted by poly_size
+    '''
+    poly_sizes = sorted(set(poly_sizes))
+    for finer, coarser in zip(poly_sizes[:-1], poly_sizes[1:]):
+        if coarser % finer:
+            raise ValueError(f"polygon size {finer} does not divide {coarser}")
+    return [Grid(upper_left, bottom_right, poly_size, mask=mask, align=poly_sizes[-1]) for poly_size in poly_sizes]
+
+@profiled
+def save_depot_distance_matrix(depot_distances, path):
+    '''
+    Write polygon x depot distance matrix to .npz file
+    :param depot_distances: DepotDistances
+    :param path: String. Path of .npz file
+    :return: None
+    '''
+    np.savez(path, **depot_distances._asdict())
+
+@profiled
+def load_depot_distance_matrix(path):
+    '''
+    Read polygon x depot distance matrix written by save_depot_distance_matrix
+    :param path: String. Path of .npz file
+    :return: DepotDistances
+    '''
+    with np.load(path) as arrays:
+        return DepotDistances(*(arrays[field] for field in DepotDistances._fields))
 
 class Grid(object):
     '''
     Grid Class is used to create a geospatial grid over a desired coverage area. The grid coordinates align with a
     SNODAS grid, but the dimensions of every cell/polygon are poly_size times that of a SNODAS polygon
     '''
+    @profiled
     def __init__(self, upper_left, bottom_right, poly_size, reference_upper_left=Point(-130.5167, 58.2333),
                  reference_x_size=8192, reference_lat_increment=Increment(1 / 3600 * 30, -1),
-                 reference_lon_increment=Increment(1 / 3600 * 30, 1)):
+                 reference_lon_increment=Increment(1 / 3600 * 30, 1), mask=None, align=None):
         '''
         Initialize Grid object
         :param upper_left: Point. Upper left coordinates of coverage area
@@ -37,7 +107,14 @@ class Grid(object):
         :param reference_x_size: Int. Width, in polygons, of SNODAS grid
         :param reference_lat_increment: Increment. Latitudinal Increment of SNODAS grid from upper left corner
         :param reference_lon_increment: Increment. Longitudinal Increment of SNODAS grid from upper left corner
+        :param mask: Shapely geometry. Only Grid polygons intersecting mask are kept, with the poly_index they have in
+        the unmasked Grid. All Grid polygons are kept if None
+        :param align: Int. Width and height of Grid, in SNODAS polygons, are padded to a multiple of align rather than
+        of poly_size, so that Grids of every poly_size dividing align cover the same SNODAS polygons and nest into
+        each other. poly_size if None
         '''
+        if align is not None and align % poly_size:
+            raise ValueError(f"align {align} is not a multiple of poly_size {poly_size}")
         self.upper_left = upper_left
         self.bottom_right = bottom_right
         self.poly_size = poly_size
@@ -45,6 +122,8 @@ class Grid(object):
         self.reference_x_size = reference_x_size
         self.reference_lat_increment = reference_lat_increment
         self.reference_lon_increment = reference_lon_increment
+        self.mask = mask
+        self.align = align or poly_size
 
         self.reference_index = None #index of SNODAS polygons
         self.poly_index = None #index of Grid polygons
@@ -54,6 +133,9 @@ class Grid(object):
         self.x_end = None #zero-referenced horizontal ending point of Grid within SNODAS grid
         self.y_start = None #zero-referenced vertical starting point of Grid within SNODAS grid
         self.y_end = None #zero-referenced vertical ending point of Grid within SNODAS grid
+        #flat positions, within the y_height x x_width SNODAS slice of Grid, of the SNODAS polygons of kept Grid
+        #polygons. All positions if None
+        self.cells = None
 
         self._create_grid_params()
 
@@ -110,7 +192,8 @@ class Grid(object):
         '''
         Translate from SNODAS parameters into Grid parameters over desired coverage area. Create indexes.
         :return: None
-        :modifies: self.x_start, self.x_end, self.x_width, self.y_height, self.poly_index, self.reference_index
+        :modifies: self.x_start, self.x_end, self.x_width, self.y_height, self.poly_index, self.reference_index,
+        self.cells
         '''
         lat_inc = self.reference_lat_increment
         lon_inc = self.reference_lon_increment
@@ -124,14 +207,23 @@ class Grid(object):
 
         #adjust x, y starting and ending positions to ensure the dimensions are evenly divisible by polygon size and
         #and roughly centered over desired area
-        self.x_start, self.x_end = self._adjust_dimension(initial_x_start, initial_x_end, self.poly_size)
-        self.y_start, self.y_end = self._adjust_dimension(initial_y_start, initial_y_end, self.poly_size)
+        self.x_start, self.x_end = self._adjust_dimension(initial_x_start, initial_x_end, self.align)
+        self.y_start, self.y_end = self._adjust_dimension(initial_y_start, initial_y_end, self.align)
 
         self.x_width = self.x_end - self.x_start + 1
         self.y_height = self.y_end - self.y_start + 1
 
         self.poly_index = self._poly_index()
         self.reference_index = self._reference_index()
+        if self.mask is not None:
+            shapely.prepare(self.mask)
+            n_polys = np.prod(self.poly_shape())
+            kept = np.concatenate([
+                shapely.intersects(self._boxes(np.arange(start, min(start + MASK_CHUNK, n_polys)) + 1), self.mask)
+                for start in range(0, n_polys, MASK_CHUNK)])
+            self.cells = np.flatnonzero(kept[self.poly_index - 1])
+            self.poly_index = self.poly_index[self.cells]
+            self.reference_index = self.reference_index[self.cells]
 
     def _reference_index(self):
         '''
@@ -152,93 +244,199 @@ class Grid(object):
     def _poly_index(self):
         '''
         Flattended index of Grid polygons. Index is same length as reference index and is used to group SNODAS polygons
-        into Grid polygons
+        into Grid polygons. Grid polygons are numbered from 1, row by row from the upper left corner, in the same order
+        as the polygons of grid_df
         :return: ndarray.
         '''
-        pmatrix_width = self.x_width // self.poly_size
-        pmatrix_height = self.y_height // self.poly_size
-
-        count = 1
-        row = None
-        poly_matrix = None
-        for x_count in range(1, pmatrix_width + 1):
-            for y_count in range(1, pmatrix_height + 1):
-                if y_count == 1:
-                    row = np.full((self.poly_size, self.poly_size), count, dtype='int')
-                else:
-                    row = np.concatenate((row, np.full((self.poly_size, self.poly_size), count, dtype='int')), axis=1)
-                count += 1
-            if x_count == 1:
-                poly_matrix = row
-            else:
-                poly_matrix = np.concatenate((poly_matrix, row), axis=0)
-
+        poly_rows = np.arange(self.y_height) // self.poly_size
+        poly_columns = np.arange(self.x_width) // self.poly_size
+        poly_matrix = 1 + poly_rows[:, np.newaxis] * (self.x_width // self.poly_size) + poly_columns[np.newaxis, :]
         return poly_matrix.reshape(poly_matrix.size)
 
-    def grid_df(self):
+    def poly_shape(self):
         '''
-        Create DataFrame representation of Grid, including Grid geometry in wkt format, index of SNODAS polygons, and
-        index of Grid polygons
+        Number of rows and columns of Grid polygons
+        :return: (Int, Int)
         '''
-        polygons = self._polygons()
-        return pd.DataFrame({'geometry': polygons.to_wkt(), 'poly_index': pd.unique(self.poly_index)})
+        return self.y_height // self.poly_size, self.x_width // self.poly_size
 
-    def depot_distances_df(self, depot_locations_input, grid_df_input):
+    def poly_position(self, poly_index):
         '''
-        Create dataframe of distances from centroid of each grid polygon to closest CMP depot
-        :param depot_locations_input: String. Path of csv file containing coordinates of depot locations
-        :param grid_df_input: String. Path of csv file containing geometry and index of grid
-        :return: DataFrame. Columns = ['poly_index', 'min_depot_distance']
+        Row and column of Grid polygons, zero-referenced from the upper left corner
+        :param poly_index: Array-like. poly_index of Grid polygons
+        :return: (ndarray, ndarray). Rows and columns
         '''
-        depot_df = pd.read_csv(depot_locations_input)
-        depot_gdf = gpd.GeoDataFrame(depot_df, geometry=gpd.points_from_xy(depot_df.longitude, depot_df.lattitude),
-                                    crs="EPSG:4326")
-        geod = Geod(ellps="WGS84")
-        grid_df = pd.read_csv(grid_df_input)
-        grid_df['geometry'] = gpd.GeoSeries.from_wkt(grid_df['geometry'])
-        grid_gdf = gpd.GeoDataFrame(grid_df, geometry='geometry')
-        grid_gdf['centroids'] = grid_gdf['geometry'].centroid
+        return np.divmod(np.asarray(poly_index) - 1, self.x_width // self.poly_size)
 
-        grid_gdf['min_depot_distance'] = grid_gdf['centroids'].apply(lambda centroid: centroid)
+    def coarsen(self, poly_index, poly_size):
+        '''
+        poly_index of the polygons, of a Grid of a larger poly_size over the same SNODAS polygons, that contain Grid
+        polygons, e.g. the parent level of a grid pyramid
+        :param poly_index: Array-like. poly_index of Grid polygons
+        :param poly_size: Int. Size of polygons of the coarser Grid, a multiple of poly_size of Grid
+        :return: ndarray
+        '''
+        if poly_size % self.poly_size or (self.x_width % poly_size) or (self.y_height % poly_size):
+            raise ValueError(f"polygons of size {self.poly_size} do not nest into polygons of size {poly_size}")
+        factor = poly_size // self.poly_size
+        rows, columns = self.poly_position(poly_index)
+        return 1 + (rows // factor) * (self.x_width // poly_size) + columns // factor
 
-        grid_gdf['min_depot_distance'] = grid_gdf['centroids']\
-            .apply(lambda centroid: np.amin(geod.inv(lons1=np.array([centroid.x]*depot_gdf['geometry'].size),
-                                                     lats1=np.array([centroid.y]*depot_gdf['geometry'].size),
-                                                     lons2=depot_gdf['geometry'].x,
-                                                     lats2=depot_gdf['geometry'].y, return_back_azimuth=False)[2]))
+    def locate(self, lon, lat):
+        '''
+        Row and column of the Grid polygons containing points, zero-referenced from the upper left corner. Points
+        outside of Grid get rows or columns outside of poly_shape()
+        :param lon: Array-like. Longitudes
+        :param lat: Array-like. Latitudes
+        :return: (ndarray, ndarray). Rows and columns
+        '''
+        lons, lats = self._edges()
+        rows = np.floor((np.asarray(lat) - lats[0]) / (lats[1] - lats[0])).astype('int64')
+        columns = np.floor((np.asarray(lon) - lons[0]) / (lons[1] - lons[0])).astype('int64')
+        return rows, columns
 
-        return pd.DataFrame({'poly_index': grid_gdf['poly_index'],
-                             'min_depot_distance': grid_gdf['min_depot_distance']})
+    def tiles(self, tile_polys):
+        '''
+        Split Grid into square tiles of polygons, numbered from 0 row by row from the upper left corner. Tiles of the
+        last row and column are cut at the Grid boundary
+        :param tile_polys: Int. Width and height of a tile, in Grid polygons
+        :return: List of Tile
+        '''
+        poly_rows, poly_columns = self.poly_shape()
+        corners = [(row, column) for row in range(0, poly_rows, tile_polys)
+                   for column in range(0, poly_columns, tile_polys)]
+        return [Tile(tile_id, slice(row, min(row + tile_polys, poly_rows)),
+                     slice(column, min(column + tile_polys, poly_columns)))
+                for tile_id, (row, column) in enumerate(corners)]
+
+    def tile_poly_index(self, tile):
+        '''
+        poly_index of the Grid polygons of a tile, sorted. Polygons left out by the mask are not included
+        :param tile: Tile
+        :return: ndarray
+        '''
+        rows = np.arange(tile.rows.start, tile.rows.stop)
+        columns = np.arange(tile.columns.start, tile.columns.stop)
+        poly_index = (1 + rows[:, np.newaxis] * (self.x_width // self.poly_size) + columns[np.newaxis, :]).reshape(-1)
+        if self.mask is not None:
+            poly_index = poly_index[np.isin(poly_index, self.poly_index)]
+        return poly_index
+
+    @profiled
+    def grid_df(self, poly_index=None):
+        '''
+        Create DataFrame representation of Grid, including Grid geometry in wkt format, index of SNODAS polygons, and
+        index of Grid polygons
+        :param poly_index: Array-like. poly_index of the polygons included, e.g. tile_poly_index. All polygons of
+        Grid if None
+        '''
+        poly_index = pd.unique(self.poly_index) if poly_index is None else np.asarray(poly_index)
+        polygons = self._polygons(poly_index)
+        return pd.DataFrame({'geometry': polygons.to_wkt(), 'poly_index': poly_index})
 
-    def _polygons(self):
+    @profiled
+    def depot_distance_matrix(self, depot_locations_input, grid_df_input, cache_file=None):
         '''
-        Create GeoSeries of Grid polygons
-        :return: GeoSeries. Grid polygons
+        Geodesic distances from centroid of each grid polygon to every CMP depot, computed in one broadcasted Geod.inv
+        call. With cache_file, distances to depots already in the cache are reused, so only the columns of added
+        depots are computed, and the updated matrix is written back to the cache
+        :param depot_locations_input: String. Path of csv file containing coordinates of depot locations
+        :param grid_df_input: String. Path of csv file containing geometry and index of grid
+        :param cache_file: String. Path of .npz cache of distance matrix. Not cached if None
+        :return: DepotDistances. distances has shape (number of polygons, number of depots), in meters
+        '''
+        depot_df = read_frame(depot_locations_input)
+        depot_lon = depot_df['longitude'].to_numpy(dtype='float64')
+        depot_lat = depot_df['lattitude'].to_numpy(dtype='float64')
+        grid_gdf = read_frame(grid_df_input, schema='grid', geometry=True)
+        centroids = grid_gdf['geometry'].centroid
+        centroid_lon, centroid_lat = centroids.x.to_numpy(), centroids.y.to_numpy()
+
+        distances = np.full((centroid_lon.size, depot_lon.size), np.nan)
+        if cache_file is not None and os.path.exists(cache_file):
+            cached = load_depot_distance_matrix(cache_file)
+            if np.array_equal(cached.centroid_lon, centroid_lon) and np.array_equal(cached.centroid_lat, centroid_lat):
+                cached_columns = {depot: j for j, depot in enumerate(zip(cached.depot_lon, cached.depot_lat))}
+                for j, depot in enumerate(zip(depot_lon, depot_lat)):
+                    if depot in cached_columns:
+                        distances[:, j] = cached.distances[:, cached_columns[depot]]
+
+        missing = np.flatnonzero(np.isnan(distances).all(axis=0))
+        if missing.size:
+            geod = Geod(ellps="WGS84")
+            distances[:, missing] = geod.inv(lons1=np.repeat(centroid_lon, missing.size),
+                                             lats1=np.repeat(centroid_lat, missing.size),
+                                             lons2=np.tile(depot_lon[missing], centroid_lon.size),
+                                             lats2=np.tile(depot_lat[missing], centroid_lon.size),
+                                             return_back_azimuth=False)[2].reshape(centroid_lon.size, missing.size)
+
+        depot_distances = DepotDistances(grid_gdf['poly_index'].to_numpy(), centroid_lon, centroid_lat, depot_lon,
+                                         depot_lat, distances)
+        if cache_file is not None and missing.size:
+            save_depot_distance_matrix(depot_distances, cache_file)
+        return depot_distances
+
+    @profiled
+    def depot_distances_df(self, depot_locations_input, grid_df_input, cache_file=None, road_inputs=None,
+                           class_weights=ROAD_CLASS_WEIGHTS):
+        '''
+        Create dataframe of distances from centroid of each grid polygon to closest CMP depot. With road_inputs, the
+        road-network distance to the closest depot is added, from one multi-source shortest path search over the road
+        graph of all states
+        :param depot_locations_input: String. Path of csv file containing coordinates of depot locations
+        :param grid_df_input: String. Path of csv file containing geometry and index of grid
+        :param cache_file: String. Path of .npz cache of polygon x depot distance matrix. Not cached if None
+        :param road_inputs: List. Paths of files containing state NAR road data. No network distance if None
+        :param class_weights: Dictionary. keys = road CLASS, values = cost per meter relative to a freeway
+        :return: DataFrame. Columns = ['poly_index', 'min_depot_distance'], and 'network_depot_distance' in
+        CLASS-weighted meters with road_inputs. Network distance is NaN for polygons no depot reaches
+        '''
+        depot_distances = self.depot_distance_matrix(depot_locations_input, grid_df_input, cache_file)
+        depot_distances_df = pd.DataFrame({'poly_index': depot_distances.poly_index,
+                                           'min_depot_distance': depot_distances.distances.min(axis=1)})
+        if road_inputs:
+            distance = network_distances(road_network(road_inputs, class_weights), depot_distances.depot_lon,
+                                         depot_distances.depot_lat, depot_distances.centroid_lon,
+                                         depot_distances.centroid_lat, max(class_weights.values()))
+            depot_distances_df['network_depot_distance'] = np.where(np.isinf(distance), np.nan, distance)
+        return depot_distances_df
+
+    def _edges(self):
+        '''
+        Longitudes of the edges of Grid polygon columns and latitudes of the edges of Grid polygon rows
+        :return: (ndarray, ndarray). Edges from the upper left corner, one more than polygon columns and rows
         '''
         lat_inc = self.reference_lat_increment
         lon_inc = self.reference_lon_increment
-
-        boxes = None
         # upp left point of area that will be gridded (likely bigger than the mapped area)
-
         upp_left = Point(lon=self.reference_upper_left.lon + self.x_start * lon_inc.degrees * lon_inc.direction,
                          lat=self.reference_upper_left.lat + self.y_start * lat_inc.degrees * lat_inc.direction)
 
-        max_lat = upp_left.lat
-        min_lat = max_lat + lat_inc.degrees * lat_inc.direction * self.poly_size
-
-        for y in range(self.y_height // self.poly_size):
-            min_lon = upp_left.lon
-            max_lon = min_lon + lon_inc.degrees * lon_inc.direction * self.poly_size
-            for x in range(self.x_width // self.poly_size):
-                if boxes is None:
-                    boxes = gpd.GeoSeries(sgeom.box(min_lon, min_lat, max_lon, max_lat), name='geometry')
-                else:
-                    boxes = pd.concat([boxes, gpd.GeoSeries(sgeom.box(min_lon, min_lat, max_lon, max_lat),
-                                                            name='geometry')], ignore_index=True)
-                min_lon = max_lon
-                max_lon = min_lon + lon_inc.degrees * lon_inc.direction * self.poly_size
-            max_lat = min_lat
-            min_lat = max_lat + lat_inc.degrees * lat_inc.direction * self.poly_size
-
-        return boxes
+        #polygon edges, accumulated one polygon at a time from the upper left point
+        poly_rows, poly_columns = self.poly_shape()
+        lons = np.add.accumulate(np.concatenate(([upp_left.lon], np.full(poly_columns, lon_inc.degrees *
+                                                                         lon_inc.direction * self.poly_size))))
+        lats = np.add.accumulate(np.concatenate(([upp_left.lat], np.full(poly_rows, lat_inc.degrees *
+                                                                         lat_inc.direction * self.poly_size))))
+        return lons, lats
+
+    def _boxes(self, poly_index=None):
+        '''
+        Boxes of Grid polygons, masked or not
+        :param poly_index: Array-like. poly_index of polygons. All polygons of the unmasked Grid if None
+        :return: Ndarray of shapely Polygons, in the order of poly_index
+        '''
+        lons, lats = self._edges()
+        if poly_index is None:
+            poly_index = np.arange(np.prod(self.poly_shape())) + 1
+        row, column = self.poly_position(poly_index)
+        return shapely.box(lons[column], lats[row + 1], lons[column + 1], lats[row])
+
+    def _polygons(self, poly_index=None):
+        '''
+        Create GeoSeries of Grid polygons
+        :param poly_index: Array-like. poly_index of polygons. pd.unique(self.poly_index) if None
+        :return: GeoSeries. Grid polygons, in the order of poly_index
+        '''
+        return gpd.GeoSeries(self._boxes(pd.unique(self.poly_index) if poly_index is None else poly_index),
+                             name='geometry')
@@ -0,0 +1,234 @@
+import argparse
+import os
+import glob
+import json
+import logging
+import numpy as np
+import pandas as pd
+from definitions import ROOT_DIR, REGIONAL_UPPER_LEFT, REGIONAL_BOTTOM_RIGHT, POLY_SIZE, MIN_SOLID, SNODAS_LAGS
+from grid import Grid, Point, load_mask
+from snodas import snodas_day_with_poly_index
+from snodas_client import snodas_download_day, save_tar
+from salt_model import load_salt_model, model_features, storm_cell_predictions, sales_model, company_model, \
+    lead_in_rows
+from snodas_store import rolling_windows, window_lags
+from storage import read_frame, write_frame, find_frame
+from utility import quarters_of_date, quarter_dates, configure_logging
+from profiling import profiled
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE = 'index.json'
+
+class RunningQuarter(object):
+    '''
+    RunningQuarter holds the nowcast state of an in-progress quarter in <nowcast_dir>/<quarter>/: the SNODAS rows and
+    storm cell predictions of every ingested day, one file per day, and the running salt total by polygon. Ingesting a
+    day adds its predictions to the running total; ingesting a day again replaces its earlier contribution
+    '''
+    def __init__(self, nowcast_dir, quarter, poly_index):
+        '''
+        Initialize RunningQuarter object
+        :param nowcast_dir: String. Path of nowcast directory holding one directory per quarter
+        :param quarter: String. Quarter tag, e.g. Q12024
+        :param poly_index: Array-like. poly_index of every polygon of the regional road features
+        '''
+        self.nowcast_dir = nowcast_dir
+        self.quarter = quarter
+        self.directory = os.path.join(nowcast_dir, quarter)
+        for sub_dir in ('snodas', 'salt'):
+            os.makedirs(os.path.join(self.directory, sub_dir), exist_ok=True)
+        self.index = {'days': {}}
+        if os.path.exists(os.path.join(self.directory, INDEX_FILE)):
+            with open(os.path.join(self.directory, INDEX_FILE)) as f:
+                self.index = json.load(f)
+        self.totals_file = os.path.join(self.directory, f"salt_predictions_{quarter}.csv")
+        if os.path.exists(self.totals_file):
+            self.totals = read_frame(self.totals_file, schema='salt_predictions')
+        else:
+            self.totals = pd.DataFrame({'quarter': quarter, 'poly_index': np.sort(np.asarray(poly_index)),
+                                        'salt': 0.})
+
+    def lag_frames(self, date, lags, snodas_input=None):
+        '''
+        SNODAS rows of the lagged days of a date. Days ingested into any quarter of the nowcast directory are read from
+        their day files. Other days are read from the quarterly SNODAS file of the quarter, or, for days before its
+        window, from the Q4 file of the prior year, see lead_in_rows. Days found in neither are logged, and their
+        lagged features are missing
+        :param date: Datetime
+        :param lags: Tuple. Lags, in days prior to date
+        :param snodas_input: String. Path of quarterly SNODAS file of the quarter. Only ingested days are read if None
+        :return: List. DataFrames of SNODAS variables by date and poly_index
+        '''
+        frames, missing = [], []
+        for lag in lags:
+            day = date - pd.Timedelta(days=lag)
+            files = glob.glob(os.path.join(self.nowcast_dir, '*', 'snodas', f"{day:%Y-%m-%d}.csv"))
+            if files:
+                frames.append(read_frame(files[0], schema='snodas_params'))
+            else:
+                missing.append(day)
+        if missing and snodas_input:
+            start = pd.Timestamp(quarter_dates(self.quarter)[0])
+            if os.path.exists(snodas_input) and max(missing) >= start:
+                frames.append(read_frame(snodas_input, schema='snodas_params',
+                                         filters=[('date', 'in', [day for day in missing if day >= start])]))
+            if min(missing) < start:
+                lead_in_df = lead_in_rows(snodas_input, tuple(int((start - day).days) for day in missing))
+                frames.append(lead_in_df[lead_in_df['date'].isin(missing)])
+            found = set(pd.concat(frames, ignore_index=True)['date']) if frames else set()
+            missing = [day for day in missing if day not in found]
+        if missing:
+            logger.warning(f"{date:%Y-%m-%d}: lagged days {', '.join(f'{day:%Y-%m-%d}' for day in missing)} are "
+                           f"neither ingested nor in the quarterly SNODAS files, their lagged features are missing")
+        return frames
+
+    def _add(self, day_predictions, sign):
+        #storm cells of polygons without road features are left out of the total, as in the quarterly predictions
+        poly_index = self.totals['poly_index'].to_numpy()
+        position = np.searchsorted(poly_index, day_predictions['poly_index'].to_numpy())
+        found = position < poly_index.size
+        found[found] = poly_index[position[found]] == day_predictions['poly_index'].to_numpy()[found]
+        salt = self.totals['salt'].to_numpy(dtype='float64', copy=True)
+        np.add.at(salt, position[found], sign * day_predictions['salt'].to_numpy(dtype='float64')[found])
+        self.totals['salt'] = salt
+
+    def add_snodas_day(self, date, snodas_day_df):
+        '''
+        Store SNODAS rows of a day only, e.g. as lag days of a quarter already complete in the quarterly predictions
+        :param date: Datetime
+        :param snodas_day_df: DataFrame. SNODAS variables of the day by poly_index
+        :return: None
+        '''
+        write_frame(snodas_day_df, os.path.join(self.directory, 'snodas', f"{date:%Y-%m-%d}.csv"),
+                    schema='snodas_params')
+
+    def add_day(self, date, snodas_day_df, day_predictions):
+        '''
+        Store SNODAS rows and storm cell predictions of a day and add the predictions to the running total
+        :param date: Datetime
+        :param snodas_day_df: DataFrame. SNODAS variables of the day by poly_index
+        :param day_predictions: DataFrame. Columns = ['poly_index', 'salt'], storm cells of the day
+        :return: None
+        '''
+        day = f"{date:%Y-%m-%d}"
+        salt_file = os.path.join(self.directory, 'salt', f"{day}.csv")
+        if day in self.index['days']:
+            self._add(read_frame(salt_file), -1)
+        self.add_snodas_day(date, snodas_day_df)
+        write_frame(day_predictions, salt_file)
+        self._add(day_predictions, 1)
+        write_frame(self.totals, self.totals_file, schema='salt_predictions')
+        self.index['days'][day] = {'storm_cells': len(day_predictions)}
+        with open(os.path.join(self.directory, INDEX_FILE), 'w') as f:
+            json.dump(self.index, f, indent=1, sort_keys=True)
+
+@profiled
+def nowcast(date, fitted_salt_model_path, roads_overlay_input, predictions_file, actual_sales_file, distances_file,
+            output_file, nowcast_dir='data/interim/nowcast', snodas_dir='data/raw/snodas_params',
+            snodas_directory='data/interim', download=False,
+            tar_dir='data/raw/snodas_tar_files', min_solid_precip=MIN_SOLID, lags=SNODAS_LAGS, exp=-.5, cutoff=None,
+            n_boot=2000, upper_left=REGIONAL_UPPER_LEFT, bottom_right=REGIONAL_BOTTOM_RIGHT, poly_size=POLY_SIZE,
+            mask_file=None):
+    '''
+    Ingest one SNODAS day into the running quarter and refresh company estimates. Only the day is aggregated onto the
+    regional grid and only its storm cells are predicted; their salt is added to the running total of the quarter,
+    which replaces the quarter in the quarterly salt predictions before company_model is refit. Days in the windows of
+    both Q4 and the following Q1 (12/31 and 01/01) are added to the running total of the quarter in progress only; a
+    quarter already complete in the quarterly salt predictions keeps its predictions, and the day is stored under it
+    as a lag day only
+    :param date: String or Datetime. Day ingested
+    :param fitted_salt_model_path: String. Relative path of fitted salt model .pkd file
+    :param roads_overlay_input: String. Relative path of regional road features file
+    :param predictions_file: String. Relative path of quarterly salt predictions of completed quarters
+    :param actual_sales_file: String. Relative path of actual sales file
+    :param distances_file: String. Relative path of depot distances file
+    :param output_file: String. Relative path of nowcast sales estimates
+    :param nowcast_dir: String. Relative path of nowcast directory
+    :param snodas_dir: String. Relative path of directory of unpacked SNODAS files
+    :param snodas_directory: String. Relative directory of quarterly regional SNODAS files, read for lagged days not
+    ingested
+    :param download: Boolean. Download and unpack the SNODAS files of the day first
+    :param tar_dir: String. Relative path of directory of SNODAS tar files
+    :param min_solid_precip: Int. Minimum amount of solid precipitation per day per polygon
+    :param lags: Tuple. Lags, in days, of SNODAS features
+    :param exp: Float. Negative distance-decay exponent of company_model
+    :param cutoff: Float. Depot distance cutoff of company_model in km. No cutoff if None
+    :param n_boot: Int. Bootstrap resamples of the percentile bands of company_model. No bands if 0
+    :param upper_left: Tuple. Upper left coordinates of regional grid
+    :param bottom_right: Tuple. Bottom right coordinates of regional grid
+    :param poly_size: Int. Size of grid polygon dimensions in SNODAS units
+    :param mask_file: String. Relative path of mask polygon file of the regional grid. No mask if None
+    :return: DataFrame. Output of company_model
+    '''
+    date = pd.Timestamp(date)
+    quarters = quarters_of_date(date)
+    if not quarters:
+        raise ValueError(f"{date:%Y-%m-%d} is outside the Q1 and Q4 SNODAS windows")
+    if download:
+        snodas_download_day(date.year, date.day, date.month, tar_dir)
+        save_tar(date.year, date.day, date.month, tar_dir, snodas_dir)
+
+    mask = load_mask(os.path.join(ROOT_DIR, mask_file)) if mask_file else None
+    regional_grid = Grid(Point(*upper_left), Point(*bottom_right), poly_size, mask=mask)
+    snodas_day_df = snodas_day_with_poly_index(regional_grid, date, snodas_dir)
+    roads_df = read_frame(os.path.join(ROOT_DIR, roads_overlay_input), schema='road_features')
+    running = [RunningQuarter(os.path.join(ROOT_DIR, nowcast_dir), quarter, roads_df['poly_index'])
+               for quarter in quarters]
+    fitted_salt_model = load_salt_model(os.path.join(ROOT_DIR, fitted_salt_model_path))
+    #prior days of the lags and of the rolling windows of the model's features
+    prior_lags = [lag for lag in window_lags(lags, rolling_windows(model_features(fitted_salt_model))) if lag]
+    snodas_input = find_frame(os.path.join(ROOT_DIR, snodas_directory,
+                                           f"snodas_params_regional_poly{poly_size}_{running[0].quarter}.csv"))
+    day_predictions = storm_cell_predictions(fitted_salt_model, snodas_day_df,
+                                             running[0].lag_frames(date, prior_lags, snodas_input), roads_df,
+                                             min_solid_precip, lags)
+    predictions_df = read_frame(os.path.join(ROOT_DIR, predictions_file), schema='salt_predictions')
+    completed = set(predictions_df['quarter'])
+    in_progress = [running_quarter for running_quarter in running if running_quarter.quarter not in completed]
+    for running_quarter in running:
+        if running_quarter.quarter in completed:
+            running_quarter.add_snodas_day(date, snodas_day_df)
+            logger.info(f"{date:%Y-%m-%d}: {running_quarter.quarter} is complete in the quarterly salt predictions, "
+                        f"day stored as lag day only")
+            continue
+        running_quarter.add_day(date, snodas_day_df, day_predictions)
+        logger.info(f"{date:%Y-%m-%d}: {len(day_predictions)} storm cells, {day_predictions['salt'].sum():.0f} salt "
+                    f"added to {running_quarter.quarter} ({len(running_quarter.index['days'])} days ingested)")
+
+    #completed quarters, with the running totals of the quarters in progress
+    market_file = os.path.join(ROOT_DIR, nowcast_dir, 'market_salt_predictions.csv')
+    write_frame(pd.concat([predictions_df] + [running_quarter.totals for running_quarter in in_progress],
+                          ignore_index=True), market_file, schema='salt_predictions')
+    company_df = company_model(sales_model(market_file, os.path.join(ROOT_DIR, actual_sales_file),
+                                           os.path.join(ROOT_DIR, distances_file)), exp, cutoff, n_boot=n_boot)
+    company_df.to_csv(os.path.join(ROOT_DIR, output_file))
+    return company_df
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Ingest the latest SNODAS day into the running quarter and refresh '
+                                                 'company sales estimates')
+    # CLI arguments with short and long flags
+    parser.add_argument('-d', '--date', default=None, help='Day ingested, yyyy-mm-dd. Defaults to yesterday')
+    parser.add_argument('-dl', '--download', action='store_true', help='Download and unpack SNODAS files of the day')
+    parser.add_argument('-s', '--saltmodelfile', help='Fitted salt model file path')
+    parser.add_argument('-r', '--roadoverlayfile', help='Regional road features file')
+    parser.add_argument('-p', '--predictions', help='Quarterly salt predictions file')
+    parser.add_argument('-a', '--actualsales', help='Actual sales file')
+    parser.add_argument('-ds', '--distances', help='Depot distance file')
+    parser.add_argument('-o', '--output', help='Output file')
+    parser.add_argument('-n', '--nowcastdir', default='data/interim/nowcast', help='Nowcast directory')
+    parser.add_argument('-sd', '--snodasdirectory', default='data/interim',
+                        help='Directory of quarterly SNODAS files read for lagged days not ingested')
+    parser.add_argument('-m', '--mask', default=None, help='Mask polygon file of the regional grid')
+    parser.add_argument('-e', '--exp', type=float, default=-.5,
+                        help='Negative distance-decay exponent, weights are distance ** exp')
+    parser.add_argument('-b', '--bootstrap', type=int, default=2000,
+                        help='Bootstrap resamples of the 5th-95th percentile band of predicted. No band if 0')
+    args = parser.parse_args()
+    configure_logging()
+
+    date = args.date or pd.Timestamp.today().normalize() - pd.Timedelta(days=1)
+    print(nowcast(date, args.saltmodelfile, args.roadoverlayfile, args.predictions, args.actualsales, args.distances,
+                  args.output, args.nowcastdir, snodas_directory=args.snodasdirectory, download=args.download,
+                  exp=args.exp, n_boot=args.bootstrap, mask_file=args.mask))
@@ -0,0 +1,427 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+import multiprocessing
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from definitions import ROOT_DIR, STATES, STATE_BREVS, START_YEAR, END_YEAR, POLY_SIZE, MIN_SOLID, SNODAS_LAGS, \
+    ROLLING_WINDOWS, PYRAMID_SIZES, POLY_INDEX_VERSION, NAR_LINK, NAR_CRS, SALT_LINK, IOWA_UPPER_LEFT, IOWA_BOTTOM_RIGHT, REGIONAL_UPPER_LEFT, REGIONAL_BOTTOM_RIGHT
+from utility import file_hash
+from snodas_store import window_lags
+from profiling import write_run_report
+
+'''
+Python runner for the pipeline described in the Makefile. Targets are modeled as a DAG over the existing get_*/save_*
+functions. A target is rebuilt only when one of its outputs is missing or when the content hash of its inputs and
+parameters differs from the hash recorded at its last build. Independent targets (per-state overlays, per-quarter
+SNODAS data sets) run in parallel on a pool of worker processes that are forked from the runner, so geopandas and
+sklearn are imported once rather than once per target.
+'''
+#import pipeline stages before the worker pool is forked
+import get_state_roads_data
+import get_winter_iowa_data
+import storm_dates
+import extract_storm_dates
+import get_snodas_data_winter_iowa
+import get_regional_snodas
+import save_iowa_grid
+import save_overlay_iowa_winter
+import save_winter_iowa_snodas
+import save_winter_iowa_road_overlay
+import save_winter_iowa_joined
+import fit_salt_model
+import save_regional_grid
+import save_depot_distances
+import save_regional_snodas
+import save_state_road_overlays
+import save_regional_road_overlay
+import save_regional_pyramid
+import save_quarterly_salt_predictions
+import company_sales
+import quarterly_solid_precip
+import storm_events
+
+STATE_FILE = 'data/interim/pipeline_state.json'
+
+#versions of a target are hashed with its parameters, so that targets written by code with another version of, e.g.,
+#the poly_index numbering are rebuilt even though their inputs and parameters are unchanged
+Target = namedtuple("Target", ['name', 'outputs', 'inputs', 'func', 'kwargs', 'versions'], defaults=(None,))
+
+#versions of targets numbering SNODAS cells into Grid polygons. Downstream targets are rebuilt through the changed
+#content of their inputs
+POLY_INDEX = {'poly_index': POLY_INDEX_VERSION}
+
+def touch_after(func, marker, **kwargs):
+    '''
+    Run func and then touch a marker file. Used for download targets that have no single output file
+    :param func: Function
+    :param marker: String. Relative path of marker file
+    :param kwargs: keyword arguments passed to func
+    :return: None
+    '''
+    func(**kwargs)
+    with open(os.path.join(ROOT_DIR, marker), 'a'):
+        os.utime(os.path.join(ROOT_DIR, marker), None)
+
+def build_targets(fmt='csv', states=None, start_year=START_YEAR, end_year=END_YEAR, poly_size=POLY_SIZE,
+                  mask_file=None, pyramid_sizes=PYRAMID_SIZES):
+    '''
+    Create the targets of the pipeline. Paths, dependencies and parameters mirror the Makefile
+    :param fmt: String. File format of intermediate targets in data/interim and data/processed
+    :param states: List. States in CMP's market, with spaces replaced by underscores
+    :param start_year: Int. First year of quarterly coverage
+    :param end_year: Int. Last year of quarterly coverage
+    :param poly_size: Int. Size of grid polygon dimensions in SNODAS units
+    :param mask_file: String. Relative path of mask polygon file of the regional grid and SNODAS. No mask if None
+    :param pyramid_sizes: Tuple. Polygon sizes of the levels of the regional grid pyramid in data/interim/pyramid
+    :return: Dictionary. keys = target name, values = Target
+    '''
+    masks = [mask_file] if mask_file else []
+    states = states or [s.replace(" ", "_") for s in STATES]
+    years = range(start_year, end_year + 1)
+    quarters = [f"Q1{year}" for year in years] + [f"Q4{year}" for year in years]
+
+    salt_raw = 'data/raw/winter_iowa_salt_data.csv'
+    salt_dates = f'data/interim/winter_iowa_salt_data_with_stormdates.{fmt}'
+    unique_dates = 'data/interim/winter_iowa_unique_dates.pkd'
+    iowa_download = 'winter_iowa_snodas_download_file'
+    iowa_grid = f'data/processed/iowa_poly{poly_size}_grid.{fmt}'
+    salt_overlay = f'data/interim/winter_iowa_overlay_saltbypoly.{fmt}'
+    iowa_snodas = f'data/interim/winter_iowa_snodas_params_poly{poly_size}.{fmt}'
+    iowa_roads = f'data/interim/winter_iowa_road_overlay.{fmt}'
+    iowa_joined = f'data/processed/winter_iowa_joined.{fmt}'
+    salt_model = 'models/fitted_salt_model.pkd'
+    regional_grid = f'data/processed/regional_poly{poly_size}_grid.{fmt}'
+    depot_distances = f'data/interim/depot_distances.{fmt}'
+    regional_download = 'regional_snodas_download_file'
+    regional_roads = f'data/interim/regional_road_overlay.{fmt}'
+    predictions = 'models/quarterly_salt_predictions.csv'
+
+    def roads_raw(state):
+        return f'data/raw/roads_data_{state}.csv'
+
+    def state_overlay(state):
+        return f'data/interim/regional_poly_{poly_size}_road_overlay_{state}.{fmt}'
+
+    def quarterly_snodas(quarter):
+        return f'data/interim/snodas_params_regional_poly{poly_size}_{quarter}.{fmt}'
+
+    targets = [
+        Target('winter_iowa_salt_data', [salt_raw], [], get_winter_iowa_data.download_winter_iowa_data,
+               dict(link=SALT_LINK, filename=salt_raw)),
+        Target('storm_dates', [salt_dates], [salt_raw], storm_dates.add_storm_dates,
+               dict(input_file=salt_raw, output_file=salt_dates)),
+        Target('date_range', [unique_dates], [salt_dates], extract_storm_dates.add_storm_dates,
+               dict(input_file=salt_dates, output_file=unique_dates,
+                    lookback=max(window_lags(SNODAS_LAGS, ROLLING_WINDOWS)))),
+        Target('winter_iowa_snodas_download_file', [iowa_download], [unique_dates], touch_after,
+               dict(func=get_snodas_data_winter_iowa.download_snodas_winter_iowa, marker=iowa_download,
+                    input_file=unique_dates, tar_dir='data/raw/snodas_tar_files',
+                    unpacked_dir='data/raw/snodas_params')),
+        Target('winter_iowa_grid', [iowa_grid], [], save_iowa_grid.save_iowa_grid,
+               dict(output_file=iowa_grid, upper_left=IOWA_UPPER_LEFT, bottom_right=IOWA_BOTTOM_RIGHT,
+                    poly_size=poly_size), POLY_INDEX),
+        Target('winter_iowa_overlay', [salt_overlay], [salt_dates, iowa_grid],
+               save_overlay_iowa_winter.save_overlay_winter_iowa,
+               dict(output_file=salt_overlay, salt_file=salt_dates, grid_file=iowa_grid)),
+        Target('winter_iowa_snodas_params', [iowa_snodas], [iowa_download, unique_dates],
+               save_winter_iowa_snodas.save_winter_iowa_snodas,
+               dict(upper_left=IOWA_UPPER_LEFT, bottom_right=IOWA_BOTTOM_RIGHT, poly_size=poly_size,
+                    date_file=unique_dates, output_file=iowa_snodas), POLY_INDEX),
+        Target('winter_iowa_road_overlay', [iowa_roads], [roads_raw('Iowa'), iowa_grid],
+               save_winter_iowa_road_overlay.save_winter_iowa_road_overlay,
+               dict(road_file=roads_raw('Iowa'), grid_file=iowa_grid, output_file=iowa_roads)),
+        Target('winter_iowa_joined', [iowa_joined], [salt_overlay, iowa_snodas, iowa_roads],
+               save_winter_iowa_joined.save_winter_iowa_joined,
+               dict(salt_file=salt_overlay, snodas_file=iowa_snodas, roads_file=iowa_roads, output_file=iowa_joined,
+                    lags=SNODAS_LAGS, windows=ROLLING_WINDOWS)),
+        Target('fit_salt_model', [salt_model], [iowa_joined], fit_salt_model.fit_salt_model,
+               dict(winter_iowa_salt_data_path=iowa_joined, output_file=salt_model, min_solid=MIN_SOLID)),
+        Target('regional_grid', [regional_grid], masks, save_regional_grid.save_regional_grid,
+               dict(output_file=regional_grid, upper_left=REGIONAL_UPPER_LEFT, bottom_right=REGIONAL_BOTTOM_RIGHT,
+                    poly_size=poly_size, mask_file=mask_file), POLY_INDEX),
+        Target('depot_distances', [depot_distances],
+               [regional_grid, 'data/raw/salt_depots.csv'] + [roads_raw(state) for state in states],
+               save_depot_distances.save_depot_distances,
+               dict(depot_file='data/raw/salt_depots.csv', grid_file=regional_grid, output_file=depot_distances,
+                    upper_left=REGIONAL_UPPER_LEFT, bottom_right=REGIONAL_BOTTOM_RIGHT, poly_size=poly_size,
+                    cache_file=f'data/interim/depot_distance_matrix_poly{poly_size}.npz',
+                    road_files=[roads_raw(state) for state in states])),
+        Target('regional_snodas_download_file', [regional_download], [], touch_after,
+               dict(func=get_regional_snodas.download_snodas_regional, marker=regional_download,
+                    tar_dir='data/raw/snodas_tar_files', unpacked_dir='data/raw/snodas_params',
+                    start_year=start_year, end_year=end_year)),
+        Target('regional_road_overlay', [regional_roads], [state_overlay(state) for state in states],
+               save_regional_road_overlay.save_regional_road_overlay,
+               dict(overlays_directory='data/interim', output_file=regional_roads)),
+        Target('quarterly_salt_predictions', [predictions],
+               [salt_model, regional_roads] + [quarterly_snodas(quarter) for quarter in quarters],
+               save_quarterly_salt_predictions.save_quarterly_salt_predictions,
+               dict(fitted_salt_model_path=salt_model, roads_overlay_input=regional_roads,
+                    snodas_directory='data/interim', output_file=predictions, batched=True,
+                    cache_dir='data/interim/prediction_cache')),
+        Target('sales_estimates', ['models/sales_estimates.csv'],
+               [predictions, 'data/raw/sales_actual.csv', depot_distances], company_sales.company_sales,
+               dict(predictions_file=predictions, actual_sales_file='data/raw/sales_actual.csv',
+                    distances_file=depot_distances, output_file='models/sales_estimates.csv')),
+        Target('quarterly_solid_precip', ['data/processed/quarterly_solid_precip.csv'],
+               [quarterly_snodas(quarter) for quarter in quarters], quarterly_solid_precip.solid_precipitation,
+               dict(glob_pattern=f'data/interim/snodas_params_regional_poly{poly_size}_Q*.{fmt}',
+                    output_file='data/processed/quarterly_solid_precip.csv')),
+        Target('storm_events', [f'data/processed/storm_events.{fmt}', f'data/processed/storm_event_cells.{fmt}'],
+               [quarterly_snodas(quarter) for quarter in quarters], storm_events.save_storm_events,
+               dict(glob_pattern=f'data/interim/snodas_params_regional_poly{poly_size}_Q*.{fmt}',
+                    events_file=f'data/processed/storm_events.{fmt}',
+                    cells_file=f'data/processed/storm_event_cells.{fmt}', min_solid_precip=MIN_SOLID,
+                    poly_size=poly_size)),
+    ]
+    for state in states:
+        targets.append(Target(f'roads_data_{state}', [roads_raw(state)], [],
+                              get_state_roads_data.download_nar_roads_data,
+                              dict(state=state, link=NAR_LINK, crs=NAR_CRS)))
+        targets.append(Target(f'regional_road_overlay_{state}', [state_overlay(state)],
+                              [regional_grid, roads_raw(state)], save_state_road_overlays.save_state_road_overlays,
+                              dict(state=state, grid_file=regional_grid, road_file=roads_raw(state),
+                                   outputfile=state_overlay(state), state_brevs=STATE_BREVS)))
+    pyramid_dir = 'data/interim/pyramid'
+    pyramid = save_regional_pyramid.pyramid_files(pyramid_dir, pyramid_sizes, fmt)
+    finest = min(pyramid_sizes)
+    targets.append(Target('pyramid_grids', [files['grid'] for files in pyramid.values()], masks,
+                          save_regional_pyramid.save_pyramid_grids,
+                          dict(output_directory=pyramid_dir, poly_sizes=pyramid_sizes, fmt=fmt, mask_file=mask_file),
+                          POLY_INDEX))
+    targets.append(Target('pyramid_road_features', [files['road_features'] for files in pyramid.values()],
+                          [pyramid[finest]['grid']] + [roads_raw(state) for state in states],
+                          save_regional_pyramid.save_pyramid_road_features,
+                          dict(states=states, output_directory=pyramid_dir, poly_sizes=pyramid_sizes, fmt=fmt)))
+    for quarter in quarters:
+        targets.append(Target(f'pyramid_snodas_{quarter}',
+                              [files['snodas'] for files in
+                               save_regional_pyramid.pyramid_files(pyramid_dir, pyramid_sizes, fmt, quarter).values()],
+                              [regional_download] + masks, save_regional_pyramid.save_pyramid_snodas,
+                              dict(quarter=quarter, output_directory=pyramid_dir, poly_sizes=pyramid_sizes, fmt=fmt,
+                                   mask_file=mask_file), POLY_INDEX))
+    for quarter in quarters:
+        targets.append(Target(f'snodas_params_regional_{quarter}', [quarterly_snodas(quarter)],
+                              [regional_download] + masks, save_regional_snodas.save_regional_snodas,
+                              dict(upper_left=REGIONAL_UPPER_LEFT, bottom_right=REGIONAL_BOTTOM_RIGHT,
+                                   poly_size=poly_size, output_file=quarterly_snodas(quarter), mask_file=mask_file),
+                              POLY_INDEX))
+    return {target.name: target for target in targets}
+
+class Pipeline(object):
+    '''
+    Pipeline class schedules targets in dependency order, skips targets whose input hashes are unchanged and runs
+    independent stale targets in parallel
+    '''
+    def __init__(self, targets, state_file=STATE_FILE):
+        '''
+        Initialize Pipeline object
+        :param targets: Dictionary. keys = target name, values = Target
+        :param state_file: String. Relative path of json file recording input hashes and durations of built targets
+        '''
+        self.targets = targets
+        self.state_file = os.path.join(ROOT_DIR, state_file)
+        self.producers = {output: name for name, target in targets.items() for output in target.outputs}
+        self.dependencies = {name: sorted({self.producers[i] for i in target.inputs if i in self.producers})
+                             for name, target in targets.items()}
+        self.state = {'targets': {}, 'files': {}}
+        if os.path.exists(self.state_file):
+            with open(self.state_file) as f:
+                self.state = json.load(f)
+
+    def _save_state(self):
+        os.makedirs(os.path.dirname(self.state_file), exist_ok=True)
+        with open(self.state_file, 'w') as f:
+            json.dump(self.state, f, indent=1, sort_keys=True)
+
+    def _file_hash(self, path):
+        '''
+        Content hash of a file, cached by modification time and size so that unchanged files are not re-read
+        :param path: String. Relative path of file
+        :return: String. Hex digest, or None if file does not exist
+        '''
+        absolute_path = os.path.join(ROOT_DIR, path)
+        if not os.path.exists(absolute_path):
+            return None
+        stat = os.stat(absolute_path)
+        cached = self.state['files'].get(path)
+        if cached and cached['mtime'] == stat.st_mtime and cached['size'] == stat.st_size:
+            return cached['hash']
+        digest = file_hash(absolute_path)
+        self.state['files'][path] = {'mtime': stat.st_mtime, 'size': stat.st_size, 'hash': digest}
+        return digest
+
+    def target_hash(self, name):
+        '''
+        Hash of the function, parameters, versions and input contents of a target
+        :param name: String. Target name
+        :return: String. Hex digest
+        '''
+        target = self.targets[name]
+        params = {k: getattr(v, '__qualname__', v) for k, v in target.kwargs.items()}
+        content = {'func': f"{target.func.__module__}.{target.func.__qualname__}",
+                   'kwargs': params, 'inputs': {i: self._file_hash(i) for i in target.inputs}}
+        #targets without versions keep the hash of earlier builds
+        if target.versions:
+            content['versions'] = target.versions
+        content = json.dumps(content, sort_keys=True, default=str)
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def is_stale(self, name):
+        '''
+        A target is stale if one of its outputs is missing or the hash of its inputs differs from its last build
+        :param name: String. Target name
+        :return: Boolean
+        '''
+        target = self.targets[name]
+        if not all(os.path.exists(os.path.join(ROOT_DIR, o)) for o in target.outputs):
+            return True
+        return self.state['targets'].get(name, {}).get('hash') != self.target_hash(name)
+
+    def upstream(self, goals):
+        '''
+        Targets required to build goals, in topological order
+        :param goals: List. Target names
+        :return: List. Target names
+        '''
+        order, visited = [], set()
+
+        def visit(name):
+            if name in visited:
+                return
+            visited.add(name)
+            for dependency in self.dependencies[name]:
+                visit(dependency)
+            order.append(name)
+
+        for goal in goals:
+            visit(goal)
+        return order
+
+    def plan(self, goals, force=False):
+        '''
+        Dry-run plan of goals. Targets downstream of a stale target are stale because their inputs will change
+        :param goals: List. Target names
+        :param force: Boolean. Treat every target as stale
+        :return: List of (target name, status) tuples in topological order. status is 'run', 'run (upstream)' or
+        'skip'
+        '''
+        plan, will_run = [], set()
+        for name in self.upstream(goals):
+            if force or self.is_stale(name):
+                status = 'run'
+            elif any(d in will_run for d in self.dependencies[name]):
+                status = 'run (upstream)'
+            else:
+                status = 'skip'
+            if status != 'skip':
+                will_run.add(name)
+            plan.append((name, status))
+        self._save_state()
+        return plan
+
+    def run(self, goals, workers=1, force=False):
+        '''
+        Build goals. Targets whose dependencies are complete are submitted to a pool of forked worker processes
+        :param goals: List. Target names
+        :param workers: Int. Number of worker processes
+        :param force: Boolean. Rebuild every target
+        :return: Dictionary. keys = target name, values = duration of build in seconds. Skipped targets are omitted
+        '''
+        pending = self.upstream(goals)
+        done, durations, running = set(), {}, {}
+        context = multiprocessing.get_context('fork')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+            while pending or running:
+                for name in [n for n in pending if all(d in done for d in self.dependencies[n])]:
+                    pending.remove(name)
+                    if not force and not self.is_stale(name):
+                        done.add(name)
+                        continue
+                    target = self.targets[name]
+                    running[executor.submit(_run_target, name, target.func, target.kwargs)] = name
+                if not running:
+                    continue
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    durations[name] = future.result()
+                    self.state['targets'][name] = {'hash': self.target_hash(name), 'duration': durations[name]}
+                    self._save_state()
+                    done.add(name)
+        return durations
+
+    def critical_path(self, goals, durations=None):
+        '''
+        Longest chain of dependent targets weighted by build duration. Durations not measured in this run are taken
+        from the last recorded build
+        :param goals: List. Target names
+        :param durations: Dictionary. keys = target name, values = duration of build in seconds
+        :return: (List of target names, total duration in seconds)
+        '''
+        durations = durations or {}
+        finish, previous = {}, {}
+        for name in self.upstream(goals):
+            duration = durations.get(name, self.state['targets'].get(name, {}).get('duration', 0.0))
+            start = max((finish[d] for d in self.dependencies[name]), default=0.0)
+            previous[name] = max(self.dependencies[name], key=lambda d: finish[d], default=None)
+            finish[name] = start + duration
+        name = max(finish, key=finish.get)
+        total, path = finish[name], []
+        while name is not None:
+            path.append(name)
+            name = previous[name]
+        return path[::-1], total
+
+    def report(self, goals, durations=None):
+        '''
+        Timing report of goals: duration of every target and the critical path
+        :param goals: List. Target names
+        :param durations: Dictionary. keys = target name, values = duration of build in seconds
+        :return: String
+        '''
+        durations = durations or {}
+        lines = [f"{'target':<45} {'seconds':>10}  status"]
+        for name in self.upstream(goals):
+            duration = durations.get(name, self.state['targets'].get(name, {}).get('duration', 0.0))
+            lines.append(f"{name:<45} {duration:>10.1f}  {'built' if name in durations else 'skipped'}")
+        path, total = self.critical_path(goals, durations)
+        lines.append(f"critical path ({total:.1f} s): {' -> '.join(path)}")
+        return "\n".join(lines)
+
+def _run_target(name, func, kwargs):
+    '''
+    Run a target in a worker process. Stages profiled during the target are written to a run report labeled with the
+    target name, since worker processes do not run exit handlers
+    :return: Float. Duration in seconds
+    '''
+    start = time.perf_counter()
+    func(**kwargs)
+    write_run_report(label=name)
+    return time.perf_counter() - start
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run pipeline targets, skipping targets whose inputs are unchanged')
+    # CLI arguments with short and long flags
+    parser.add_argument('targets', nargs='*', default=['sales_estimates', 'quarterly_solid_precip'],
+                        help='Targets to build')
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count(), help='Number of worker processes')
+    parser.add_argument('-f', '--format', default='csv', help='File format of intermediate targets')
+    parser.add_argument('-n', '--dry-run', action='store_true', help='Print plan without building targets')
+    parser.add_argument('--force', action='store_true', help='Rebuild every target')
+    parser.add_argument('-m', '--mask', default=None, help='Mask polygon file of the regional grid')
+    args = parser.parse_args()
+
+    os.chdir(ROOT_DIR)
+    pipeline = Pipeline(build_targets(fmt=args.format, mask_file=args.mask))
+    if args.dry_run:
+        for target_name, status in pipeline.plan(args.targets, force=args.force):
+            print(f"{target_name:<45} {status}")
+        critical_targets, critical_seconds = pipeline.critical_path(args.targets)
+        print(f"critical path of last build ({critical_seconds:.1f} s): {' -> '.join(critical_targets)}")
+    else:
+        run_durations = pipeline.run(args.targets, workers=args.workers, force=args.force)
+        print(pipeline.report(args.targets, run_durations))
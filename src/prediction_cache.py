@@ -0,0 +1,144 @@
+import os
+import json
+import hashlib
+import logging
+import pandas as pd
+from definitions import STORM_FEATURES_VERSION
+from salt_model import lead_in_file
+from storage import read_frame, write_frame
+from utility import file_hash, quarter_from_path
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE = 'index.json'
+
+class PredictionCache(object):
+    '''
+    PredictionCache stores quarterly salt predictions, one file per quarter, keyed by the hashes of the fitted salt
+    model, the regional road features, the quarter's SNODAS file and, for Q1 quarters, the Q4 file of the prior year that
+    early storms look back into, together with the storm threshold, lags and STORM_FEATURES_VERSION. Only quarters
+    whose key changed are recomputed. Entries made with a different fitted salt model are evicted when the cache is
+    opened
+    '''
+    def __init__(self, cache_dir, fitted_salt_model_path, roads_overlay_input, min_solid_precip, lags):
+        '''
+        Initialize PredictionCache object
+        :param cache_dir: String. Path of cache directory
+        :param fitted_salt_model_path: String. Path of fitted salt model .pkd file
+        :param roads_overlay_input: String. Path of regional road features file
+        :param min_solid_precip: Int. Minimum amount of solid precipitation per day per polygon
+        :param lags: Tuple. Lags, in days, of SNODAS features
+        '''
+        self.cache_dir = cache_dir
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.index = {'model': None, 'entries': {}, 'files': {}}
+        if os.path.exists(os.path.join(self.cache_dir, INDEX_FILE)):
+            with open(os.path.join(self.cache_dir, INDEX_FILE)) as f:
+                self.index = json.load(f)
+
+        self.model_hash = self._file_hash(fitted_salt_model_path)
+        if self.index['model'] != self.model_hash:
+            self.evict()
+            self.index['model'] = self.model_hash
+        self.base_key = [self.model_hash, self._file_hash(roads_overlay_input), str(min_solid_precip),
+                         ','.join(str(lag) for lag in lags), str(STORM_FEATURES_VERSION)]
+
+    def _save_index(self):
+        with open(os.path.join(self.cache_dir, INDEX_FILE), 'w') as f:
+            json.dump(self.index, f, indent=1, sort_keys=True)
+
+    def _file_hash(self, path):
+        '''
+        Content hash of a file, cached by modification time and size so that unchanged SNODAS files are not re-read
+        :param path: String. Path of file
+        :return: String. Hex digest
+        '''
+        stat = os.stat(path)
+        cached = self.index['files'].get(path)
+        if cached and cached['mtime'] == stat.st_mtime and cached['size'] == stat.st_size:
+            return cached['hash']
+        digest = file_hash(path)
+        self.index['files'][path] = {'mtime': stat.st_mtime, 'size': stat.st_size, 'hash': digest}
+        return digest
+
+    def key(self, snodas_input):
+        '''
+        Cache key of the predictions of a quarter. Storms early in a Q1 window look back into the Q4 file of the prior
+        year, so its hash is part of the key of Q1 quarters
+        :param snodas_input: String. Path of quarterly SNODAS file
+        :return: String. Hex digest
+        '''
+        file_hashes = [self._file_hash(file) for file in (snodas_input, lead_in_file(snodas_input)) if file]
+        return hashlib.sha256('|'.join(self.base_key + file_hashes).encode()).hexdigest()
+
+    def _entry_path(self, quarter):
+        return os.path.join(self.cache_dir, self.index['entries'][quarter]['file'])
+
+    def is_stale(self, snodas_input):
+        '''
+        Predictions of a quarter are stale if no entry exists for the quarter or the key of the entry has changed
+        :param snodas_input: String. Path of quarterly SNODAS file
+        :return: Boolean
+        '''
+        entry = self.index['entries'].get(quarter_from_path(snodas_input))
+        return entry is None or entry['key'] != self.key(snodas_input) or \
+            not os.path.exists(os.path.join(self.cache_dir, entry['file']))
+
+    def get(self, snodas_input):
+        '''
+        Cached predictions of a quarter
+        :param snodas_input: String. Path of quarterly SNODAS file
+        :return: DataFrame. Columns = ['quarter', 'poly_index', 'salt'], or None if predictions are stale
+        '''
+        if self.is_stale(snodas_input):
+            return None
+        return read_frame(self._entry_path(quarter_from_path(snodas_input)), schema='salt_predictions')
+
+    def put(self, snodas_input, predictions_df):
+        '''
+        Store predictions of a quarter, replacing any previous entry of the quarter
+        :param snodas_input: String. Path of quarterly SNODAS file
+        :param predictions_df: DataFrame. Columns = ['quarter', 'poly_index', 'salt'] of the quarter
+        :return: None
+        '''
+        quarter = quarter_from_path(snodas_input)
+        key = self.key(snodas_input)
+        if quarter in self.index['entries']:
+            self._remove(quarter)
+        file = f"salt_predictions_{quarter}_{key[:16]}.csv"
+        write_frame(predictions_df, os.path.join(self.cache_dir, file), schema='salt_predictions')
+        self.index['entries'][quarter] = {'key': key, 'file': file}
+        self._save_index()
+
+    def _remove(self, quarter):
+        entry = self.index['entries'].pop(quarter)
+        if os.path.exists(os.path.join(self.cache_dir, entry['file'])):
+            os.remove(os.path.join(self.cache_dir, entry['file']))
+
+    def evict(self):
+        '''
+        Remove all entries. Called when the fitted salt model changes
+        :return: None
+        '''
+        if self.index['entries']:
+            logger.info(f"evicting {len(self.index['entries'])} cached quarters of previous salt model")
+        for quarter in list(self.index['entries']):
+            self._remove(quarter)
+        self._save_index()
+
+    def predictions(self, snodas_files, predict):
+        '''
+        Salt predictions of every quarter, computing only stale quarters
+        :param snodas_files: List. Paths of quarterly SNODAS files
+        :param predict: Function. Maps a list of quarterly SNODAS files to a DataFrame of predictions with columns
+        ['quarter', 'poly_index', 'salt']
+        :return: DataFrame. Columns = ['quarter', 'poly_index', 'salt'], sorted by quarter and poly_index
+        '''
+        stale_files = [file for file in snodas_files if self.is_stale(file)]
+        logger.info(f"{len(snodas_files) - len(stale_files)} cached quarters, {len(stale_files)} to predict")
+        if stale_files:
+            stale_df = predict(stale_files)
+            for file in stale_files:
+                self.put(file, stale_df[stale_df['quarter'] == quarter_from_path(file)])
+        return pd.concat([self.get(file) for file in snodas_files], ignore_index=True) \
+            .sort_values(['quarter', 'poly_index'], ignore_index=True)
@@ -0,0 +1,167 @@
+import os
+import sys
+import json
+import time
+import atexit
+import socket
+import functools
+import inspect
+from contextlib import contextmanager
+from datetime import datetime
+from definitions import ROOT_DIR
+try:
+    import resource
+except ImportError: #not available on Windows
+    resource = None
+
+'''
+Stage-level instrumentation. Every profiled stage records wall time, CPU time, peak resident set size and rows in/out.
+Stages are recorded when the environment variable SALT_PROFILE_DIR is set, and a structured JSON run report is written
+to that directory when the process exits (or when write_run_report is called). Reports of two runs are compared with
+compare_profiles.py
+    rows_in: rows read by read_frame/iter_frames within the stage, plus rows of DataFrame/ndarray arguments
+    rows_out: rows of the returned DataFrame/ndarray, or the sum over a returned tuple/list of them
+    peak_rss_mb: high-water mark of the process resident set size at the end of the stage. peak_rss_growth_mb is the
+    increase of the high-water mark during the stage
+'''
+PROFILE_ENV = "SALT_PROFILE_DIR"
+
+_records = [] #finished stages of current run
+_stack = [] #stages in progress, innermost last
+_started = datetime.now().isoformat(timespec='seconds')
+
+def enabled():
+    '''
+    Stages are recorded when SALT_PROFILE_DIR is set to a non-empty path
+    :return: Boolean
+    '''
+    return bool(os.environ.get(PROFILE_ENV))
+
+def peak_rss_mb():
+    '''
+    High-water mark of resident set size of current process in MB. None where resource module is unavailable
+    :return: Float
+    '''
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    #ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+def count_rows(obj):
+    '''
+    Number of rows of a DataFrame, Series or ndarray, or the sum over a tuple/list of them
+    :param obj: Object
+    :return: Int, or None if obj holds no rows
+    '''
+    if hasattr(obj, 'shape') and hasattr(obj, '__len__'):
+        return len(obj)
+    if isinstance(obj, (tuple, list)):
+        counts = [count_rows(o) for o in obj]
+        counts = [c for c in counts if c is not None]
+        return sum(counts) if counts else None
+    return None
+
+def add_rows_in(rows):
+    '''
+    Add rows read to innermost stage in progress. Called by the storage readers
+    :param rows: Int
+    :return: None
+    '''
+    if _stack and rows is not None:
+        _stack[-1]['rows_in'] = (_stack[-1]['rows_in'] or 0) + rows
+
+@contextmanager
+def profile_stage(name, rows_in=None):
+    '''
+    Context manager recording wall time, CPU time, peak RSS and rows of a stage. rows_out can be set on the yielded
+    record
+    :param name: String. Stage name
+    :param rows_in: Int. Rows passed into stage
+    :return: Dictionary. Stage record
+    '''
+    if not enabled():
+        yield {}
+        return
+    record = {'stage': name, 'parent': _stack[-1]['stage'] if _stack else None, 'depth': len(_stack),
+              'rows_in': rows_in, 'rows_out': None}
+    start_rss = peak_rss_mb()
+    start_wall, start_cpu = time.perf_counter(), time.process_time()
+    _stack.append(record)
+    try:
+        yield record
+    finally:
+        _stack.pop()
+        record['wall_s'] = time.perf_counter() - start_wall
+        record['cpu_s'] = time.process_time() - start_cpu
+        record['peak_rss_mb'] = peak_rss_mb()
+        record['peak_rss_growth_mb'] = None if start_rss is None else record['peak_rss_mb'] - start_rss
+        _records.append(record)
+
+def profiled(func):
+    '''
+    Decorator recording each call of func as a stage named module.qualname. Generator functions are timed across the
+    iteration of the generator
+    :param func: Function
+    :return: Function
+    '''
+    name = f"{func.__module__}.{func.__qualname__}"
+
+    def rows_of_arguments(args, kwargs):
+        counts = [count_rows(a) for a in list(args) + list(kwargs.values()) if hasattr(a, 'shape')]
+        return sum(counts) if counts else None
+
+    if inspect.isgeneratorfunction(func):
+        @functools.wraps(func)
+        def generator_wrapper(*args, **kwargs):
+            with profile_stage(name, rows_of_arguments(args, kwargs)) as record:
+                rows_out = 0
+                for item in func(*args, **kwargs):
+                    rows_out += count_rows(item) or 0
+                    yield item
+                record['rows_out'] = rows_out
+        return generator_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not enabled():
+            return func(*args, **kwargs)
+        with profile_stage(name, rows_of_arguments(args, kwargs)) as record:
+            result = func(*args, **kwargs)
+            record['rows_out'] = count_rows(result)
+        return result
+    return wrapper
+
+def run_report(label=None):
+    '''
+    Structured report of stages recorded in current run
+    :param label: String. Run label. Defaults to name of script
+    :return: Dictionary
+    '''
+    return {'label': label or os.path.splitext(os.path.basename(sys.argv[0]))[0] or 'python',
+            'argv': sys.argv, 'started': _started, 'finished': datetime.now().isoformat(timespec='seconds'),
+            'host': socket.gethostname(), 'pid': os.getpid(), 'python': sys.version.split()[0],
+            'stages': list(_records)}
+
+def write_run_report(label=None, clear=True):
+    '''
+    Write JSON report of current run to SALT_PROFILE_DIR. File name is <label>_<timestamp>_<pid>.json
+    :param label: String. Run label. Defaults to name of script
+    :param clear: Boolean. Clear recorded stages after writing
+    :return: String. Path of report, or None if profiling is disabled or no stages were recorded
+    '''
+    global _started
+    if not enabled() or not _records:
+        return None
+    report = run_report(label)
+    profile_dir = os.path.join(ROOT_DIR, os.environ[PROFILE_ENV])
+    os.makedirs(profile_dir, exist_ok=True)
+    path = os.path.join(profile_dir, f"{report['label']}_{datetime.now():%Y%m%dT%H%M%S}_{os.getpid()}.json")
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=1)
+    if clear:
+        _records.clear()
+        _started = datetime.now().isoformat(timespec='seconds')
+    return path
+
+atexit.register(write_run_report)
@@ -3,12 +3,13 @@ from salt_model import quarterly_solid_precip
 import os
 from definitions import ROOT_DIR
 import glob
+from storage import write_frame
 
 def solid_precipitation(glob_pattern, output_file):
     '''Summarize quarterly snodas solid preciptiation for purpose of demonstration of changes in snodas params year over
     year'''
     all_files = glob.glob(os.path.join(ROOT_DIR, glob_pattern))
-    quarterly_solid_precip(all_files).to_csv(os.path.join(ROOT_DIR, output_file), index=False)
+    write_frame(quarterly_solid_precip(all_files), os.path.join(ROOT_DIR, output_file), schema='solid_precip')
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Summarize quarterly snodas solid preciptiation for purpose of '
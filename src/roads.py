@@ -1,8 +1,23 @@
+import logging
+from collections import namedtuple
+import numpy as np
 import pandas as pd
 import geopandas as gpd
+import shapely
 from pyproj import Geod
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+from scipy.spatial import cKDTree
 from roads_client import Roads_client
+from storage import read_frame
+from profiling import profiled
 
+logger = logging.getLogger(__name__)
+
+#road graph: CSR matrix of CLASS-weighted geodesic lengths, in meters, between road nodes, and node coordinates
+RoadNetwork = namedtuple("RoadNetwork", ['graph', 'lon', 'lat'])
+
+@profiled
 def build_state_roads_df(link, state, crs):
     '''
     Create DataFrame, with geometry in wkt format, of state North American Roads data set
@@ -16,6 +31,7 @@ def build_state_roads_df(link, state, crs):
     state_roads_client.get_record_count()
     return state_roads_client.build_df()
 
+@profiled
 def nar_overlay(state_abbrev, nar_input, grid_input):
     '''
     Create overlay of polygons that correspond to SNODAS grid (each polygon is a 10 x 10 SNODAS grid) with
@@ -33,24 +49,19 @@ def nar_overlay(state_abbrev, nar_input, grid_input):
     """
     geod = Geod(ellps="WGS84")
 
-    road_gdf = pd.read_csv(nar_input)
-    road_gdf['geometry'] = gpd.GeoSeries.from_wkt(road_gdf['geometry'])
-    road_gdf = gpd.GeoDataFrame(road_gdf, geometry='geometry')
+    road_gdf = read_frame(nar_input, schema='roads', geometry=True)
 
     #calculate length of each road and in km prior to overlay and intersections with polygon grid
     road_gdf['ORIG_KMS'] = road_gdf['geometry'].apply(lambda x: geod.geometry_length(x))/1000
     # calculate lanes * length of each road and in km prior to overlay and intersections with polynomial grid
     road_gdf['ORIG_LANE_KMS'] = road_gdf['ORIG_KMS'] * road_gdf['LANES']
     road_gdf['STATE'] = pd.Series([state_abbrev]*len(road_gdf))
-    print(road_gdf.head())
-    grid_gdf = pd.read_csv(grid_input)
-    grid_gdf['geometry'] = gpd.GeoSeries.from_wkt(grid_gdf['geometry'])
-    grid_gdf = gpd.GeoDataFrame(grid_gdf, geometry='geometry')
-    print(grid_gdf.head())
+    grid_gdf = read_frame(grid_input, schema='grid', geometry=True)
+    logger.debug("%s: %d roads, %d grid polygons", state_abbrev, len(road_gdf), len(grid_gdf))
     # create overaly of roads and polygons
     # keep_geom_type=True keeps only the roads geometry for each road, not the polygons
     overlay = gpd.overlay(road_gdf, grid_gdf, how='intersection', keep_geom_type=True, make_valid=False)
-    print(overlay.head())
+    logger.debug("%s: %d road sections in overlay", state_abbrev, len(overlay))
     # save the length, and lanes * length of each road section that will be summed when grouping by polygon
     overlay['WITHIN_POLY_KMS'] = overlay['geometry'].apply(lambda x: geod.geometry_length(x))/1000
     overlay['WITHIN_POLY_LANE_KMS'] = overlay['WITHIN_POLY_KMS'] * overlay['LANES']
@@ -58,14 +69,16 @@ def nar_overlay(state_abbrev, nar_input, grid_input):
 
     return overlay.to_wkt()
 
+@profiled
 def nar_combine_overlays(all_files):
     ''' Combine all roads overlay files. Combine prior to grouping by polygon because there are polygons that straddle
     state boundaries
     :param: all_files:  List. List of overlay files
     :return: DataFrame
     '''
-    return pd.concat((pd.read_csv(f) for f in all_files), ignore_index=True)
+    return pd.concat((read_frame(f, schema='road_overlay') for f in all_files), ignore_index=True)
 
+@profiled
 def regional_nar_overlay_road_features(regional_overlay_input):
     '''
     Add features to regional roads overlay. Create length and length * lanes features for each class of road. Groupby
@@ -95,6 +108,43 @@ def regional_nar_overlay_road_features(regional_overlay_input):
 
     return road_df
 
+@profiled
+def roads_by_tile(road_gdf, grid, tiles):
+    '''
+    Roads crossing each tile of a grid, by bounding box. A road crossing several tiles is in each of them; the overlay
+    with the polygons of a tile keeps only its sections within the tile, so no section is counted twice
+    :param road_gdf: GeoDataFrame. Roads
+    :param grid: Grid object
+    :param tiles: List of Tile. Tiles of grid, see Grid.tiles
+    :return: Generator of (Tile, GeoDataFrame). Tiles without roads are left out
+    '''
+    bounds = road_gdf['geometry'].bounds
+    top, left = grid.locate(bounds['minx'], bounds['maxy'])
+    bottom, right = grid.locate(bounds['maxx'], bounds['miny'])
+    for tile in tiles:
+        crossing = ((top < tile.rows.stop) & (bottom >= tile.rows.start) & (left < tile.columns.stop) &
+                    (right >= tile.columns.start))
+        if crossing.any():
+            yield tile, road_gdf[crossing]
+
+@profiled
+def roll_up_road_features(road_features_df, parent_index):
+    '''
+    Road features of the polygons of a coarser level of a grid pyramid, from the road features of the level below.
+    Length and lanes * length features are sums over the road sections within a polygon, so the features of a polygon
+    are the sums of the features of its child polygons
+    :param road_features_df: DataFrame. Road features by poly_index, as produced by regional_nar_overlay_road_features
+    :param parent_index: Array-like. poly_index of the parent polygon of each row, e.g. Grid.coarsen
+    :return: DataFrame. Road features by parent poly_index
+    '''
+    road_cols = [col for col in road_features_df.columns if "WITHIN_POLY" in col]
+    aggregations = {col: "sum" for col in road_cols}
+    #state abbreviations of every child polygon, once each
+    aggregations["STATE"] = lambda states: " ".join(pd.unique(" ".join(states).split()))
+    return road_features_df.assign(poly_index=np.asarray(parent_index)).groupby(
+        by=['poly_index'], as_index=False, sort=True).aggregate(aggregations)
+
+@profiled
 def winter_iowa_roads_overlay(roads_input, grid_input):
     """ Create overlay of polygons that correspond to SNODAS grid (each polygon is a 10 x 10 SNODAS grid) with
     road data for Iowa
@@ -102,19 +152,14 @@ def winter_iowa_roads_overlay(roads_input, grid_input):
    """
     geod = Geod(ellps="WGS84")
 
-    road_gdf = pd.read_csv(roads_input)
-
-    road_gdf['geometry'] = gpd.GeoSeries.from_wkt(road_gdf['geometry'])
-    road_gdf = gpd.GeoDataFrame(road_gdf, geometry='geometry')
+    road_gdf = read_frame(roads_input, schema='roads', geometry=True)
     # calculate length of each road in km prior to overlay and intersections with polygon grid
     road_gdf['ORIG_KMS'] = road_gdf['geometry'].apply(lambda x: geod.geometry_length(x))/1000
     # calculate lanes * length of each road in km prior to overlay and intersections with polynomial grid
     road_gdf['ORIG_LANE_KMS'] = road_gdf['ORIG_KMS'] * road_gdf['LANES']
     road_gdf['STATE'] = pd.Series(["IA"]*len(road_gdf))
 
-    grid_gdf = pd.read_csv(grid_input)
-    grid_gdf['geometry'] = gpd.GeoSeries.from_wkt(grid_gdf['geometry'])
-    grid_gdf = gpd.GeoDataFrame(grid_gdf, geometry='geometry')
+    grid_gdf = read_frame(grid_input, schema='grid', geometry=True)
 
     # create overaly of roads and polygons
     # keep_geom_type=True keeps only the roads geometry for each road, not the polygons
@@ -126,6 +171,7 @@ def winter_iowa_roads_overlay(roads_input, grid_input):
 
     return overlay.to_wkt()
 
+@profiled
 def winter_iowa_road_features(roads_overlay_input):
     '''
     Create length and length * lanes features for each class of road. Groupby polygon.
@@ -142,4 +188,94 @@ def winter_iowa_road_features(roads_overlay_input):
     columns = [col for col in road_df.columns if "WITHIN_POLY" in col]
     aggregations = {col: "sum" for col in columns}
     road_df = road_df.groupby(by=['poly_index'], as_index=False, sort=False).aggregate(aggregations)
-    return road_df
\ No newline at end of file
+    return road_df
+
+def _node_keys(lon, lat):
+    #coordinates rounded to 1e-6 degrees and packed into one integer, so that endpoints shared by roads match
+    return (np.round((lon + 180) * 1e6).astype('int64') << 28) | np.round((lat + 90) * 1e6).astype('int64')
+
+@profiled
+def road_network(road_inputs, class_weights):
+    '''
+    Build road graph from NAR road data. Nodes are road endpoints, and every road (every part of a multi-part road) is
+    an undirected edge weighted by its geodesic length times the weight of its CLASS. Of parallel edges between two
+    nodes only the cheapest is kept
+    :param road_inputs: List. Paths of files containing state NAR road data
+    :param class_weights: Dictionary. keys = CLASS, values = cost per meter relative to a freeway
+    :return: RoadNetwork
+    '''
+    geod = Geod(ellps="WGS84")
+    parts, weights = [], []
+    for road_input in road_inputs:
+        road_gdf = read_frame(road_input, schema='roads', columns=['geometry', 'CLASS'], geometry=True)
+        road_parts, road_index = shapely.get_parts(road_gdf['geometry'].to_numpy(), return_index=True)
+        parts.append(road_parts)
+        weights.append(road_gdf['CLASS'].map(class_weights).to_numpy(dtype='float64')[road_index])
+    parts, weights = np.concatenate(parts), np.concatenate(weights)
+
+    #geodesic length of every part from its consecutive vertices in one Geod.inv call
+    coords, part_index = shapely.get_coordinates(parts, return_index=True)
+    same_part = part_index[1:] == part_index[:-1]
+    segments = geod.inv(coords[:-1, 0][same_part], coords[:-1, 1][same_part], coords[1:, 0][same_part],
+                        coords[1:, 1][same_part], return_back_azimuth=False)[2]
+    lengths = np.bincount(part_index[1:][same_part], weights=segments, minlength=parts.size)
+
+    first = np.searchsorted(part_index, np.arange(parts.size))
+    last = np.searchsorted(part_index, np.arange(parts.size), side='right') - 1
+    keys, nodes = np.unique(_node_keys(np.concatenate([coords[first, 0], coords[last, 0]]),
+                                       np.concatenate([coords[first, 1], coords[last, 1]])), return_inverse=True)
+    start, end = nodes[:parts.size], nodes[parts.size:]
+    lon = (keys >> 28) / 1e6 - 180
+    lat = (keys & ((1 << 28) - 1)) / 1e6 - 90
+
+    #one edge per unordered node pair, the cheapest; self loops are dropped
+    cost = lengths * weights
+    u, v = np.minimum(start, end), np.maximum(start, end)
+    order = np.lexsort((cost, v, u))
+    u, v, cost = u[order], v[order], cost[order]
+    keep = (u != v) & np.concatenate([[True], (u[1:] != u[:-1]) | (v[1:] != v[:-1])])
+    graph = csr_matrix((cost[keep], (u[keep], v[keep])), shape=(keys.size, keys.size))
+    logger.debug("road network: %d nodes, %d edges", keys.size, keep.sum())
+    return RoadNetwork(graph, lon, lat)
+
+def _snap(network, lon, lat):
+    '''
+    Closest road node of each point, searched on an equirectangular projection, and geodesic distance to it in meters
+    :param network: RoadNetwork
+    :param lon: Ndarray. Longitudes of points
+    :param lat: Ndarray. Latitudes of points
+    :return: (node index by point, distance by point)
+    '''
+    scale = np.cos(np.radians(np.mean(network.lat)))
+    tree = cKDTree(np.column_stack([network.lon * scale, network.lat]))
+    node = tree.query(np.column_stack([lon * scale, lat]))[1]
+    distance = Geod(ellps="WGS84").inv(lon, lat, network.lon[node], network.lat[node], return_back_azimuth=False)[2]
+    return node, distance
+
+@profiled
+def network_distances(network, source_lon, source_lat, target_lon, target_lat, access_weight):
+    '''
+    Road-network distance from the closest of all sources to each target, in one Dijkstra pass. Sources are joined to a
+    virtual origin node by their access legs, so the cost does not grow with the number of sources
+    :param network: RoadNetwork
+    :param source_lon: Ndarray. Longitudes of sources, e.g. depots
+    :param source_lat: Ndarray. Latitudes of sources
+    :param target_lon: Ndarray. Longitudes of targets, e.g. polygon centroids
+    :param target_lat: Ndarray. Latitudes of targets
+    :param access_weight: Float. Cost per meter of legs between a source or target and its closest road node
+    :return: Ndarray. CLASS-weighted distance in meters by target, inf if no source is reachable
+    '''
+    source_node, source_access = _snap(network, source_lon, source_lat)
+    target_node, target_access = _snap(network, target_lon, target_lat)
+    n_nodes = network.graph.shape[0]
+    graph = network.graph.tocoo()
+    #virtual origin node n_nodes, joined to the road node of every source by the shortest access leg to that node.
+    #Explicit zeros are edges in csgraph, so a source on a road node costs nothing
+    access = np.full(n_nodes, np.inf)
+    np.minimum.at(access, source_node, source_access * access_weight)
+    joined = np.flatnonzero(np.isfinite(access))
+    origin = csr_matrix((np.concatenate([graph.data, access[joined]]),
+                         (np.concatenate([graph.row, np.full(joined.size, n_nodes)]),
+                          np.concatenate([graph.col, joined]))), shape=(n_nodes + 1, n_nodes + 1))
+    distances = dijkstra(origin, directed=False, indices=n_nodes)
+    return distances[target_node] + target_access * access_weight
@@ -3,19 +3,22 @@ import geopandas as gpd
 import requests
 import time
 from retrying import retry
+from definitions import ARCGIS_PAUSE
 
 class Roads_client(object):
     """The Roads_client class is used to interact with the ArcGIS API for purpose of downloading road data for a state
     in CMP's market"""
-    def __init__(self, link, state, spatial_ref, **kwargs):
+    def __init__(self, link, state, spatial_ref, pause=ARCGIS_PAUSE, **kwargs):
         '''
         Initiallize a Roads_client object
         :param link: String. ArcGIS API endpoint
         :param state: String. Capitalized full name of state
         :param spatial_ref: String. Coordinate reference system of NAR data set
+        :param pause: Float. Seconds between consecutive page requests
         :param kwargs: optional URL query parameters
         '''
         self.link = link
+        self.pause = pause
         self.call_limit = 2000
         self.record_count = None
         self.state = state
@@ -66,7 +69,7 @@ class Roads_client(object):
         #load into GeoDataframe
         road_gdf = gpd.GeoDataFrame.from_features(response_json["features"])
 
-        time.sleep(5)
+        time.sleep(self.pause)
         offset += self.call_limit
         while offset < self.total_record_count:
             self.add_params(resultOffset=str(offset), resultRecordCount=self.call_limit)
@@ -74,7 +77,7 @@ class Roads_client(object):
             road_gdf = pd.concat([road_gdf, gpd.GeoDataFrame.from_features(response_json["features"])],
                                  ignore_index=True)
             offset += self.call_limit
-            time.sleep(5)
+            time.sleep(self.pause)
         return road_gdf.to_wkt()
 
     @retry(wait_fixed=5000, stop_max_attempt_number=2)
@@ -1,9 +1,18 @@
 from salt_client import Salt_client
 import pandas as pd
+import numpy as np
 import geopandas as gpd
 from datetime import timedelta
 from pyproj import Geod
+from snodas_store import SnodasStore
+from definitions import SNODAS_LAGS, SNODAS_VARIABLES, ROLLING_WINDOWS
+from utility import winter_season
+from storage import read_frame, iter_frames, write_frame, file_format
+from profiling import profiled
+import os
+import glob
 
+@profiled
 def build_salt_df(link):
     """ Create instance of Salt_client and use it to download and save salt data
     :return: DataFrame with complete Iowa DOT historic salt dataset. Includes geometry col in wkt format.
@@ -12,26 +21,31 @@ def build_salt_df(link):
     salt.get_record_count()
     return salt.build_df()
 
+@profiled
 def parse_dates(salt_input):
     '''Save storm dates that will be used to join with SNODAS data. Determine storm dates based on datetime of last
     pass. SNODAS and IOWA DOT use same time zone.
     :return: Dataframe with dates saved that correspond to SNODAS dates
     '''
-    salt_df = pd.read_csv(salt_input)
+    salt_df = read_frame(salt_input, schema='salt')
     salt_df['LAST_PASS'] = pd.to_datetime(salt_df['LAST_PASS'], unit='ms')
     salt_df['STORM_DATE'] = salt_df['LAST_PASS'].apply(
         lambda x: (x.floor('D') + timedelta(days=1)) if (x.hour > 11) else x.floor('D'))
     salt_df['PREV_DATE'] = salt_df['STORM_DATE'] - timedelta(days=1)
     return salt_df
 
-def unique_salt_dates(salt_input):
-    ''' Return numpy array of the set of all storm dates and one day previous dates
+@profiled
+def unique_salt_dates(salt_input, lookback=1):
+    ''' Return numpy array of the set of all storm dates and the lookback days previous to each storm date
     :param filename: Path of salt dataset that includes storm dates
+    :param lookback: Int. Number of days prior to each storm date to include. 1 includes the PREV_DATE
     :return: Numpy array of set of storm + prior to storm dates
     '''
-    salt_df = pd.read_csv(salt_input)
-    return pd.concat([salt_df['STORM_DATE'], salt_df['PREV_DATE']], ignore_index=True).unique()
+    salt_df = read_frame(salt_input, schema='salt_storm_dates', columns=['STORM_DATE'])
+    return pd.concat([salt_df['STORM_DATE'] - timedelta(days=lag) for lag in range(lookback + 1)],
+                     ignore_index=True).unique()
 
+@profiled
 def build_iowa_winter(salt_input, grid_input):
     '''
     Overlay iowa salt data and iowa grid. create per polygon features.
@@ -40,17 +54,13 @@ def build_iowa_winter(salt_input, grid_input):
     :return: DataFrame
     '''
     geod = Geod(ellps="WGS84")
-    salt_df = pd.read_csv(salt_input)
-    salt_df['geometry'] = gpd.GeoSeries.from_wkt(salt_df['geometry'])
-    salt_gdf = gpd.GeoDataFrame(salt_df, geometry='geometry')
-    salt_df['ORIG_ID'] = salt_df.index.to_numpy(copy=True)
+    salt_gdf = read_frame(salt_input, schema='salt_storm_dates', geometry=True)
+    salt_gdf['ORIG_ID'] = salt_gdf.index.to_numpy(copy=True)
     salt_gdf['ORIG_SEGMENT'] = salt_gdf['geometry'].apply(lambda x: geod.geometry_length(x))
     salt_gdf['SOLID_PER_SEGMENT'] = salt_gdf['QUANTITY_SOLID'] / salt_gdf['ORIG_SEGMENT']
     salt_gdf['TOTAL_PER_SEGMENT'] = salt_gdf['TOTAL_SALT_QUANTITY'] / salt_gdf['ORIG_SEGMENT']
 
-    grid_df = pd.read_csv(grid_input)
-    grid_df['geometry'] = gpd.GeoSeries.from_wkt(grid_df['geometry'])
-    grid_gdf = gpd.GeoDataFrame(grid_df, geometry='geometry')
+    grid_gdf = read_frame(grid_input, schema='grid', geometry=True)
 
     # keep_geom_type=True keeps only the lines from salt_df, not the polygons from grid
     overlay = gpd.overlay(salt_gdf, grid_gdf, how='intersection', keep_geom_type=True, make_valid=False)
@@ -58,6 +68,7 @@ def build_iowa_winter(salt_input, grid_input):
     overlay['NEW_SEGMENT'] = overlay['geometry'].apply(lambda x: geod.geometry_length(x))
     return overlay.to_wkt()
 
+@profiled
 def groupby_poly_iowawinter(salt_input):
     '''
     Group by polygon and sum up total salt that falls within each polygon by storm date
@@ -72,27 +83,113 @@ def groupby_poly_iowawinter(salt_input):
         .aggregate(aggregations)
     return salt_df
 
-def join_it_iowawinter(salt_input, snodas_input, roads_input):
+@profiled
+def join_it_iowawinter(salt_input, snodas_input, roads_input, lags=SNODAS_LAGS, windows=ROLLING_WINDOWS):
     '''
-    Join Iowa datasets (salt, SNODAS, roads)
+    Join Iowa datasets (salt, SNODAS, roads). SNODAS features for the storm date and for each lag, and rolling SNODAS
+    features, are looked up by array offset in a SnodasStore rather than merged
     :param salt_input: String. Path of file containing Iowa salt data
     :param snodas_input: String. Path of file containing Iowa SNODAS data
     :param roads_input: String. Path of file containing Iowa roads overlay data
+    :param lags: Tuple. Lags, in days prior to storm date, of SNODAS features. Lag 1 columns are suffixed _PREV
+    :param windows: Tuple. Windows, in days ending on storm date, of rolling SNODAS features. The SNODAS data must hold
+    every day of the largest window, see extract_storm_dates lookback
     :return: Dataframe
     '''
-    salt_df = pd.read_csv(salt_input, parse_dates=["STORM_DATE", "PREV_DATE"])
-    salt_df = salt_df.assign(STORM_DATE=salt_df['STORM_DATE'].astype('datetime64[ns]'),PREV_DATE=salt_df['PREV_DATE']
-                             .astype('datetime64[ns]'))
+    salt_df = read_frame(salt_input, schema='salt_overlay')
 
-    snodas_params_df = pd.read_csv(snodas_input)
-    snodas_params_df['DATE'] = snodas_params_df['date'].astype('datetime64[ns]')
+    snodas_store = SnodasStore.from_file(snodas_input)
+    snodas_features = [snodas_store.features(salt_df['STORM_DATE'], salt_df['poly_index'], lags=(0,) + tuple(lags))]
+    if windows:
+        snodas_features.append(snodas_store.rolling_features(salt_df['STORM_DATE'], salt_df['poly_index'], windows))
+    merged = pd.concat([salt_df] + snodas_features, axis=1)
 
-    merged = pd.merge(salt_df, snodas_params_df, how='left', left_on=['STORM_DATE', 'poly_index'],
-                      right_on=['DATE', 'poly_index'])
-    merged = pd.merge(merged, snodas_params_df, how='left', left_on=['PREV_DATE', 'poly_index'],
-                      right_on=['DATE', 'poly_index'], suffixes=("","_PREV"))
-
-    roads_df = pd.read_csv(roads_input)
+    roads_df = read_frame(roads_input, schema='road_features')
     merged = pd.merge(merged, roads_df, how='left', left_on=['poly_index'], right_on=['poly_index'])
 
     return merged
+
+@profiled
+def snodas_by_season(snodas_input, partition_dir, chunksize=1000000):
+    '''
+    Generate the SNODAS data of one winter season at a time. Parquet files are read one season at a time with a date
+    filter pushed down to the reader. Csv files are streamed in chunks and the rows of each chunk are appended to one
+    csv partition per season, so that no more than one chunk or one season of the SNODAS file is held in memory
+    :param snodas_input: String. Path of file containing Iowa SNODAS data
+    :param partition_dir: String. Path of directory for temporary SNODAS partitions of csv files
+    :param chunksize: Int. Number of SNODAS rows read per chunk
+    :return: Generator of (season, DataFrame) tuples, in season order
+    '''
+    columns = ['date', 'poly_index'] + SNODAS_VARIABLES
+    if file_format(snodas_input) == 'parquet':
+        seasons = np.unique(winter_season(read_frame(snodas_input, columns=['date'])['date']))
+        for season in seasons:
+            filters = [('date', '>=', pd.Timestamp(season - 1, 7, 1)), ('date', '<', pd.Timestamp(season, 7, 1))]
+            yield season, read_frame(snodas_input, schema='snodas_params', columns=columns, filters=filters)
+        return
+
+    if not os.path.exists(partition_dir):
+        os.makedirs(partition_dir)
+    for f in glob.glob(os.path.join(partition_dir, "season=*.csv")):
+        os.remove(f)
+
+    partitions = {}
+    for chunk in iter_frames(snodas_input, schema='snodas_params', columns=columns, chunksize=chunksize):
+        seasons = winter_season(chunk['date'])
+        for season in pd.unique(seasons):
+            path = os.path.join(partition_dir, f"season={season}.csv")
+            chunk[seasons == season].to_csv(path, mode='a', header=season not in partitions, index=False)
+            partitions[season] = path
+
+    for season, path in sorted(partitions.items()):
+        yield season, read_frame(path, schema='snodas_params')
+        os.remove(path)
+    os.rmdir(partition_dir)
+
+@profiled
+def join_it_iowawinter_chunked(salt_input, snodas_input, roads_input, output_dir, lags=SNODAS_LAGS,
+                               chunksize=1000000, fmt='csv', windows=ROLLING_WINDOWS):
+    '''
+    Join Iowa datasets (salt, SNODAS, roads) one winter season at a time. Each season of SNODAS data is joined against
+    the storm rows of that season and written to its own output partition. Peak memory is bounded by one season of
+    SNODAS data rather than by the full Iowa history. Lagged features that fall in the previous season (storms in the
+    first days of July) are NaN
+    :param salt_input: String. Path of file containing Iowa salt data
+    :param snodas_input: String. Path of file containing Iowa SNODAS data
+    :param roads_input: String. Path of file containing Iowa roads overlay data
+    :param output_dir: String. Path of directory for joined partitions, one file per winter season
+    :param lags: Tuple. Lags, in days prior to storm date, of SNODAS features. Lag 1 columns are suffixed _PREV
+    :param chunksize: Int. Number of SNODAS rows read per chunk
+    :param fmt: String. File format of joined partitions
+    :param windows: Tuple. Windows, in days ending on storm date, of rolling SNODAS features
+    :return: List. Paths of joined partitions
+    '''
+    salt_df = read_frame(salt_input, schema='salt_overlay')
+    salt_seasons = winter_season(salt_df['STORM_DATE'])
+    roads_df = read_frame(roads_input, schema='road_features')
+
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    #clear joined partitions of a previous build
+    for f in glob.glob(os.path.join(output_dir, "season=*.*")):
+        os.remove(f)
+
+    output_files = []
+    for season, snodas_params_df in snodas_by_season(snodas_input, os.path.join(output_dir, "_snodas_partitions"),
+                                                     chunksize=chunksize):
+        season_salt_df = salt_df[salt_seasons == season].reset_index(drop=True)
+        if season_salt_df.empty:
+            continue
+        snodas_store = SnodasStore(snodas_params_df)
+        snodas_features = [snodas_store.features(season_salt_df['STORM_DATE'], season_salt_df['poly_index'],
+                                                 lags=(0,) + tuple(lags))]
+        if windows:
+            snodas_features.append(snodas_store.rolling_features(season_salt_df['STORM_DATE'],
+                                                                 season_salt_df['poly_index'], windows))
+        merged = pd.concat([season_salt_df] + snodas_features, axis=1)
+        merged = pd.merge(merged, roads_df, how='left', left_on=['poly_index'], right_on=['poly_index'])
+
+        output_file = os.path.join(output_dir, f"season={season}.{fmt}")
+        write_frame(merged, output_file, schema='winter_iowa_joined')
+        output_files.append(output_file)
+    return output_files
@@ -4,13 +4,14 @@ import requests
 from retrying import retry
 import time
 
-from definitions import SALT_LINK
+from definitions import SALT_LINK, ARCGIS_PAUSE
 
 class Salt_client(object):
     """The Salt_client class is used to interact with the ArcGIS API for purpose of downloading historical winter
     operationsdata, including geocoded salt usage, for the Iowa department of transportation"""
-    def __init__(self, link, **kwargs):
+    def __init__(self, link, pause=ARCGIS_PAUSE, **kwargs):
         self.link = link
+        self.pause = pause #seconds between consecutive page requests
         self.call_limit = 2000
         self.record_count = None
         self.params = {
@@ -61,7 +62,7 @@ class Salt_client(object):
         #load into geodataframe and serialize to save as dataframe
         road_gdf = gpd.GeoDataFrame.from_features(response_json["features"])
 
-        time.sleep(5)
+        time.sleep(self.pause)
         offset += self.call_limit
 
         while offset < self.total_record_count:
@@ -70,7 +71,7 @@ class Salt_client(object):
             road_gdf = pd.concat([road_gdf, gpd.GeoDataFrame.from_features(response_json["features"])],
                                  ignore_index=True)
             offset += self.call_limit
-            time.sleep(5)
+            time.sleep(self.pause)
 
         return road_gdf.to_wkt()
 
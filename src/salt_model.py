@@ -1,102 +1,642 @@
 import pandas as pd
 import os
+import dill
+import copy
+import itertools
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from threadpoolctl import threadpool_limits
 from sklearn.compose import ColumnTransformer
 from sklearn.utils import shuffle
 from sklearn.ensemble import HistGradientBoostingRegressor
 from sklearn.pipeline import Pipeline
-from datetime import timedelta
-import glob
 import numpy as np
 from sklearn.linear_model import LinearRegression
+from snodas_store import SnodasStore, lag_rows, lag_suffix, rolling_columns, rolling_windows, window_lags
+from definitions import SNODAS_LAGS, SNODAS_VARIABLES
+from utility import quarter_from_path, quarter_dates, winter_season
+from storage import read_frame, iter_frames, glob_frames, find_frame
+from profiling import profiled
 
-def total_salt_per_polygon(data_input, min_solid):
+#company_model regression: market matrix, polygon weights, gravity-weighted salt by quarter and fitted LinearRegression
+CompanyFit = namedtuple("CompanyFit", ['quarters', 'polygons', 'salt', 'weights', 'volume', 'X', 'model'])
+#features of the salt model, selected from the joined Iowa winter data by the pipeline's ColumnTransformer
+FEATURE_NAMES = ['solid_precip', 'SWE', 'snow_depth', 'runoff', 'sub_pack', 'sp_temp', 'solid_precip_PREV',
+                 'liquid_precip_PREV', 'SWE_PREV', 'snow_depth_PREV', 'runoff_PREV', 'sub_pack_PREV', 'sp_temp_PREV',
+                 'WITHIN_POLY_LANE_KMS_1', 'WITHIN_POLY_LANE_KMS_3', 'WITHIN_POLY_LANE_KMS_4', 'WITHIN_POLY_LANE_KMS_5']
+#hyperparameters of the salt model's HistGradientBoostingRegressor
+TREE_PARAMS = {'max_leaf_nodes': 140, 'min_samples_leaf': 15, 'learning_rate': 0.1, 'max_iter': 100}
+
+@profiled
+def total_salt_per_polygon(data_input, min_solid, **tree_params):
     '''
     Fit machine learning model for Iowa Winter Salt Data. Label is total salt per polygon per storm date. Features are
     Lane miles by road type by polygon and SNODAS variables by polygon per storm date. Estimator is
-    HistGradientBoostingRegressor
-    :param data_input: String. Path to file containing Iowa Winter Salt Data set
+    HistGradientBoostingRegressor. The winter seasons fit are recorded in the pipeline's training_seasons
+    :param data_input: String. Path to file, or directory of season partitions, containing Iowa Winter Salt Data set
     :param min_solid: Int. Minimum amount of solid precipitation per day per polygon
+    :param tree_params: Hyperparameters of HistGradientBoostingRegressor overriding TREE_PARAMS
     :return: Pipeline.  Fitted pipeline object.
     '''
-    salt_df = pd.read_csv(data_input)
+    salt_df = read_frame(data_input, schema='winter_iowa_joined')
     salt_df = salt_df[(salt_df['solid_precip'] >= min_solid)]
     X = salt_df
     y = salt_df['WITHIN_POLY_TOTALSALT']
     X_ran, y_ran = shuffle(X, y, random_state=42)
-    feature_names = ['solid_precip', 'SWE', 'snow_depth', 'runoff', 'sub_pack', 'sp_temp', 'solid_precip_PREV',
-                     'liquid_precip_PREV', 'SWE_PREV', 'snow_depth_PREV', 'runoff_PREV', 'sub_pack_PREV',
-                     'sp_temp_PREV', 'WITHIN_POLY_LANE_KMS_1', 'WITHIN_POLY_LANE_KMS_3', 'WITHIN_POLY_LANE_KMS_4',
-                     'WITHIN_POLY_LANE_KMS_5']
-    col_trans = ColumnTransformer([('pass', 'passthrough', feature_names)], remainder='drop')
+    col_trans = ColumnTransformer([('pass', 'passthrough', FEATURE_NAMES)], remainder='drop')
     pipeline = Pipeline([('col_trans', col_trans), ('hsg', HistGradientBoostingRegressor(loss='poisson',
-                                                                                         max_leaf_nodes=140,
-                                                                                         min_samples_leaf=15))])
+                                                                                         **{**TREE_PARAMS,
+                                                                                            **tree_params}))])
     pipeline.fit(X_ran, y_ran)
+    pipeline.training_seasons = _training_seasons(salt_df)
     return pipeline
 
-def build_quarterly_storm_dataset(fitted_salt_model, snodas_input, roads_overlay_input, quarter, min_solid_precip=2):
-       snodas_params_df = pd.read_csv(snodas_input)
-       snodas_params_df['DATE'] = snodas_params_df['date'].astype('datetime64[ns]')
+def _training_seasons(salt_df):
+    return sorted(int(season) for season in np.unique(winter_season(salt_df['STORM_DATE'])))
+
+@profiled
+def continue_boosting(fitted_salt_model, data_input, min_solid, n_iter=20, **tree_params):
+    '''
+    Continue boosting a fitted salt model on Iowa Winter Salt Data. Trees are fit to the Poisson residual of the current
+    model (label divided by the current prediction, weighted by the current prediction, which is boosting from the
+    current model's log prediction) and appended to the model's HistGradientBoostingRegressor. The returned Pipeline
+    predicts exp(current raw prediction + new trees) and is used like a model fitted by total_salt_per_polygon. Its
+    training_seasons add the seasons of data_input to those of the fitted salt model, if the fitted salt model records
+    them
+    :param fitted_salt_model: Pipeline. Fitted salt model. Not modified
+    :param data_input: String or DataFrame. Path to file, or directory of season partitions, or DataFrame of Iowa
+    Winter Salt Data
+    :param min_solid: Int. Minimum amount of solid precipitation per day per polygon
+    :param n_iter: Int. Maximum number of boosting iterations added
+    :param tree_params: Hyperparameters of the added trees overriding TREE_PARAMS
+    :return: Pipeline
+    '''
+    salt_df = read_frame(data_input, schema='winter_iowa_joined') if isinstance(data_input, str) else data_input
+    salt_df = salt_df[(salt_df['solid_precip'] >= min_solid)]
+    model = copy.deepcopy(fitted_salt_model)
+    hsg = model.named_steps['hsg']
+    if type(hsg._loss.link).__name__ != 'LogLink':
+        raise ValueError("continue_boosting requires a log link loss")
+
+    X = model.named_steps['col_trans'].transform(salt_df)
+    current = hsg.predict(X)
+    residual = HistGradientBoostingRegressor(loss='poisson', **{**TREE_PARAMS, 'random_state': 0, **tree_params,
+                                                                 'max_iter': n_iter})
+    residual.fit(X, salt_df['WITHIN_POLY_TOTALSALT'].to_numpy() / current, sample_weight=current)
+
+    hsg._predictors = hsg._predictors + residual._predictors
+    hsg._baseline_prediction = hsg._baseline_prediction + residual._baseline_prediction
+    #n_iter_ is the number of predictors
+    hsg.max_iter = hsg.n_iter_
+    #models fitted before training seasons were recorded have no training_seasons, and their seasons stay unknown
+    if getattr(fitted_salt_model, 'training_seasons', None) is not None:
+        model.training_seasons = sorted(set(fitted_salt_model.training_seasons) | set(_training_seasons(salt_df)))
+    return model
+
+def load_salt_model(fitted_salt_model_path):
+    '''
+    Load dill-pickled fitted salt model
+    :param fitted_salt_model_path: String. Path of fitted salt model .pkd file
+    :return: Pipeline
+    '''
+    with open(fitted_salt_model_path, 'rb') as f:
+        return dill.load(f)
+
+def model_features(fitted_salt_model):
+    '''
+    Names of the columns used by a fitted salt model pipeline, i.e. the columns selected by its ColumnTransformer
+    :param fitted_salt_model: Pipeline. Fitted salt model
+    :return: List. Column names
+    '''
+    features = []
+    for name, transformer, columns in fitted_salt_model.named_steps['col_trans'].transformers_:
+        if transformer != 'drop' and name != 'remainder':
+            features.extend(columns)
+    return features
+
+def _assemble_storm_features(storm_df, lag_df, roads_df, lags, columns, events_df=None, windows=()):
+    '''
+    Join lagged SNODAS features, rolling SNODAS features, road features and, with events_df, storm event features to
+    storm rows
+    :param storm_df: DataFrame. SNODAS variables of storm days by date and poly_index
+    :param lag_df: DataFrame. SNODAS rows at the lagged keys, and with windows every day of the largest window, of the
+    storm rows
+    :param events_df: DataFrame. Storm event features by date and poly_index, see storm_events. Not joined if None
+    :param windows: Tuple. Windows, in days, of rolling SNODAS features
+    :return: DataFrame. One row per storm day and polygon
+    '''
+    X = storm_df.reset_index(drop=True)
+    X['STORM_DATE'] = X['date'].astype('datetime64[ns]')
+    feature_columns = [f"{v}{lag_suffix(lag)}" for lag in lags for v in SNODAS_VARIABLES]
+    if len(lag_df):
+        #lagged SNODAS features are looked up by array offset in a SnodasStore rather than by merging with itself
+        snodas_store = SnodasStore(lag_df)
+        lag_features = [snodas_store.features(X['STORM_DATE'], X['poly_index'], lags=lags)]
+        if windows:
+            lag_features.append(snodas_store.rolling_features(X['STORM_DATE'], X['poly_index'], windows))
+    else:
+        lag_features = [pd.DataFrame(np.nan, index=X.index, columns=feature_columns + rolling_columns(windows))]
+    X = pd.concat([X] + lag_features, axis=1)
+    X = pd.merge(X, roads_df, how='left', left_on=['poly_index'], right_on=['poly_index'])
+    if events_df is not None:
+        X = pd.merge(X, events_df.drop(columns=['event_id'], errors='ignore'), how='left', on=['date', 'poly_index'])
+    if columns is not None:
+        X = X[['poly_index'] + [c for c in columns if c != 'poly_index']]
+    return X
+
+def storm_features(snodas_params_df, roads_df, min_solid_precip=2, lags=SNODAS_LAGS, columns=None, events_df=None,
+                   windows=None):
+    '''
+    Assemble feature rows of storm days (solid precipitation of at least min_solid_precip) from SNODAS variables by date
+    and polygon and road features by polygon. The storm threshold is applied first; lagged SNODAS features are then
+    looked up in a SnodasStore holding only the rows at the lagged keys of storm rows, so lags of storm days are
+    available even when the prior day is not a storm day
+    :param snodas_params_df: DataFrame. SNODAS variables by date and poly_index
+    :param roads_df: DataFrame. Road features by poly_index
+    :param min_solid_precip: Int. Minimum amount of solid precipitation per day per polygon
+    :param lags: Tuple. Lags, in days, of SNODAS features
+    :param columns: List. Columns to keep, in addition to poly_index. All columns are kept if None
+    :param events_df: DataFrame. Storm event features by date and poly_index, see storm_events. Not joined if None
+    :param windows: Tuple. Windows, in days, of rolling SNODAS features. Windows of the rolling features in columns if
+    None
+    :return: DataFrame. One row per storm day and polygon
+    '''
+    windows = rolling_windows(columns or []) if windows is None else windows
+    storm_df = snodas_params_df[snodas_params_df['solid_precip'] >= min_solid_precip]
+    lag_df = lag_rows([snodas_params_df], storm_df['date'], storm_df['poly_index'], window_lags(lags, windows))
+    return _assemble_storm_features(storm_df, lag_df, roads_df, lags, columns, events_df, windows)
+
+def lead_in_file(snodas_input):
+    '''
+    Quarterly SNODAS file of the window before a quarterly SNODAS file, in the same directory. Only Q1 windows have one,
+    the Q4 file of the prior year
+    :param snodas_input: String. Path of quarterly SNODAS file
+    :return: String. Path of previous file, or None for Q4 files and missing files
+    '''
+    quarter = quarter_from_path(snodas_input)
+    if quarter[:2] != 'Q1':
+        return None
+    previous_input = find_frame(os.path.join(os.path.dirname(snodas_input), os.path.basename(snodas_input).replace(
+        quarter, f"Q4{int(quarter[2:]) - 1}")))
+    return previous_input if os.path.exists(previous_input) else None
+
+@profiled
+def lead_in_rows(snodas_input, lags):
+    '''
+    SNODAS rows of the lagged days before the first day of a quarterly SNODAS file, read from the file of the previous
+    window in the same directory. Q1 windows start on 12/31, so the lagged days of early January storms are in the
+    Q4 file of the prior year. Q4 windows follow no other window, and their lagged days before 09/30 are left missing
+    :param snodas_input: String. Path of quarterly SNODAS file
+    :param lags: Tuple. Lags, in days, of the SNODAS rows needed, see window_lags
+    :return: DataFrame. Columns = ['date', 'poly_index'] + SNODAS_VARIABLES. Empty if there is no previous file
+    '''
+    columns = ['date', 'poly_index'] + SNODAS_VARIABLES
+    previous_input = lead_in_file(snodas_input)
+    if previous_input is None or not max(lags, default=0):
+        return pd.DataFrame(columns=columns)
+    start = pd.Timestamp(quarter_dates(quarter_from_path(snodas_input))[0])
+    return read_frame(previous_input, schema='snodas_params', columns=columns,
+                      filters=[('date', '>=', start - pd.Timedelta(days=max(lags))), ('date', '<', start)])
+
+@profiled
+def storm_features_from_file(snodas_input, roads_df, min_solid_precip=2, lags=SNODAS_LAGS, columns=None,
+                             chunksize=1000000, events_df=None, windows=None):
+    '''
+    storm_features of a SNODAS file without reading the whole file into memory. Storm rows are read with the
+    solid_precip threshold pushed down to the reader, and the file is then streamed in chunks that are semi-joined
+    against the lagged keys of storm rows. Lagged days before the first day of the file are read from the previous
+    quarterly file, see lead_in_rows
+    :param snodas_input: String. Path of SNODAS file
+    :param roads_df: DataFrame. Road features by poly_index
+    :param min_solid_precip: Int. Minimum amount of solid precipitation per day per polygon
+    :param lags: Tuple. Lags, in days, of SNODAS features
+    :param columns: List. Columns to keep, in addition to poly_index. All columns are kept if None
+    :param chunksize: Int. Number of SNODAS rows read per chunk
+    :param events_df: DataFrame. Storm event features by date and poly_index, see storm_events. Not joined if None
+    :param windows: Tuple. Windows, in days, of rolling SNODAS features. Windows of the rolling features in columns if
+    None
+    :return: DataFrame. One row per storm day and polygon
+    '''
+    windows = rolling_windows(columns or []) if windows is None else windows
+    storm_df = read_frame(snodas_input, schema='snodas_params',
+                          filters=[('solid_precip', '>=', min_solid_precip)])
+    all_lags = window_lags(lags, windows)
+    frames = itertools.chain([lead_in_rows(snodas_input, all_lags)],
+                             iter_frames(snodas_input, schema='snodas_params', columns=['date', 'poly_index'] +
+                                         SNODAS_VARIABLES, chunksize=chunksize))
+    lag_df = lag_rows(frames, storm_df['date'], storm_df['poly_index'], all_lags)
+    return _assemble_storm_features(storm_df, lag_df, roads_df, lags, columns, events_df, windows)
+
+@profiled
+def storm_cell_predictions(fitted_salt_model, snodas_days_df, lag_frames, roads_df, min_solid_precip=2,
+                           lags=SNODAS_LAGS, chunksize=500000):
+    '''
+    Predict salt usage of the storm cells of a set of days. Only rows of the days with solid precipitation of at least
+    min_solid_precip are predicted, with lagged SNODAS features looked up in lag_frames
+    :param fitted_salt_model: Pipeline. Fitted salt model
+    :param snodas_days_df: DataFrame. SNODAS variables by date and poly_index of the days predicted
+    :param lag_frames: List. DataFrames of SNODAS variables by date and poly_index holding the lagged days, and the days
+    of the rolling windows of the model's features. Lagged features are NaN if missing
+    :param roads_df: DataFrame. Road features by poly_index
+    :param min_solid_precip: Int. Minimum amount of solid precipitation per day per polygon
+    :param lags: Tuple. Lags, in days, of SNODAS features
+    :param chunksize: Int. Number of rows per predict call
+    :return: DataFrame. Columns = ['date', 'poly_index', 'salt'], storm cells only
+    '''
+    features = model_features(fitted_salt_model)
+    windows = rolling_windows(features)
+    storm_df = snodas_days_df[snodas_days_df['solid_precip'] >= min_solid_precip]
+    #rolling windows end on the predicted days themselves
+    lag_df = lag_rows(list(lag_frames) + ([snodas_days_df] if windows else []), storm_df['date'],
+                      storm_df['poly_index'], window_lags(lags, windows))
+    X = _assemble_storm_features(storm_df, lag_df, roads_df, lags, ['STORM_DATE'] + features, windows=windows)
+    salt = np.empty(len(X))
+    for start in range(0, len(X), chunksize):
+        salt[start:start + chunksize] = fitted_salt_model.predict(X.iloc[start:start + chunksize])
+    return pd.DataFrame({'date': X['STORM_DATE'].to_numpy(), 'poly_index': X['poly_index'].to_numpy(), 'salt': salt})
+
+@profiled
+def build_quarterly_storm_dataset(fitted_salt_model, snodas_input, roads_overlay_input, quarter, min_solid_precip=2,
+                                  lags=SNODAS_LAGS):
+    '''
+    Predict salt usage by polygon for one quarter
+    :param fitted_salt_model: Pipeline. Fitted salt model
+    :param snodas_input: String. Path of quarterly SNODAS file
+    :param roads_overlay_input: String. Path of regional road features file
+    :param quarter: String. Quarter tag, e.g. Q12019
+    :param min_solid_precip: Int. Minimum amount of solid precipitation per day per polygon
+    :param lags: Tuple. Lags, in days, of SNODAS features
+    :return: DataFrame. Columns = ['poly_index', 'quarter', 'salt']. salt is NaN for polygons without storm days
+    '''
+    roads_df = read_frame(roads_overlay_input, schema='road_features')
+    X = storm_features_from_file(snodas_input, roads_df, min_solid_precip, lags,
+                                 windows=rolling_windows(model_features(fitted_salt_model)))
+    #all polyindexes regardless of solid precipitation or salt levels
+    polygons_df = pd.DataFrame({'poly_index': roads_df['poly_index'],
+                                'quarter': [quarter] * roads_df['poly_index'].size})
+
+    predictions = pd.DataFrame({'poly_index': X['poly_index'], "salt": fitted_salt_model.predict(X)})
+    predictions = predictions.groupby(by=['poly_index'], as_index=False, sort=False).aggregate('sum')
+
+    return pd.merge(polygons_df, predictions, how='left', left_on=['poly_index'], right_on=['poly_index'])
+
+@profiled
+def batched_quarterly_salt_predictions(fitted_salt_model, roads_overlay_input, snodas_files, min_solid_precip=2,
+                                       lags=SNODAS_LAGS, chunksize=500000):
+    '''
+    Predict salt usage by polygon for every quarter in one pass. Road features are read once, storm rows of all
+    quarters are assembled into one feature matrix holding only the model's columns, and predict is called on chunks
+    of that matrix
+    :param fitted_salt_model: Pipeline. Fitted salt model
+    :param roads_overlay_input: String. Path of regional road features file
+    :param snodas_files: List. Paths of quarterly SNODAS files
+    :param min_solid_precip: Int. Minimum amount of solid precipitation per day per polygon
+    :param lags: Tuple. Lags, in days, of SNODAS features
+    :param chunksize: Int. Number of rows per predict call
+    :return: DataFrame. Columns = ['quarter', 'poly_index', 'salt'], one row per quarter and polygon of the road
+    features, sorted by quarter and poly_index. salt is 0 for polygons without storm days
+    '''
+    roads_df = read_frame(roads_overlay_input, schema='road_features')
+    features = model_features(fitted_salt_model)
+    quarters = [quarter_from_path(file) for file in snodas_files]
+
+    blocks, quarter_codes = [], []
+    for code, file in enumerate(snodas_files):
+        X = storm_features_from_file(file, roads_df, min_solid_precip, lags, features)
+        blocks.append(X)
+        quarter_codes.append(np.full(len(X), code, dtype='int32'))
+    X = pd.concat(blocks, ignore_index=True)
+    del blocks
+
+    salt = np.empty(len(X))
+    for start in range(0, len(X), chunksize):
+        salt[start:start + chunksize] = fitted_salt_model.predict(X.iloc[start:start + chunksize])
+
+    predictions = pd.DataFrame({'quarter': np.concatenate(quarter_codes), 'poly_index': X['poly_index'].to_numpy(),
+                                'salt': salt})
+    predictions = predictions.groupby(by=['quarter', 'poly_index'], as_index=False, sort=False).aggregate('sum')
+    predictions['quarter'] = np.asarray(quarters, dtype=object)[predictions['quarter'].to_numpy()]
 
-       storm_df = snodas_params_df.copy()
-       storm_df = storm_df.rename(columns={"DATE": "STORM_DATE"})
+    #all polyindexes of every quarter regardless of solid precipitation or salt levels
+    polygons_df = pd.DataFrame({'quarter': np.repeat(np.asarray(quarters, dtype=object), roads_df['poly_index'].size),
+                                'poly_index': np.tile(roads_df['poly_index'].to_numpy(), len(quarters))})
+    predictions = pd.merge(polygons_df, predictions, how='left', on=['quarter', 'poly_index'])
+    predictions['salt'] = predictions['salt'].fillna(0.)
+    return predictions.sort_values(['quarter', 'poly_index'], ignore_index=True)
 
-       storm_df['PREV_DATE'] = storm_df['STORM_DATE'] - timedelta(days=1)
+#state of a prediction worker process, set once by _init_prediction_worker
+_worker = {}
+
+def _init_prediction_worker(fitted_salt_model_path, shm_name, shape, columns, threads):
+    '''
+    Initializer of prediction worker processes. Loads the fitted salt model once per worker and attaches to the road
+    features held in shared memory by parallel_quarterly_salt_predictions
+    '''
+    _worker['model'] = load_salt_model(fitted_salt_model_path)
+    #workers share the resource tracker of the parent, which unlinks the block once all quarters are predicted
+    _worker['shm'] = shared_memory.SharedMemory(name=shm_name)
+    _worker['roads'] = pd.DataFrame(np.ndarray(shape, dtype='float64', buffer=_worker['shm'].buf), columns=columns,
+                                    copy=False)
+    _worker['roads']['poly_index'] = _worker['roads']['poly_index'].astype('int64')
+    #limit OpenMP threads of HistGradientBoostingRegressor.predict so workers do not oversubscribe cores
+    _worker['threads'] = threadpool_limits(threads)
 
-       X = pd.merge(storm_df, snodas_params_df, how='left', left_on=['PREV_DATE', 'poly_index'],
-                                right_on=['DATE', 'poly_index'], suffixes=("", "_PREV"))
-       roads_df = pd.read_csv(roads_overlay_input)
-       X = pd.merge(X, roads_df, how='left', left_on=['poly_index'], right_on=['poly_index'])
-       #all polyindexes regardless of solid precipitation or salt levels
-       polygons_df = pd.DataFrame({'poly_index': roads_df['poly_index'],
-                     'quarter': [quarter] * roads_df['poly_index'].size})
+def _predict_quarter(snodas_input, min_solid_precip, lags):
+    '''
+    Predict salt usage by polygon for one quarter in a prediction worker
+    :return: DataFrame. Columns = ['poly_index', 'salt'], polygons with storm days only
+    '''
+    X = storm_features_from_file(snodas_input, _worker['roads'], min_solid_precip, lags,
+                                 model_features(_worker['model']))
+    predictions = pd.DataFrame({'poly_index': X['poly_index'].to_numpy(), 'salt': _worker['model'].predict(X)})
+    return predictions.groupby(by=['poly_index'], as_index=False, sort=False).aggregate('sum')
 
-       X = X[(X['solid_precip'] >= min_solid_precip)]
-       predictions = pd.DataFrame({'poly_index': X['poly_index'], "salt": fitted_salt_model.predict(X)})
-       predictions = predictions.groupby(by=['poly_index'], as_index=False, sort=False).aggregate('sum')
+@profiled
+def parallel_quarterly_salt_predictions(fitted_salt_model_path, roads_overlay_input, snodas_files, workers,
+                                        min_solid_precip=2, lags=SNODAS_LAGS):
+    '''
+    Predict salt usage by polygon for every quarter, with quarters processed concurrently by a pool of worker
+    processes. Each worker loads the fitted salt model once, and the numeric road features are shared with the workers
+    through shared memory rather than pickled per quarter. Output is ordered by quarter and poly_index regardless of
+    the order in which quarters finish
+    :param fitted_salt_model_path: String. Path of fitted salt model .pkd file
+    :param roads_overlay_input: String. Path of regional road features file
+    :param snodas_files: List. Paths of quarterly SNODAS files
+    :param workers: Int. Number of worker processes
+    :param min_solid_precip: Int. Minimum amount of solid precipitation per day per polygon
+    :param lags: Tuple. Lags, in days, of SNODAS features
+    :return: DataFrame. Columns = ['quarter', 'poly_index', 'salt'], one row per quarter and polygon of the road
+    features. salt is 0 for polygons without storm days
+    '''
+    roads_df = read_frame(roads_overlay_input, schema='road_features').select_dtypes('number')
+    roads = roads_df.to_numpy(dtype='float64')
+    shm = shared_memory.SharedMemory(create=True, size=max(roads.nbytes, 1))
+    try:
+        np.ndarray(roads.shape, dtype='float64', buffer=shm.buf)[:] = roads
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_prediction_worker,
+                                 initargs=(fitted_salt_model_path, shm.name, roads.shape, list(roads_df.columns),
+                                           threads)) as executor:
+            #map returns results in the order of snodas_files
+            results = list(executor.map(_predict_quarter, snodas_files, [min_solid_precip] * len(snodas_files),
+                                        [lags] * len(snodas_files)))
+    finally:
+        shm.close()
+        shm.unlink()
 
-       return pd.merge(polygons_df, predictions, how='left', left_on=['poly_index'], right_on=['poly_index'])
+    quarters = [quarter_from_path(file) for file in snodas_files]
+    predictions = pd.concat([result.assign(quarter=quarter) for quarter, result in zip(quarters, results)],
+                            ignore_index=True)
+    #all polyindexes of every quarter regardless of solid precipitation or salt levels
+    polygons_df = pd.DataFrame({'quarter': np.repeat(np.asarray(quarters, dtype=object), roads_df['poly_index'].size),
+                                'poly_index': np.tile(roads_df['poly_index'].to_numpy(), len(quarters))})
+    predictions = pd.merge(polygons_df, predictions, how='left', on=['quarter', 'poly_index'])
+    predictions['salt'] = predictions['salt'].fillna(0.)
+    return predictions.sort_values(['quarter', 'poly_index'], ignore_index=True)
 
+@profiled
 def quarterly_solid_precip(input_list):
     quarterly_solid_precip_df = pd.DataFrame()
 
     for file in input_list:
-        quarter = file[-10:-4]
-        temp_df = pd.read_csv(file)
+        quarter = quarter_from_path(file)
+        temp_df = read_frame(file, schema='snodas_params', columns=['poly_index', 'solid_precip'])
         temp_df['quarter'] = [quarter] * temp_df['poly_index'].size
         temp_df = temp_df.groupby(by=['quarter', 'poly_index'], as_index=False).aggregate({'solid_precip':'sum'})
         quarterly_solid_precip_df = pd.concat([quarterly_solid_precip_df, temp_df], axis=0, ignore_index=True)
     return quarterly_solid_precip_df
 
+@profiled
 def quarterly_salt_predictions(fitted_salt_model, roads_overlay_input, snodas_directory):
     quarterly_salt_predictions_df = pd.DataFrame()
-    all_files = glob.glob(os.path.join(snodas_directory, "*.csv"))
+    all_files = glob_frames(os.path.join(snodas_directory, "*"))
     for file in all_files:
-        quarter = file[-10:-4]
+        quarter = quarter_from_path(file)
         quarterly_salt_predictions_df = pd.concat([quarterly_salt_predictions_df, build_quarterly_storm_dataset(
             fitted_salt_model, snodas_input=file, roads_overlay_input=roads_overlay_input, quarter=quarter)], axis=0,
                                                   ignore_index=True)
     quarterly_salt_predictions_df = quarterly_salt_predictions_df.groupby(by=['quarter', 'poly_index'], as_index=False).aggregate('sum')
     return quarterly_salt_predictions_df
 
+@profiled
 def sales_model(quarterly_salt_input, actual_sales_input, depot_dist_input):
-    market_df = pd.read_csv(quarterly_salt_input)
-    actual_df = pd.read_csv(actual_sales_input)
-    depot_df = pd.read_csv(depot_dist_input)
+    market_df = read_frame(quarterly_salt_input, schema='salt_predictions')
+    actual_df = read_frame(actual_sales_input)
+    depot_df = read_frame(depot_dist_input, schema='depot_distances')
 
     market_df = pd.merge(market_df, actual_df, how='left', left_on='quarter', right_on='quarter')
     market_df = pd.merge(market_df, depot_df, how='left', left_on='poly_index', right_on='poly_index')
     return market_df
 
-def company_model(market_input):
-    exp = -.5
-    salt_df = market_input
-    salt_df['min_depot_distance'] = salt_df['min_depot_distance']/1000
-    salt_df['volume'] = salt_df['volume'] * 2000 * 1000
-    salt_df['estimates'] = salt_df['salt']/salt_df['min_depot_distance']**exp
-    salt_df = salt_df.groupby(by=['quarter'], as_index=False).aggregate({'min_depot_distance':'mean', 'volume':'mean', 'estimates': 'sum', 'salt':'sum'})
-    X = np.array(salt_df['estimates']).reshape(-1, 1)
-    y = salt_df['volume']
+@profiled
+def market_matrix(market_input, distance_column='min_depot_distance'):
+    '''
+    Quarter x polygon matrix of predicted salt, with distance to closest depot by polygon and company volume by quarter.
+    Distances are converted from meters to kilometers and volume from thousands of tons to pounds
+    :param market_input: DataFrame. Output of sales_model. Not modified
+    :param distance_column: String. Depot distance column, min_depot_distance or network_depot_distance
+    :return: (quarters, polygons, salt matrix, distance by polygon, volume by quarter)
+    '''
+    quarters, quarter_codes = np.unique(market_input['quarter'].to_numpy().astype(str), return_inverse=True)
+    polygons, poly_codes = np.unique(market_input['poly_index'].to_numpy(), return_inverse=True)
+    salt = np.bincount(quarter_codes * polygons.size + poly_codes,
+                       weights=np.nan_to_num(market_input['salt'].to_numpy(dtype='float64')),
+                       minlength=quarters.size * polygons.size).reshape(quarters.size, polygons.size)
+    distance = np.full(polygons.size, np.nan)
+    distance[poly_codes] = market_input[distance_column].to_numpy(dtype='float64') / 1000
+    volume = np.full(quarters.size, np.nan)
+    volume[quarter_codes] = market_input['volume'].to_numpy(dtype='float64') * 2000 * 1000
+    return quarters, polygons, salt, distance, volume
+
+def _decay_exponents(exps):
+    '''
+    Distance-decay exponents of gravity_weights and huff_weights, which weight polygons with distance ** exp
+    :param exps: Array-like. Exponents
+    :return: Ndarray. Exponents. Raises ValueError unless every exponent is negative, i.e. weights decay with distance
+    '''
+    exps = np.asarray(exps, dtype='float64')
+    if (exps >= 0).any():
+        raise ValueError(f"distance-decay exponents must be negative for weights to decay with distance: "
+                         f"{exps[exps >= 0]}")
+    return exps
+
+@profiled
+def gravity_weights(distance, exps, cutoffs=(None,)):
+    '''
+    Gravity weights of polygons for every combination of distance-decay exponent and distance cutoff. Polygon salt is
+    weighted by distance to closest depot ** exp, and polygons farther than the cutoff or without a depot distance are
+    excluded
+    :param distance: Ndarray. Distance in km to closest depot by polygon
+    :param exps: Array-like. Negative exponents, so that weights decay with distance
+    :param cutoffs: Array-like. Distance cutoffs in km, None for no cutoff
+    :return: Ndarray. Shape (number of polygons, number of exponents, number of cutoffs)
+    '''
+    exps = _decay_exponents(exps)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        kernel = np.nan_to_num(distance[:, None] ** exps[None, :], nan=0.)
+    within = np.column_stack([np.ones(distance.size, dtype=bool) if cutoff is None else distance <= cutoff
+                              for cutoff in cutoffs])
+    return kernel[:, :, None] * within[:, None, :]
+
+@profiled
+def huff_weights(depot_distances, polygons, exps, cutoffs=(None,), outside=1.):
+    '''
+    Huff-style probabilistic allocation of polygon salt. Every depot within the cutoff attracts a polygon with
+    distance ** exp, and the company's share of the polygon is the sum of its depots' attractions over that sum
+    plus the attraction of competing suppliers, outside. Polygons without a depot within the cutoff get no weight
+    :param depot_distances: DepotDistances. Polygon x depot distance matrix in meters, see Grid.depot_distance_matrix
+    :param polygons: Ndarray. poly_index of the polygons weighted
+    :param exps: Array-like. Negative exponents, so that attraction decays with distance
+    :param cutoffs: Array-like. Distance cutoffs in km, None for no cutoff
+    :param outside: Float. Attraction of competing suppliers
+    :return: Ndarray. Shape (number of polygons, number of exponents, number of cutoffs)
+    '''
+    order = np.argsort(depot_distances.poly_index)
+    position = np.clip(np.searchsorted(depot_distances.poly_index[order], polygons), 0, order.size - 1)
+    distance = depot_distances.distances[order[position]] / 1000
+    distance[depot_distances.poly_index[order[position]] != polygons] = np.nan
+
+    exps = _decay_exponents(exps)
+    weights = np.zeros((polygons.size, exps.size, len(cutoffs)))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for i, exp in enumerate(exps):
+            attraction = distance ** exp
+            attraction[np.isnan(attraction)] = 0.
+            for k, cutoff in enumerate(cutoffs):
+                total = (attraction if cutoff is None else np.where(distance <= cutoff, attraction, 0.)).sum(axis=1)
+                weights[:, i, k] = np.nan_to_num(1 / (1 + outside / total), nan=0.)
+    return weights
+
+@profiled
+def gravity_estimates(salt, weights):
+    '''
+    Weighted salt totals by quarter for every combination of distance-decay exponent and distance cutoff, in one
+    matrix product
+    :param salt: Ndarray. Quarter x polygon salt matrix
+    :param weights: Ndarray. Output of gravity_weights or huff_weights
+    :return: Ndarray. Shape (number of quarters, number of exponents, number of cutoffs)
+    '''
+    return (salt @ weights.reshape(weights.shape[0], -1)).reshape(salt.shape[0], *weights.shape[1:])
+
+@profiled
+def bootstrap_predictions(weighted_salt, volume, n_boot, seed=0, chunksize=256):
+    '''
+    Bootstrap company volume predictions of every quarter. Each resample reweights polygons with Poisson(1) counts,
+    a bootstrap of the quarter x polygon salt predictions, and refits the regression of company_model on a resample,
+    with replacement, of the quarters with known volume. A chunk of resamples is one matrix product, and the
+    regressions of all resamples in the chunk are solved in closed form at once
+    :param weighted_salt: Ndarray. Quarter x polygon matrix of salt times polygon weights
+    :param volume: Ndarray. Company volume by quarter, NaN if unknown
+    :param n_boot: Int. Number of resamples
+    :param seed: Int. Random seed
+    :param chunksize: Int. Number of resamples drawn at a time, bounding memory to chunksize x number of polygons
+    :return: Ndarray. Shape (n_boot, number of quarters)
+    '''
+    rng = np.random.default_rng(seed)
+    known = np.flatnonzero(~np.isnan(volume))
+    predictions = np.empty((n_boot, volume.size))
+    for start in range(0, n_boot, chunksize):
+        n = min(chunksize, n_boot - start)
+        estimates = rng.poisson(1., (n, weighted_salt.shape[1])) @ weighted_salt.T
+        resample = known[rng.integers(known.size, size=(n, known.size))]
+        x = np.take_along_axis(estimates, resample, axis=1)
+        y = volume[resample]
+        centered = x - x.mean(axis=1, keepdims=True)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            slope = np.nan_to_num((centered * (y - y.mean(axis=1, keepdims=True))).sum(axis=1) /
+                                  (centered ** 2).sum(axis=1))
+        intercept = y.mean(axis=1) - slope * x.mean(axis=1)
+        predictions[start:start + n] = intercept[:, None] + slope[:, None] * estimates
+    return predictions
+
+def _company_weights(polygons, distance, exps, cutoffs, depot_distances, outside):
+    if depot_distances is None:
+        return gravity_weights(distance, exps, cutoffs)
+    return huff_weights(depot_distances, polygons, exps, cutoffs, outside)
+
+@profiled
+def fit_company_model(market_input, exp=-.5, cutoff=None, depot_distances=None, outside=1.,
+                      distance_column='min_depot_distance'):
+    '''
+    Fit the linear regression of company_model on the quarters with known volume
+    :param market_input: DataFrame. Output of sales_model. Not modified
+    :param exp: Float. Negative distance-decay exponent
+    :param cutoff: Float. Depot distance cutoff in km. No cutoff if None
+    :param depot_distances: DepotDistances. Huff weights of all depots if given, see company_model
+    :param outside: Float. Attraction of competing suppliers in the Huff share
+    :param distance_column: String. Depot distance column of market_input used without depot_distances
+    :return: CompanyFit. weights has one entry per polygon
+    '''
+    quarters, polygons, salt, distance, volume = market_matrix(market_input, distance_column)
+    weights = _company_weights(polygons, distance, [exp], [cutoff], depot_distances, outside)
+    X = gravity_estimates(salt, weights).reshape(-1, 1)
+    known = ~np.isnan(volume)
     model = LinearRegression()
-    model.fit(X, y)
-    return pd.DataFrame({'quarter':salt_df['quarter'],'actual': salt_df['volume'], 'predicted': model.predict(X)})
+    model.fit(X[known], volume[known])
+    return CompanyFit(quarters, polygons, salt, weights[:, 0, 0], volume, X, model)
+
+@profiled
+def company_model(market_input, exp=-.5, cutoff=None, depot_distances=None, outside=1.,
+                  distance_column='min_depot_distance', n_boot=0, percentiles=(5, 95), seed=0):
+    '''
+    Estimate company volume by quarter with a linear regression of actual volume on gravity-weighted salt totals
+    :param market_input: DataFrame. Output of sales_model. Not modified
+    :param exp: Float. Negative distance-decay exponent. Polygon salt is weighted by distance to closest depot ** exp,
+    or, with depot_distances, depots attract polygons with distance ** exp
+    :param cutoff: Float. Polygons farther than cutoff km from a depot are excluded. No cutoff if None
+    :param depot_distances: DepotDistances. If given, polygon salt is weighted by the Huff share of all depots within
+    the cutoff instead of the distance to the closest depot, see huff_weights
+    :param outside: Float. Attraction of competing suppliers in the Huff share
+    :param distance_column: String. Depot distance column of market_input used without depot_distances
+    :param n_boot: Int. Number of bootstrap resamples of the percentile bands, see bootstrap_predictions. No bands if 0
+    :param percentiles: Tuple. Percentiles of the bootstrap predictions added as bands
+    :param seed: Int. Random seed of the bootstrap
+    :return: DataFrame. Columns = ['quarter', 'actual', 'predicted'], and a column predicted_p<percentile> for every
+    percentile if n_boot > 0
+    '''
+    fit = fit_company_model(market_input, exp, cutoff, depot_distances, outside, distance_column)
+    company_df = pd.DataFrame({'quarter': fit.quarters, 'actual': fit.volume, 'predicted': fit.model.predict(fit.X)})
+    if n_boot:
+        bands = np.percentile(bootstrap_predictions(fit.salt * fit.weights, fit.volume, n_boot, seed), percentiles,
+                              axis=0)
+        for percentile, band in zip(percentiles, bands):
+            company_df[f"predicted_p{percentile:g}"] = band
+    return company_df
+
+@profiled
+def calibrate_company_model(market_input, exps=np.arange(-30, 0) / 10, cutoffs=(None,),
+                            depot_distances=None, outside=1., distance_column='min_depot_distance'):
+    '''
+    Evaluate a grid of distance-decay exponents and distance cutoffs of company_model in one vectorized pass. For every
+    combination the linear regression of quarterly volume on gravity-weighted salt is solved in closed form and scored
+    by quarterly error
+    :param market_input: DataFrame. Output of sales_model. Not modified
+    :param exps: Array-like. Negative exponents, see gravity_weights
+    :param cutoffs: Array-like. Distance cutoffs in km, None for no cutoff
+    :param depot_distances: DepotDistances. If given, candidates use Huff weights of all depots, see company_model
+    :param outside: Float. Attraction of competing suppliers in the Huff share
+    :param distance_column: String. Depot distance column of market_input used without depot_distances
+    :return: DataFrame. Columns = ['exp', 'cutoff', 'intercept', 'slope', 'rmse', 'mape'], sorted by mape
+    '''
+    quarters, polygons, salt, distance, volume = market_matrix(market_input, distance_column)
+    exps = _decay_exponents(exps)
+    known = ~np.isnan(volume)
+    weights = _company_weights(polygons, distance, exps, cutoffs, depot_distances, outside)
+    estimates = gravity_estimates(salt, weights)[known].reshape(known.sum(), -1)
+    y = volume[known][:, None]
+
+    centered = estimates - estimates.mean(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        slope = (centered * (y - y.mean())).sum(axis=0) / (centered ** 2).sum(axis=0)
+    slope = np.nan_to_num(slope)
+    intercept = y.mean() - slope * estimates.mean(axis=0)
+    error = intercept + slope * estimates - y
+
+    grid_exps, grid_cutoffs = np.meshgrid(exps, np.arange(len(cutoffs)), indexing='ij')
+    results = pd.DataFrame({'exp': grid_exps.ravel(),
+                            'cutoff': np.array(list(cutoffs), dtype=object)[grid_cutoffs.ravel()],
+                            'intercept': intercept, 'slope': slope,
+                            'rmse': np.sqrt((error ** 2).mean(axis=0)),
+                            'mape': np.abs(error / y).mean(axis=0)})
+    return results.sort_values(['mape', 'rmse'], ignore_index=True)
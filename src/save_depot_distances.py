@@ -1,22 +1,31 @@
 from definitions import ROOT_DIR, REGIONAL_UPPER_LEFT, REGIONAL_BOTTOM_RIGHT, POLY_SIZE
 from grid import Grid, Point
 import argparse
+from storage import write_frame
 import os
 
-def save_depot_distances(depot_file, grid_file, output_file, upper_left, bottom_right, poly_size):
+def save_depot_distances(depot_file, grid_file, output_file, upper_left, bottom_right, poly_size, cache_file=None,
+                         road_files=None):
     '''
     Given a regional grid, calculate and save distances of centroid of each grid polygon from the closest CMP depot
     :param output_file: String. Relative path to output file
     :param upper_left: Tuple. Upper left coordinates of desired coverage area.
     :param bottom_right: Tuple. Bottom right coordinates of desired coverage area.
     :param poly_size: Int. Size of grid polygon dimensions in SNODAS units
+    :param cache_file: String. Relative path of polygon x depot distance matrix .npz file. Distances to depots already
+    in the file are reused, so only added depots are computed. Not saved if None
+    :param road_files: List. Relative paths of state NAR road data files. If given, road-network distance to the
+    closest depot is added as column network_depot_distance
     :return: None
     '''
     #create regional grid with polygons of size poly_size x poly_size where each unit is the size of a reference
     #(SNODAS) polygon
     regional_grid = Grid(Point(*upper_left), Point(*bottom_right), poly_size)
-    regional_grid.depot_distances_df(os.path.join(ROOT_DIR, depot_file), os.path.join(ROOT_DIR, grid_file))\
-        .to_csv(os.path.join(ROOT_DIR, output_file), index=False)
+    cache_file = os.path.join(ROOT_DIR, cache_file) if cache_file else None
+    road_inputs = [os.path.join(ROOT_DIR, f) for f in road_files] if road_files else None
+    write_frame(regional_grid.depot_distances_df(os.path.join(ROOT_DIR, depot_file), os.path.join(ROOT_DIR, grid_file),
+                                                 cache_file, road_inputs),
+                os.path.join(ROOT_DIR, output_file), schema='depot_distances')
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Save distances of centroid of each grid polygon from the closest CMP\
@@ -25,11 +34,15 @@ if __name__ == "__main__":
     parser.add_argument('-o', '--output', help='Output file')
     parser.add_argument('-d', '--depotfile', help='Depot file')
     parser.add_argument('-g', '--gridfile', help='Grid file')
+    parser.add_argument('-c', '--cachefile', default=None, help='Polygon x depot distance matrix file')
+    parser.add_argument('-r', '--roadfiles', nargs='+', default=None,
+                        help='State road files. Adds road-network distance to the closest depot')
     args = parser.parse_args()
     output_file = args.output
     depot_file = args.depotfile
     grid_file = args.gridfile
 
-    save_depot_distances(depot_file, grid_file, output_file, REGIONAL_UPPER_LEFT, REGIONAL_BOTTOM_RIGHT, POLY_SIZE)
+    save_depot_distances(depot_file, grid_file, output_file, REGIONAL_UPPER_LEFT, REGIONAL_BOTTOM_RIGHT, POLY_SIZE,
+                         args.cachefile, args.roadfiles)
 
 
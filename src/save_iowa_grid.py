@@ -1,6 +1,7 @@
 from definitions import ROOT_DIR, IOWA_UPPER_LEFT, IOWA_BOTTOM_RIGHT, POLY_SIZE
 from grid import Grid, Point
 import argparse
+from storage import write_frame
 import os
 
 def save_iowa_grid(output_file, upper_left, bottom_right, poly_size):
@@ -15,7 +16,7 @@ def save_iowa_grid(output_file, upper_left, bottom_right, poly_size):
     iowa_grid = Grid(Point(*upper_left), Point(*bottom_right), poly_size)
     # create dataframe of iowa_grid geometries for purpose of GIS overlays
     iowa_grid_df = iowa_grid.grid_df()
-    iowa_grid_df.to_csv(os.path.join(ROOT_DIR, output_file), index=False)
+    write_frame(iowa_grid_df, os.path.join(ROOT_DIR, output_file), schema='grid')
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Create and save to output file, Iowa grid with polygons of size 10x10\
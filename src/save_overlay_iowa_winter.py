@@ -1,5 +1,6 @@
 from definitions import ROOT_DIR
 import argparse
+from storage import write_frame
 import os
 from salt import build_iowa_winter, groupby_poly_iowawinter
 
@@ -11,14 +12,14 @@ def save_overlay_winter_iowa(output_file, salt_file, grid_file):
     :param salt_file: String. Relative path to .csv file containing Dataframe of winter Iowa salt data.
     :param grid_file: String. Relative path to .csv file containing Dataframe of Iowa grid
     :return: None
-    :modifies: Outputfile. Saves overlay with salt data summarized per polygon per storm date in Dataframe. .csv format.
+    :modifies: Outputfile. Saves overlay with salt data summarized per polygon per storm date in Dataframe.
     '''
     #create initial overlay and calculate per segment per polygon salt metrics
     salt_df = build_iowa_winter(salt_input=os.path.join(ROOT_DIR, salt_file),
                                    grid_input=os.path.join(ROOT_DIR, grid_file))
     # group by polygon and sum up total salt that falls within each polygon by storm date
-    groupby_poly_iowawinter(salt_input=salt_df) \
-        .to_csv(os.path.join(ROOT_DIR, output_file), index=False)
+    write_frame(groupby_poly_iowawinter(salt_input=salt_df), os.path.join(ROOT_DIR, output_file),
+                schema='salt_overlay')
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Create, and save to output file, overlay of Iowa grid with winter\
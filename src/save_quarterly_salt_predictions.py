@@ -1,36 +1,76 @@
 import argparse
-import glob
 import os
-import dill
 import pandas as pd
-from definitions import ROOT_DIR
-from salt_model import build_quarterly_storm_dataset
+from definitions import ROOT_DIR, MIN_SOLID, SNODAS_LAGS, POLY_SIZE
+from prediction_cache import PredictionCache
+from salt_model import build_quarterly_storm_dataset, batched_quarterly_salt_predictions, \
+    parallel_quarterly_salt_predictions, load_salt_model
+from storage import glob_frames
+from utility import quarter_from_path
 
-def save_quarterly_salt_predictions(fitted_salt_model_path, roads_overlay_input, snodas_directory,):
+def quarterly_salt_predictions(fitted_salt_model_path, roads_overlay_input, snodas_files, batched=False,
+                               chunksize=500000, workers=1, min_solid_precip=MIN_SOLID):
+    '''
+    Predictions of salt usage by polygon for each quarter of a list of quarterly-regional datasets
+    :param fitted_salt_model_path: String. Path of fitted salt model .pkd file
+    :param roads_overlay_input: String. Path of regional road overlay file
+    :param snodas_files: List. Paths of quarterly regional SNODAS files
+    :param batched: Boolean. Predict all quarters in one pass over one feature matrix rather than quarter by quarter
+    :param chunksize: Int. Number of rows per predict call in batched mode
+    :param workers: Int. Number of worker processes. Quarters are predicted concurrently if greater than 1
+    :param min_solid_precip: Int. Minimum amount of solid precipitation per day per polygon
+    :return: DataFrame. Columns = ['quarter', 'poly_index', 'salt']
+    '''
+    if workers > 1:
+        return parallel_quarterly_salt_predictions(fitted_salt_model_path, roads_overlay_input, snodas_files, workers,
+                                                   min_solid_precip)
+
+    fitted_salt_model = load_salt_model(fitted_salt_model_path)
+
+    if batched:
+        return batched_quarterly_salt_predictions(fitted_salt_model, roads_overlay_input, snodas_files,
+                                                  min_solid_precip, chunksize=chunksize)
+    quarterly_salt_predictions_df = pd.concat([
+        build_quarterly_storm_dataset(fitted_salt_model, snodas_input=file, roads_overlay_input=roads_overlay_input,
+                                      quarter=quarter_from_path(file), min_solid_precip=min_solid_precip)
+        for file in snodas_files], axis=0, ignore_index=True)
+    return quarterly_salt_predictions_df.groupby(by=['quarter', 'poly_index'], as_index=False).aggregate('sum')
+
+def save_quarterly_salt_predictions(fitted_salt_model_path, roads_overlay_input, snodas_directory, output_file,
+                                    batched=False, chunksize=500000, workers=1, cache_dir=None,
+                                    min_solid_precip=MIN_SOLID, poly_size=POLY_SIZE):
     '''
     Using fitted salt model and quarterly-regional datasets to make predictions of salt usage by polygon for each
     quarter
-    :param fitted_salt_model_path:
-    :param roads_overlay_input:
-    :param snodas_directory:
-    :param quarterly_predictions_path:
-    :return:
+    :param fitted_salt_model_path: String. Relative path of fitted salt model .pkd file
+    :param roads_overlay_input: String. Relative path of regional road overlay file
+    :param snodas_directory: String. Relative directory of quarterly regional SNODAS files
+    :param output_file: String. Relative path of output file
+    :param batched: Boolean. Predict all quarters in one pass over one feature matrix rather than quarter by quarter
+    :param chunksize: Int. Number of rows per predict call in batched mode
+    :param workers: Int. Number of worker processes. Quarters are predicted concurrently if greater than 1
+    :param cache_dir: String. Relative directory of per-quarter prediction cache. Every quarter is predicted if None
+    :param min_solid_precip: Int. Minimum amount of solid precipitation per day per polygon
+    :param poly_size: Int. Size of grid polygon dimensions of the quarterly regional SNODAS files, e.g. a level of
+    the grid pyramid
+    :return: None
     '''
-    with open(os.path.join(ROOT_DIR, fitted_salt_model_path), 'rb') as f:
-        fitted_salt_model = dill.load(f)
-
-    quarterly_salt_predictions_df = pd.DataFrame()
-    all_files = glob.glob(os.path.join(ROOT_DIR, snodas_directory, "snodas_params_regional_poly10_Q*.csv"))
-    for file in all_files:
-        quarter = file[-10:-4]
-        quarterly_salt_predictions_df = pd.concat([quarterly_salt_predictions_df,
-                build_quarterly_storm_dataset(fitted_salt_model, snodas_input=file,
-                                              roads_overlay_input=os.path.join(ROOT_DIR, roads_overlay_input),
-                                              quarter=quarter)],
-                axis=0,
-                ignore_index=True)
-        quarterly_salt_predictions_df.groupby(by=['quarter', 'poly_index'], as_index=False).aggregate('sum')\
-            .to_csv(os.path.join(ROOT_DIR, output_file))
+    fitted_salt_model_path = os.path.join(ROOT_DIR, fitted_salt_model_path)
+    roads_overlay_input = os.path.join(ROOT_DIR, roads_overlay_input)
+    all_files = glob_frames(os.path.join(ROOT_DIR, snodas_directory,
+                                          f"snodas_params_regional_poly{poly_size}_Q*"))
+
+    def predict(snodas_files):
+        return quarterly_salt_predictions(fitted_salt_model_path, roads_overlay_input, snodas_files, batched,
+                                          chunksize, workers, min_solid_precip)
+
+    if cache_dir:
+        cache = PredictionCache(os.path.join(ROOT_DIR, cache_dir), fitted_salt_model_path, roads_overlay_input,
+                                min_solid_precip, SNODAS_LAGS)
+        quarterly_salt_predictions_df = cache.predictions(all_files, predict)
+    else:
+        quarterly_salt_predictions_df = predict(all_files)
+    quarterly_salt_predictions_df.to_csv(os.path.join(ROOT_DIR, output_file))
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Create Dataframes of regional SNODAS params by polygon for each\
@@ -40,10 +80,20 @@ if __name__ == "__main__":
     parser.add_argument('-s', '--saltmodelfile', help='Fitted salt model file path')
     parser.add_argument('-r', '--roadoverlayfile', help='Regional road overlay file path')
     parser.add_argument('-d', '--snodasdirectory', help='Relative directory of snodas regional files')
+    parser.add_argument('-b', '--batched', action='store_true',
+                        help='Predict all quarters in one pass over one feature matrix')
+    parser.add_argument('-cs', '--chunksize', type=int, default=500000, help='Rows per predict call in batched mode')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='Number of worker processes predicting quarters')
+    parser.add_argument('-cd', '--cachedir', default=None,
+                        help='Relative directory of per-quarter prediction cache. Only stale quarters are predicted')
+    parser.add_argument('-ps', '--polysize', type=int, default=POLY_SIZE,
+                        help='Polygon size of quarterly regional SNODAS files')
     args = parser.parse_args()
     output_file = args.output
     snodas_directory = args.snodasdirectory
     fitted_salt_model_path = args.saltmodelfile
     road_overlays_input = args.roadoverlayfile
 
-    save_quarterly_salt_predictions(fitted_salt_model_path, road_overlays_input, snodas_directory)
+    save_quarterly_salt_predictions(fitted_salt_model_path, road_overlays_input, snodas_directory, output_file,
+                                    args.batched, args.chunksize, args.workers, args.cachedir,
+                                    poly_size=args.polysize)
@@ -0,0 +1,129 @@
+import argparse
+import os
+import logging
+import pandas as pd
+from definitions import ROOT_DIR, REGIONAL_UPPER_LEFT, REGIONAL_BOTTOM_RIGHT, STATE_BREVS, PYRAMID_SIZES
+from grid import Point, grid_pyramid, load_mask
+from roads import nar_overlay, regional_nar_overlay_road_features, roll_up_road_features
+from snodas import snodas_regional_pyramid
+from storage import write_frame
+from utility import quarter_dates, configure_logging
+
+logger = logging.getLogger(__name__)
+
+def pyramid_files(output_directory, poly_sizes, fmt='csv', quarter=None):
+    '''
+    Paths of the files of each level of a grid pyramid. Files keep the names of the regional poly10 targets with the
+    poly size of the level
+    :param output_directory: String. Relative directory of pyramid files
+    :param poly_sizes: Iterable of Int. Sizes of Grid polygons of the levels
+    :param fmt: String. File format, csv or parquet
+    :param quarter: String. Quarter tag of SNODAS files, e.g. Q12019. No SNODAS files if None
+    :return: Dictionary. keys = poly size, values = dictionary of paths of 'grid', 'road_features' and 'snodas' files
+    '''
+    files = {}
+    for poly_size in sorted(set(poly_sizes)):
+        files[poly_size] = {
+            'grid': os.path.join(output_directory, f"regional_poly{poly_size}_grid.{fmt}"),
+            'road_features': os.path.join(output_directory, f"regional_road_overlay_poly{poly_size}.{fmt}")}
+        if quarter:
+            files[poly_size]['snodas'] = os.path.join(output_directory,
+                                                      f"snodas_params_regional_poly{poly_size}_{quarter}.{fmt}")
+    return files
+
+def save_pyramid_grids(output_directory, poly_sizes=PYRAMID_SIZES, fmt='csv', mask_file=None,
+                       upper_left=REGIONAL_UPPER_LEFT, bottom_right=REGIONAL_BOTTOM_RIGHT):
+    '''
+    Write the regional grid of every level of a grid pyramid
+    :param output_directory: String. Relative directory of pyramid files
+    :param poly_sizes: Iterable of Int. Sizes of Grid polygons, each dividing the next
+    :param fmt: String. File format, csv or parquet
+    :param mask_file: String. Relative path of mask polygon file. No mask if None
+    :param upper_left: Tuple. Upper left coordinates of coverage area
+    :param bottom_right: Tuple. Bottom right coordinates of coverage area
+    :return: None
+    '''
+    mask = load_mask(os.path.join(ROOT_DIR, mask_file)) if mask_file else None
+    files = pyramid_files(output_directory, poly_sizes, fmt)
+    os.makedirs(os.path.join(ROOT_DIR, output_directory), exist_ok=True)
+    for grid in grid_pyramid(Point(*upper_left), Point(*bottom_right), poly_sizes, mask):
+        write_frame(grid.grid_df(), os.path.join(ROOT_DIR, files[grid.poly_size]['grid']), schema='grid')
+
+def save_pyramid_snodas(quarter, output_directory, poly_sizes=PYRAMID_SIZES, fmt='csv', mask_file=None,
+                        snodas_dir="data/raw/snodas_params", upper_left=REGIONAL_UPPER_LEFT,
+                        bottom_right=REGIONAL_BOTTOM_RIGHT):
+    '''
+    Write the quarterly SNODAS file of every level of a grid pyramid from one pass over each day of the quarter
+    :param quarter: String. Quarter tag, e.g. Q12019
+    :param output_directory: String. Relative directory of pyramid files
+    :param poly_sizes: Iterable of Int. Sizes of Grid polygons, each dividing the next
+    :param fmt: String. File format, csv or parquet
+    :param mask_file: String. Relative path of mask polygon file. No mask if None
+    :param snodas_dir: String. Relative path of directory of unpacked SNODAS files
+    :param upper_left: Tuple. Upper left coordinates of coverage area
+    :param bottom_right: Tuple. Bottom right coordinates of coverage area
+    :return: None
+    '''
+    mask = load_mask(os.path.join(ROOT_DIR, mask_file)) if mask_file else None
+    grids = grid_pyramid(Point(*upper_left), Point(*bottom_right), poly_sizes, mask)
+    files = pyramid_files(output_directory, poly_sizes, fmt, quarter)
+    os.makedirs(os.path.join(ROOT_DIR, output_directory), exist_ok=True)
+    for grid, snodas_df in zip(grids, snodas_regional_pyramid(grids, *quarter_dates(quarter),
+                                                              os.path.join(ROOT_DIR, snodas_dir))):
+        write_frame(snodas_df, os.path.join(ROOT_DIR, files[grid.poly_size]['snodas']), schema='snodas_params')
+
+def save_pyramid_road_features(states, output_directory, poly_sizes=PYRAMID_SIZES, fmt='csv',
+                               roads_directory='data/raw', state_brevs=STATE_BREVS, upper_left=REGIONAL_UPPER_LEFT,
+                               bottom_right=REGIONAL_BOTTOM_RIGHT):
+    '''
+    Write road features of every level of a grid pyramid. State roads are overlaid with the grid of the finest level
+    only, and the road features of each coarser level are rolled up from the level below
+    :param states: List. States in CMP's market, with spaces replaced by underscores
+    :param output_directory: String. Relative directory of pyramid files, holding the grids of save_pyramid_grids
+    :param poly_sizes: Iterable of Int. Sizes of Grid polygons, each dividing the next
+    :param fmt: String. File format, csv or parquet
+    :param roads_directory: String. Relative directory of state roads files
+    :param state_brevs: Dictionary. keys = full state name, values = two-letter state abbreviation
+    :param upper_left: Tuple. Upper left coordinates of coverage area
+    :param bottom_right: Tuple. Bottom right coordinates of coverage area
+    :return: None
+    '''
+    grids = grid_pyramid(Point(*upper_left), Point(*bottom_right), poly_sizes)
+    files = pyramid_files(output_directory, poly_sizes, fmt)
+    finest_grid_file = os.path.join(ROOT_DIR, files[grids[0].poly_size]['grid'])
+    overlay = pd.concat([nar_overlay(state_brevs.get(state),
+                                     nar_input=os.path.join(ROOT_DIR, roads_directory, f"roads_data_{state}.csv"),
+                                     grid_input=finest_grid_file) for state in states], ignore_index=True)
+    road_features_df = regional_nar_overlay_road_features(regional_overlay_input=overlay)
+    logger.info("%d states, %d polygons with roads at poly size %d", len(states), len(road_features_df),
+                grids[0].poly_size)
+    write_frame(road_features_df, os.path.join(ROOT_DIR, files[grids[0].poly_size]['road_features']),
+                schema='road_features')
+    for finer, coarser in zip(grids[:-1], grids[1:]):
+        road_features_df = roll_up_road_features(road_features_df,
+                                                 finer.coarsen(road_features_df['poly_index'], coarser.poly_size))
+        write_frame(road_features_df, os.path.join(ROOT_DIR, files[coarser.poly_size]['road_features']),
+                    schema='road_features')
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Create regional grids, quarterly SNODAS files and road features at '
+                                                 'several polygon sizes, nested into each other')
+    # CLI arguments with short and long flags
+    parser.add_argument('-st', '--stage', choices=('grids', 'snodas', 'road_features'), required=True,
+                        help='Files to create')
+    parser.add_argument('-d', '--directory', default='data/interim/pyramid', help='Output directory')
+    parser.add_argument('-ps', '--polysizes', type=int, nargs='+', default=PYRAMID_SIZES,
+                        help='Polygon sizes in SNODAS units, each dividing the next')
+    parser.add_argument('-f', '--format', default='csv', help='File format')
+    parser.add_argument('-q', '--quarter', help='Quarter of SNODAS files, e.g. Q12019')
+    parser.add_argument('-s', '--states', nargs='*', help='States of road features')
+    parser.add_argument('-m', '--mask', default=None, help='Mask polygon file, e.g. boundaries of market states')
+    args = parser.parse_args()
+    configure_logging()
+
+    if args.stage == 'grids':
+        save_pyramid_grids(args.directory, args.polysizes, args.format, args.mask)
+    elif args.stage == 'snodas':
+        save_pyramid_snodas(args.quarter, args.directory, args.polysizes, args.format, args.mask)
+    else:
+        save_pyramid_road_features(args.states, args.directory, args.polysizes, args.format)
@@ -1,8 +1,10 @@
 import argparse
 import os
+import logging
 from roads import nar_combine_overlays, regional_nar_overlay_road_features
 from definitions import ROOT_DIR, STATE_BREVS
-import glob
+from storage import write_frame, glob_frames
+from utility import configure_logging
 
 def save_regional_road_overlay(overlays_directory, output_file):
     '''
@@ -12,11 +14,11 @@ def save_regional_road_overlay(overlays_directory, output_file):
     :return: None
     '''
 
-    all_files = glob.glob(os.path.join(ROOT_DIR, overlays_directory, "regional_poly_10_road_overlay_*.csv"))
-    print(all_files)
+    all_files = glob_frames(os.path.join(ROOT_DIR, overlays_directory, "regional_poly_10_road_overlay_*"))
+    logging.getLogger(__name__).info("combining %d state overlays", len(all_files))
     combined_overlay = nar_combine_overlays(all_files)
-    regional_nar_overlay_road_features(regional_overlay_input=combined_overlay)\
-        .to_csv(os.path.join(ROOT_DIR, output_file), index=False)
+    write_frame(regional_nar_overlay_road_features(regional_overlay_input=combined_overlay),
+                os.path.join(ROOT_DIR, output_file), schema='road_features')
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Combine state road overlays and add road features state's road data")
@@ -26,6 +28,6 @@ if __name__ == "__main__":
     args = parser.parse_args()
     output_file = args.output
     overlays_directory = args.directory
-    print(overlays_directory)
+    configure_logging()
     save_regional_road_overlay(overlays_directory, output_file)
 
@@ -2,35 +2,32 @@ from definitions import ROOT_DIR, REGIONAL_UPPER_LEFT, REGIONAL_BOTTOM_RIGHT, PO
 from snodas import snodas_regional_with_poly_index
 import argparse
 import os
-from grid import Grid, Point
+from storage import write_frame
+from utility import quarter_from_path, quarter_dates, configure_logging
+from grid import Grid, Point, load_mask
 
-def save_regional_snodas(upper_left, bottom_right, poly_size, output_file):
+def save_regional_snodas(upper_left, bottom_right, poly_size, output_file, mask_file=None):
     '''
     Create SNODAS data sets corresponding to regional grid area for each quarter in time frame.
     :param regional_grid: Grid. Grid corresponding to entire market area
+    :param mask_file: String. Relative path of mask polygon file. Only SNODAS polygons of grid polygons intersecting
+    the mask are aggregated. All if None
     :return: None
     '''
+    mask = load_mask(os.path.join(ROOT_DIR, mask_file)) if mask_file else None
     # create regional grid with polygons of size 10 x 10 where each unit is the size of a reference (SNODAS) polygon
-    regional_grid = Grid(Point(*upper_left), Point(*bottom_right), poly_size)
-    quarter = output_file[-10:-8]
-    year = int(output_file[-8:-4])
-    if quarter == 'Q1':
-        snodas_regional_with_poly_index(regional_grid, f"12/31/{year - 1}", f"04/01/{year}") \
-            .to_csv(os.path.join(ROOT_DIR, 'data/interim/' + f'snodas_params_regional_poly{poly_size}_Q1{year}.csv'))
-    else:
-        snodas_regional_with_poly_index(regional_grid, f"09/30/{year}", f"01/01/{year + 1}") \
-            .to_csv(os.path.join(ROOT_DIR, 'data/interim/' + f'snodas_params_regional_poly{poly_size}_Q4{year}.csv'))
+    regional_grid = Grid(Point(*upper_left), Point(*bottom_right), poly_size, mask=mask)
+    snodas_df = snodas_regional_with_poly_index(regional_grid, *quarter_dates(quarter_from_path(output_file)))
+    write_frame(snodas_df, os.path.join(ROOT_DIR, output_file), schema='snodas_params')
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Create Dataframes of regional SNODAS params by polygon for each\
                                                  quarter')
     # CLI arguments with short and long flags
     parser.add_argument('-o', '--output', help='Output file')
+    parser.add_argument('-m', '--mask', default=None, help='Mask polygon file, e.g. boundaries of market states')
     args = parser.parse_args()
     output_file = args.output
 
-    save_regional_snodas(REGIONAL_UPPER_LEFT, REGIONAL_BOTTOM_RIGHT, POLY_SIZE, output_file)
-
-
-
-
+    configure_logging()
+    save_regional_snodas(REGIONAL_UPPER_LEFT, REGIONAL_BOTTOM_RIGHT, POLY_SIZE, output_file, args.mask)
@@ -0,0 +1,254 @@
+import argparse
+import os
+import glob
+import logging
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from threadpoolctl import threadpool_limits
+from definitions import ROOT_DIR, REGIONAL_UPPER_LEFT, REGIONAL_BOTTOM_RIGHT, STATE_BREVS, STATES, MIN_SOLID, \
+    TILE_POLYS
+from grid import Grid, Point, load_mask
+from roads import nar_overlay, regional_nar_overlay_road_features, roads_by_tile
+from salt_model import load_salt_model, batched_quarterly_salt_predictions
+from snodas import snodas_day_tiles
+from storage import read_frame, write_frame, FORMATS
+from utility import quarter_dates, configure_logging
+from profiling import profiled
+
+logger = logging.getLogger(__name__)
+
+'''
+Chunked regional run for fine grids, e.g. SNODAS native resolution (poly_size=1). The regional grid is split into
+square tiles of polygons, and every stage writes per-tile outputs to <output_directory>/tile_<id>/:
+    grid.<fmt>: polygons of the tile
+    roads/<state>.<fmt>: state roads crossing the tile
+    road_features.<fmt>: road features of the polygons of the tile
+    snodas_params_regional_poly<size>_<quarter>/<yyyy-mm-dd>.<fmt>: SNODAS variables by polygon, one partition per day
+    salt_predictions.csv: salt predictions by quarter and polygon
+Tiles are independent, so memory is bounded by one tile, or by the SNODAS rasters of one day, per worker process
+'''
+
+def tile_directory(output_directory, tile_id):
+    '''
+    Directory of the outputs of a tile
+    :param output_directory: String. Directory of the chunked run
+    :param tile_id: Int. Tile number
+    :return: String
+    '''
+    return os.path.join(output_directory, f"tile_{tile_id:04d}")
+
+def tiled_grid(poly_size, tile_polys=TILE_POLYS, mask_file=None, upper_left=REGIONAL_UPPER_LEFT,
+               bottom_right=REGIONAL_BOTTOM_RIGHT):
+    '''
+    Regional grid and its tiles. Tiles whose polygons are all left out by the mask are dropped
+    :param poly_size: Int. Size of grid polygon dimensions in SNODAS units
+    :param tile_polys: Int. Width and height of a tile, in grid polygons
+    :param mask_file: String. Relative path of mask polygon file. No mask if None
+    :param upper_left: Tuple. Upper left coordinates of coverage area
+    :param bottom_right: Tuple. Bottom right coordinates of coverage area
+    :return: (Grid, List of Tile)
+    '''
+    mask = load_mask(os.path.join(ROOT_DIR, mask_file)) if mask_file else None
+    grid = Grid(Point(*upper_left), Point(*bottom_right), poly_size, mask=mask)
+    tiles = grid.tiles(tile_polys)
+    if mask is not None:
+        tiles = [tile for tile in tiles if grid.tile_poly_index(tile).size]
+    logger.info("%d x %d polygons of size %d in %d tiles", *grid.poly_shape(), poly_size, len(tiles))
+    return grid, tiles
+
+#state of a tile worker process, set once by _init_tile_worker
+_worker = {}
+
+def _init_tile_worker(poly_size, tile_polys, mask_file):
+    '''
+    Initializer of SNODAS worker processes. Builds the grid and its tiles once per worker
+    '''
+    _worker['grid'], _worker['tiles'] = tiled_grid(poly_size, tile_polys, mask_file)
+
+def _init_prediction_worker(fitted_salt_model_path, threads):
+    '''
+    Initializer of prediction worker processes. Loads the fitted salt model once per worker
+    '''
+    _worker['model'] = load_salt_model(fitted_salt_model_path)
+    #limit OpenMP threads of HistGradientBoostingRegressor.predict so workers do not oversubscribe cores
+    _worker['threads'] = threadpool_limits(threads)
+
+def _save_snodas_day(date, quarter, output_directory, fmt, snodas_dir):
+    '''
+    Write the SNODAS partition of one day of every tile in a tile worker
+    :return: Int. Number of polygon rows written
+    '''
+    grid = _worker['grid']
+    rows = 0
+    for tile, tile_df in snodas_day_tiles(grid, _worker['tiles'], date, snodas_dir):
+        day_directory = os.path.join(tile_directory(output_directory, tile.tile_id),
+                                     f"snodas_params_regional_poly{grid.poly_size}_{quarter}")
+        os.makedirs(day_directory, exist_ok=True)
+        write_frame(tile_df, os.path.join(day_directory, f"{date:%Y-%m-%d}.{fmt}"), schema='snodas_params')
+        rows += len(tile_df)
+    return rows
+
+def _save_tile_road_features(directory, fmt, state_brevs):
+    '''
+    Overlay the roads partitions of a tile with the polygons of the tile and write road features of the tile. No
+    road features are written if no road section is within a polygon of the tile
+    :return: Int. Number of polygons with roads
+    '''
+    partitions = sorted(f for f in glob.glob(os.path.join(directory, 'roads', '*.*'))
+                        if f.rsplit('.', 1)[-1] in FORMATS)
+    overlay = pd.concat([nar_overlay(state_brevs.get(os.path.splitext(os.path.basename(f))[0]), nar_input=f,
+                                     grid_input=os.path.join(directory, f"grid.{fmt}")) for f in partitions],
+                        ignore_index=True)
+    if overlay.empty:
+        return 0
+    road_features_df = regional_nar_overlay_road_features(regional_overlay_input=overlay)
+    write_frame(road_features_df, os.path.join(directory, f"road_features.{fmt}"), schema='road_features')
+    return len(road_features_df)
+
+def _predict_tile(directory, fmt, min_solid_precip):
+    '''
+    Predict salt usage by quarter and polygon of a tile in a tile worker
+    :return: Int. Number of prediction rows written
+    '''
+    snodas_directories = sorted(d for d in glob.glob(os.path.join(directory, 'snodas_params_regional_poly*_Q*'))
+                                if os.path.isdir(d))
+    predictions = batched_quarterly_salt_predictions(_worker['model'], os.path.join(directory, f"road_features.{fmt}"),
+                                                     snodas_directories, min_solid_precip)
+    predictions.to_csv(os.path.join(directory, 'salt_predictions.csv'), index=False)
+    return len(predictions)
+
+@profiled
+def save_tile_grids(output_directory, poly_size, tile_polys=TILE_POLYS, fmt='csv', mask_file=None):
+    '''
+    Write the polygons of every tile of the regional grid
+    :param output_directory: String. Relative directory of the chunked run
+    :param poly_size: Int. Size of grid polygon dimensions in SNODAS units
+    :param tile_polys: Int. Width and height of a tile, in grid polygons
+    :param fmt: String. File format, csv or parquet
+    :param mask_file: String. Relative path of mask polygon file. No mask if None
+    :return: None
+    '''
+    grid, tiles = tiled_grid(poly_size, tile_polys, mask_file)
+    for tile in tiles:
+        directory = os.path.join(ROOT_DIR, tile_directory(output_directory, tile.tile_id))
+        os.makedirs(directory, exist_ok=True)
+        write_frame(grid.grid_df(grid.tile_poly_index(tile)), os.path.join(directory, f"grid.{fmt}"), schema='grid')
+
+@profiled
+def save_tile_road_features(states, output_directory, poly_size, tile_polys=TILE_POLYS, fmt='csv', mask_file=None,
+                            workers=1, roads_directory='data/raw', state_brevs=STATE_BREVS):
+    '''
+    Write road features of every tile. State roads are read one state at a time and split into the tiles they cross,
+    then tiles are overlaid with their roads concurrently. Tiles without roads get no road features and are not
+    predicted
+    :param states: List. States in CMP's market, with spaces replaced by underscores
+    :param output_directory: String. Relative directory of the chunked run, holding the grids of save_tile_grids
+    :param poly_size: Int. Size of grid polygon dimensions in SNODAS units
+    :param tile_polys: Int. Width and height of a tile, in grid polygons
+    :param fmt: String. File format, csv or parquet
+    :param mask_file: String. Relative path of mask polygon file. No mask if None
+    :param workers: Int. Number of worker processes overlaying tiles
+    :param roads_directory: String. Relative directory of state roads files
+    :param state_brevs: Dictionary. keys = full state name, values = two-letter state abbreviation
+    :return: None
+    '''
+    grid, tiles = tiled_grid(poly_size, tile_polys, mask_file)
+    tiles_with_roads = set()
+    for state in states:
+        road_gdf = read_frame(os.path.join(ROOT_DIR, roads_directory, f"roads_data_{state}.csv"), schema='roads',
+                              geometry=True)
+        for tile, tile_roads in roads_by_tile(road_gdf, grid, tiles):
+            directory = os.path.join(ROOT_DIR, tile_directory(output_directory, tile.tile_id), 'roads')
+            os.makedirs(directory, exist_ok=True)
+            write_frame(tile_roads.to_wkt(), os.path.join(directory, f"{state}.{fmt}"), schema='roads')
+            tiles_with_roads.add(tile.tile_id)
+        logger.info("%s: %d roads", state, len(road_gdf))
+        del road_gdf
+
+    directories = [os.path.join(ROOT_DIR, tile_directory(output_directory, tile_id))
+                   for tile_id in sorted(tiles_with_roads)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        polygons = sum(executor.map(_save_tile_road_features, directories, [fmt] * len(directories),
+                                    [state_brevs] * len(directories)))
+    logger.info("%d polygons with roads in %d tiles", polygons, len(directories))
+
+@profiled
+def save_tile_snodas(quarter, output_directory, poly_size, tile_polys=TILE_POLYS, fmt='csv', mask_file=None,
+                     workers=1, snodas_dir='data/raw/snodas_params'):
+    '''
+    Write SNODAS variables by polygon of every tile for a quarter, one partition per tile and day. Days are processed
+    concurrently, and the SNODAS rasters of each day are read once for all tiles
+    :param quarter: String. Quarter tag, e.g. Q12019
+    :param output_directory: String. Relative directory of the chunked run
+    :param poly_size: Int. Size of grid polygon dimensions in SNODAS units
+    :param tile_polys: Int. Width and height of a tile, in grid polygons
+    :param fmt: String. File format, csv or parquet
+    :param mask_file: String. Relative path of mask polygon file. No mask if None
+    :param workers: Int. Number of worker processes reducing days
+    :param snodas_dir: String. Relative path of directory of unpacked SNODAS files
+    :return: None
+    '''
+    dates = pd.date_range(*quarter_dates(quarter))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_tile_worker,
+                             initargs=(poly_size, tile_polys, mask_file)) as executor:
+        rows = sum(executor.map(_save_snodas_day, dates, [quarter] * dates.size,
+                                [os.path.join(ROOT_DIR, output_directory)] * dates.size, [fmt] * dates.size,
+                                [os.path.join(ROOT_DIR, snodas_dir)] * dates.size))
+    logger.info("%s: %d polygon days", quarter, rows)
+
+@profiled
+def save_tile_predictions(fitted_salt_model_path, output_directory, output_file, fmt='csv', workers=1,
+                          min_solid_precip=MIN_SOLID):
+    '''
+    Predict salt usage by quarter and polygon of every tile with road features, concurrently, and append the tile
+    predictions to one output file, tile by tile
+    :param fitted_salt_model_path: String. Relative path of fitted salt model .pkd file
+    :param output_directory: String. Relative directory of the chunked run
+    :param output_file: String. Relative path of quarterly salt predictions csv file
+    :param fmt: String. File format, csv or parquet
+    :param workers: Int. Number of worker processes predicting tiles
+    :param min_solid_precip: Int. Minimum amount of solid precipitation per day per polygon
+    :return: None
+    '''
+    directories = sorted(d for d in glob.glob(os.path.join(ROOT_DIR, output_directory, 'tile_*'))
+                         if os.path.exists(os.path.join(d, f"road_features.{fmt}")))
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_prediction_worker,
+                             initargs=(os.path.join(ROOT_DIR, fitted_salt_model_path), threads)) as executor:
+        rows = sum(executor.map(_predict_tile, directories, [fmt] * len(directories),
+                                [min_solid_precip] * len(directories)))
+    with open(os.path.join(ROOT_DIR, output_file), 'w') as f:
+        for i, directory in enumerate(directories):
+            pd.read_csv(os.path.join(directory, 'salt_predictions.csv')).to_csv(f, header=i == 0, index=False)
+    logger.info("%d predictions of %d tiles", rows, len(directories))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Chunked regional run: grids, road features, SNODAS variables and '
+                                                 'salt predictions by tile of a fine regional grid')
+    # CLI arguments with short and long flags
+    parser.add_argument('-st', '--stage', choices=('grids', 'road_features', 'snodas', 'predictions'), required=True,
+                        help='Stage to run')
+    parser.add_argument('-ps', '--polysize', type=int, default=1, help='Polygon size in SNODAS units')
+    parser.add_argument('-t', '--tilepolys', type=int, default=TILE_POLYS, help='Tile width and height in polygons')
+    parser.add_argument('-d', '--directory', default=None, help='Output directory, data/interim/tiles_poly<size>')
+    parser.add_argument('-f', '--format', default='csv', help='File format')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='Number of worker processes')
+    parser.add_argument('-m', '--mask', default=None, help='Mask polygon file, e.g. boundaries of market states')
+    parser.add_argument('-q', '--quarter', help='Quarter of SNODAS stage, e.g. Q12019')
+    parser.add_argument('-s', '--states', nargs='*', default=[s.replace(" ", "_") for s in STATES],
+                        help='States of road features stage')
+    parser.add_argument('-sm', '--saltmodelfile', help='Fitted salt model file path of predictions stage')
+    parser.add_argument('-o', '--output', help='Quarterly salt predictions file of predictions stage')
+    args = parser.parse_args()
+    configure_logging()
+
+    directory = args.directory or f"data/interim/tiles_poly{args.polysize}"
+    if args.stage == 'grids':
+        save_tile_grids(directory, args.polysize, args.tilepolys, args.format, args.mask)
+    elif args.stage == 'road_features':
+        save_tile_road_features(args.states, directory, args.polysize, args.tilepolys, args.format, args.mask,
+                                args.workers)
+    elif args.stage == 'snodas':
+        save_tile_snodas(args.quarter, directory, args.polysize, args.tilepolys, args.format, args.mask, args.workers)
+    else:
+        save_tile_predictions(args.saltmodelfile, directory, args.output, args.format, args.workers)
@@ -1,4 +1,6 @@
 import argparse
+from storage import write_frame
+from utility import configure_logging
 import os
 from roads import nar_overlay
 from definitions import ROOT_DIR, STATE_BREVS
@@ -8,14 +10,14 @@ def save_state_road_overlays(state, grid_file, road_file, outputfile, state_brev
     Create road-overlays of regional grid and NAR roads data for each state. These will be combined into one regional
     overlay
     :param state: String. Full state name
-    :param grid_file: String. Relative path to file containing DataFrame of regional grid .csv file
+    :param grid_file: String. Relative path to file containing DataFrame of regional grid
     :param road_file: String. Relative path to file containing Dataframe of state's road data. .csv file
-    :param outputfile: String. Relative path to save overlay. .csv file
+    :param outputfile: String. Relative path to save overlay. .csv or .parquet file
     :param state_brevs: Dictionary. keys = full state name, values = two-letter state abbreviation
     :return: None
     '''
-    nar_overlay(state_brevs.get(state), nar_input=os.path.join(ROOT_DIR, road_file),
-                grid_input=grid_file).to_csv(os.path.join(ROOT_DIR, outputfile), index=False)
+    write_frame(nar_overlay(state_brevs.get(state), nar_input=os.path.join(ROOT_DIR, road_file), grid_input=grid_file),
+                os.path.join(ROOT_DIR, outputfile), schema='road_overlay')
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Create, and save to output file, overlay of regional grid with a\
@@ -31,5 +33,5 @@ if __name__ == "__main__":
     grid_file = args.gridfile
     road_file = args.roadsfile
 
+    configure_logging()
     save_state_road_overlays(state, grid_file, road_file, output_file, STATE_BREVS)
-
@@ -1,14 +1,26 @@
-from definitions import ROOT_DIR
-from salt import join_it_iowawinter
+from definitions import ROOT_DIR, SNODAS_LAGS, ROLLING_WINDOWS
+from salt import join_it_iowawinter, join_it_iowawinter_chunked
 import argparse
 import os
+from storage import write_frame, FORMATS
 
-def save_winter_iowa_joined(salt_file, snodas_file, roads_file, output_file):
+def save_winter_iowa_joined(salt_file, snodas_file, roads_file, output_file, lags=SNODAS_LAGS, windows=ROLLING_WINDOWS):
     '''Combine Iowa Datasets (salt, roads, snodas)'''
     # join salt-overlay with road overlay and snodas data
-    join_it_iowawinter(salt_input=os.path.join(ROOT_DIR, salt_file),
-                            snodas_input=os.path.join(ROOT_DIR, snodas_file),
-                            roads_input=os.path.join(ROOT_DIR, roads_file)).to_csv(os.path.join(ROOT_DIR, output_file))
+    write_frame(join_it_iowawinter(salt_input=os.path.join(ROOT_DIR, salt_file),
+                                   snodas_input=os.path.join(ROOT_DIR, snodas_file),
+                                   roads_input=os.path.join(ROOT_DIR, roads_file), lags=lags, windows=windows),
+                os.path.join(ROOT_DIR, output_file), schema='winter_iowa_joined')
+
+def save_winter_iowa_joined_chunked(salt_file, snodas_file, roads_file, output_dir, lags=SNODAS_LAGS,
+                                    chunksize=1000000, fmt='csv', windows=ROLLING_WINDOWS):
+    '''Combine Iowa Datasets (salt, roads, snodas) one winter season at a time, within a fixed memory budget. Output
+    is a directory with one partition per winter season'''
+    join_it_iowawinter_chunked(salt_input=os.path.join(ROOT_DIR, salt_file),
+                               snodas_input=os.path.join(ROOT_DIR, snodas_file),
+                               roads_input=os.path.join(ROOT_DIR, roads_file),
+                               output_dir=os.path.join(ROOT_DIR, output_dir), lags=lags, chunksize=chunksize, fmt=fmt,
+                               windows=windows)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Join Winter Iowa Features')
@@ -17,11 +29,25 @@ if __name__ == "__main__":
     parser.add_argument('-sa', '--saltfile', help='Salt file')
     parser.add_argument('-sn', '--snodasfile', help='Snodas file')
     parser.add_argument('-r', '--roadsfile', help='Roads file')
+    parser.add_argument('-l', '--lags', nargs='+', type=int, default=list(SNODAS_LAGS),
+                        help='Lags, in days prior to storm date, of SNODAS features')
+    parser.add_argument('-w', '--windows', nargs='*', type=int, default=list(ROLLING_WINDOWS),
+                        help='Windows, in days ending on storm date, of rolling SNODAS features. None if empty')
+    parser.add_argument('-c', '--chunked', action='store_true',
+                        help='Stream SNODAS file by winter season and write one partition per season to output directory')
+    parser.add_argument('-cs', '--chunksize', type=int, default=1000000, help='SNODAS rows read per chunk')
+    parser.add_argument('-f', '--format', default='csv', choices=FORMATS, help='File format of season partitions')
 
     args = parser.parse_args()
     output_file = args.output
     salt_file = args.saltfile
     snodas_file = args.snodasfile
     roads_file = args.roadsfile
+    lags = tuple(args.lags)
+    windows = tuple(args.windows)
 
-    save_winter_iowa_joined(salt_file, snodas_file, roads_file, output_file)
+    if args.chunked:
+        save_winter_iowa_joined_chunked(salt_file, snodas_file, roads_file, output_file, lags, args.chunksize,
+                                        args.format, windows)
+    else:
+        save_winter_iowa_joined(salt_file, snodas_file, roads_file, output_file, lags, windows)
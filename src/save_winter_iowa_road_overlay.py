@@ -1,6 +1,7 @@
 import argparse
 from roads import winter_iowa_roads_overlay, winter_iowa_road_features
 import os
+from storage import write_frame
 from definitions import ROOT_DIR
 
 def save_winter_iowa_road_overlay(road_file, grid_file, output_file):
@@ -16,7 +17,8 @@ def save_winter_iowa_road_overlay(road_file, grid_file, output_file):
     overlay_df = winter_iowa_roads_overlay(roads_input=os.path.join(ROOT_DIR, road_file),
                                     grid_input=os.path.join(ROOT_DIR, grid_file))
     #create road features and groupby polygon index
-    winter_iowa_road_features(roads_overlay_input=overlay_df).to_csv(os.path.join(ROOT_DIR, output_file), index=False)
+    write_frame(winter_iowa_road_features(roads_overlay_input=overlay_df), os.path.join(ROOT_DIR, output_file),
+                schema='road_features')
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Create, and save to output file, overlay of Iowa grid with roads\
@@ -2,6 +2,8 @@ from definitions import ROOT_DIR, IOWA_UPPER_LEFT, IOWA_BOTTOM_RIGHT, POLY_SIZE
 from snodas import snodas_iowa_with_poly_index, agg_by_poly_index
 import argparse
 import os
+from storage import write_frame
+from utility import configure_logging
 from grid import Grid, Point
 
 def save_winter_iowa_snodas(upper_left, bottom_right, poly_size, date_file, output_file):
@@ -20,7 +22,7 @@ def save_winter_iowa_snodas(upper_left, bottom_right, poly_size, date_file, outp
    iowa_grid = Grid(Point(*upper_left), Point(*bottom_right), poly_size)
 
    snodas_df = snodas_iowa_with_poly_index(iowa_grid, os.path.join(ROOT_DIR, date_file))
-   agg_by_poly_index(snodas_df).to_csv(os.path.join(ROOT_DIR, output_file))
+   write_frame(agg_by_poly_index(snodas_df), os.path.join(ROOT_DIR, output_file), schema='snodas_params')
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Create Dataframe of SNODAS params by polygon for Winter Iowa dataset')
@@ -31,8 +33,5 @@ if __name__ == "__main__":
     output_file = args.output
     date_file = args.datefile
 
+    configure_logging()
     save_winter_iowa_snodas(IOWA_UPPER_LEFT, IOWA_BOTTOM_RIGHT, POLY_SIZE, date_file, output_file)
-
-
-
-
@@ -0,0 +1,171 @@
+import argparse
+import os
+import logging
+import numpy as np
+import pandas as pd
+from definitions import ROOT_DIR, POLY_SIZE, MIN_SOLID, SNODAS_LAGS
+from nowcast import RunningQuarter
+from salt_model import load_salt_model, model_features, storm_cell_predictions, sales_model, fit_company_model, \
+    lead_in_rows
+from snodas_store import rolling_windows, window_lags
+from storage import read_frame, glob_frames
+from utility import quarter_dates, quarter_from_path, configure_logging
+from profiling import profiled
+
+logger = logging.getLogger(__name__)
+
+QUANTILES = (.05, .25, .5, .75, .95)
+
+@profiled
+def historical_day_totals(fitted_salt_model, roads_df, quarter, history_files, remaining_dates, polygons, weights,
+                          min_solid_precip=MIN_SOLID, lags=SNODAS_LAGS):
+    '''
+    Predicted market salt and gravity-weighted salt of every prior year on the calendar days of the remaining dates of
+    the running quarter. Storm cells of all remaining days of a prior year are predicted in one batched call, with
+    lagged SNODAS features taken from the same year
+    :param fitted_salt_model: Pipeline. Fitted salt model
+    :param roads_df: DataFrame. Road features by poly_index
+    :param quarter: String. Quarter tag of the running quarter, e.g. Q12024
+    :param history_files: List. Paths of quarterly SNODAS files of prior years of the same quarter
+    :param remaining_dates: DatetimeIndex. Remaining dates of the running quarter
+    :param polygons: Ndarray. Sorted poly_index of the company model
+    :param weights: Ndarray. Weight of each polygon in the company model
+    :param min_solid_precip: Int. Minimum amount of solid precipitation per day per polygon
+    :param lags: Tuple. Lags, in days, of SNODAS features
+    :return: (market salt, weighted salt), each of shape (number of prior years, number of remaining dates)
+    '''
+    max_lag = max(window_lags(lags, rolling_windows(model_features(fitted_salt_model))))
+    market = np.zeros((len(history_files), remaining_dates.size))
+    weighted = np.zeros((len(history_files), remaining_dates.size))
+    for i, file in enumerate(history_files):
+        #same calendar day of the prior year, 02/29 maps to 02/28
+        offset = pd.DateOffset(years=int(quarter[2:]) - int(quarter_from_path(file)[2:]))
+        dates, day_of_date = np.unique(pd.DatetimeIndex([date - offset for date in remaining_dates]),
+                                       return_inverse=True)
+        dates = pd.DatetimeIndex(dates)
+        snodas_df = read_frame(file, schema='snodas_params',
+                               filters=[('date', '>=', dates.min() - pd.Timedelta(days=max_lag))])
+        #lagged days before the first day of a Q1 file are in the Q4 file of the prior year
+        lag_frames = [snodas_df]
+        if dates.min() - pd.Timedelta(days=max_lag) < pd.Timestamp(quarter_dates(quarter_from_path(file))[0]):
+            lag_frames.append(lead_in_rows(file, (max_lag,)))
+        predictions = storm_cell_predictions(fitted_salt_model, snodas_df[snodas_df['date'].isin(dates)], lag_frames,
+                                             roads_df, min_solid_precip, lags)
+        #storm cells of polygons without road features are left out, as in the quarterly predictions
+        predictions = predictions[predictions['poly_index'].isin(roads_df['poly_index'])]
+        day = dates.get_indexer(predictions['date'])
+        poly_index = predictions['poly_index'].to_numpy()
+        position = np.clip(np.searchsorted(polygons, poly_index), 0, polygons.size - 1)
+        poly_weight = np.where(polygons[position] == poly_index, weights[position], 0.)
+        salt = predictions['salt'].to_numpy()
+        market[i] = np.bincount(day, weights=salt, minlength=dates.size)[day_of_date]
+        weighted[i] = np.bincount(day, weights=salt * poly_weight, minlength=dates.size)[day_of_date]
+        logger.debug("%s: %d storm cells on %d days", file, len(predictions), dates.size)
+    return market, weighted
+
+def resample_paths(n_years, n_days, n_paths, block_days, rng):
+    '''
+    Prior year of every remaining day of every weather path. Remaining days are split into blocks of consecutive days
+    and each block of a path is drawn from one prior year, so that storms spanning several days stay together
+    :param n_years: Int. Number of prior years
+    :param n_days: Int. Number of remaining days
+    :param n_paths: Int. Number of weather paths
+    :param block_days: Int. Days per block
+    :param rng: Generator. Random number generator
+    :return: Ndarray. Shape (n_paths, n_days), index of prior year
+    '''
+    n_blocks = -(-n_days // block_days)
+    return np.repeat(rng.integers(n_years, size=(n_paths, n_blocks)), block_days, axis=1)[:, :n_days]
+
+@profiled
+def quarter_scenarios(quarter, fitted_salt_model_path, roads_overlay_input, snodas_directory, predictions_file,
+                      actual_sales_file, distances_file, output_file, nowcast_dir='data/interim/nowcast',
+                      n_paths=500, block_days=7, quantiles=QUANTILES, seed=0, min_solid_precip=MIN_SOLID,
+                      lags=SNODAS_LAGS, exp=-.5, cutoff=None, poly_size=POLY_SIZE):
+    '''
+    Distribution of final market salt and company volume of the running quarter. The days observed so far by nowcast
+    keep their predictions, and the remaining days of each Monte Carlo weather path are completed with blocks of the
+    same calendar days of prior years. Every prior year is predicted once for all remaining days, so the paths only
+    add up predicted daily totals
+    :param quarter: String. Quarter tag of the running quarter, e.g. Q12024
+    :param fitted_salt_model_path: String. Relative path of fitted salt model .pkd file
+    :param roads_overlay_input: String. Relative path of regional road features file
+    :param snodas_directory: String. Relative path of directory of quarterly SNODAS files of prior years
+    :param predictions_file: String. Relative path of quarterly salt predictions of completed quarters
+    :param actual_sales_file: String. Relative path of actual sales file
+    :param distances_file: String. Relative path of depot distances file
+    :param output_file: String. Relative path of scenario quantiles csv file
+    :param nowcast_dir: String. Relative path of nowcast directory holding the running quarter
+    :param n_paths: Int. Number of weather paths
+    :param block_days: Int. Days per resampled block
+    :param quantiles: Tuple. Quantiles reported
+    :param seed: Int. Random seed
+    :param min_solid_precip: Int. Minimum amount of solid precipitation per day per polygon
+    :param lags: Tuple. Lags, in days, of SNODAS features
+    :param exp: Float. Negative distance-decay exponent of company_model
+    :param cutoff: Float. Depot distance cutoff of company_model in km. No cutoff if None
+    :param poly_size: Int. Size of grid polygon dimensions in SNODAS units
+    :return: DataFrame. Columns = ['quantile', 'market_salt', 'company_volume']
+    '''
+    roads_df = read_frame(os.path.join(ROOT_DIR, roads_overlay_input), schema='road_features')
+    running = RunningQuarter(os.path.join(ROOT_DIR, nowcast_dir), quarter, roads_df['poly_index'])
+    start, end = pd.to_datetime(quarter_dates(quarter))
+    observed_through = max(pd.to_datetime(list(running.index['days'])), default=start - pd.Timedelta(days=1))
+    remaining_dates = pd.date_range(observed_through + pd.Timedelta(days=1), end)
+
+    fit = fit_company_model(sales_model(os.path.join(ROOT_DIR, predictions_file),
+                                        os.path.join(ROOT_DIR, actual_sales_file),
+                                        os.path.join(ROOT_DIR, distances_file)), exp, cutoff)
+    position = np.clip(np.searchsorted(fit.polygons, running.totals['poly_index'].to_numpy()), 0,
+                       fit.polygons.size - 1)
+    observed_salt = running.totals['salt'].to_numpy()
+    observed_weighted = (observed_salt * np.where(fit.polygons[position] == running.totals['poly_index'].to_numpy(),
+                                                  fit.weights[position], 0.)).sum()
+
+    history_pattern = os.path.join(ROOT_DIR, snodas_directory, f"snodas_params_regional_poly{poly_size}_{quarter[:2]}*")
+    history_files = [file for file in glob_frames(history_pattern)
+                     if int(quarter_from_path(file)[2:]) < int(quarter[2:])]
+    logger.info(f"{quarter}: {len(running.index['days'])} days observed, {remaining_dates.size} remaining, "
+                f"{len(history_files)} prior years")
+    if remaining_dates.size and history_files:
+        market, weighted = historical_day_totals(load_salt_model(os.path.join(ROOT_DIR, fitted_salt_model_path)),
+                                                 roads_df, quarter, history_files, remaining_dates, fit.polygons,
+                                                 fit.weights, min_solid_precip, lags)
+        years = resample_paths(len(history_files), remaining_dates.size, n_paths, block_days,
+                               np.random.default_rng(seed))
+        days = np.arange(remaining_dates.size)
+        path_salt = market[years, days].sum(axis=1)
+        path_weighted = weighted[years, days].sum(axis=1)
+    else:
+        path_salt = path_weighted = np.zeros(n_paths)
+
+    market_salt = observed_salt.sum() + path_salt
+    company_volume = fit.model.predict((observed_weighted + path_weighted).reshape(-1, 1))
+    scenarios_df = pd.DataFrame({'quantile': quantiles, 'market_salt': np.quantile(market_salt, quantiles),
+                                 'company_volume': np.quantile(company_volume, quantiles)})
+    scenarios_df.to_csv(os.path.join(ROOT_DIR, output_file), index=False)
+    return scenarios_df
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Quantiles of final market salt and company volume of the running '
+                                                 'quarter from rest-of-quarter weather resampled from prior years')
+    # CLI arguments with short and long flags
+    parser.add_argument('-q', '--quarter', help='Running quarter, e.g. Q12024')
+    parser.add_argument('-s', '--saltmodelfile', help='Fitted salt model file path')
+    parser.add_argument('-r', '--roadoverlayfile', help='Regional road features file')
+    parser.add_argument('-sd', '--snodasdirectory', help='Directory of quarterly SNODAS files')
+    parser.add_argument('-p', '--predictions', help='Quarterly salt predictions file')
+    parser.add_argument('-a', '--actualsales', help='Actual sales file')
+    parser.add_argument('-ds', '--distances', help='Depot distance file')
+    parser.add_argument('-o', '--output', help='Output file')
+    parser.add_argument('-n', '--nowcastdir', default='data/interim/nowcast', help='Nowcast directory')
+    parser.add_argument('-np', '--paths', type=int, default=500, help='Number of weather paths')
+    parser.add_argument('-bd', '--blockdays', type=int, default=7, help='Days per resampled block')
+    parser.add_argument('-e', '--exp', type=float, default=-.5,
+                        help='Negative distance-decay exponent, weights are distance ** exp')
+    args = parser.parse_args()
+    configure_logging()
+
+    print(quarter_scenarios(args.quarter, args.saltmodelfile, args.roadoverlayfile, args.snodasdirectory,
+                            args.predictions, args.actualsales, args.distances, args.output, args.nowcastdir,
+                            args.paths, args.blockdays, exp=args.exp))
@@ -6,8 +6,29 @@ from definitions import ROOT_DIR
 import dill
 import gzip
 from utility import to_padded_num, dat_to_numpy
+from profiling import profiled
 
-def join_snodas_folder(date, file_pre_suf, x_slice, y_slice, flat_size):
+logger = logging.getLogger(__name__)
+
+#prefix and suffix of unpacked SNODAS file name for each SNODAS variable
+SNODAS_FILES = {"solid_precip": ("01025SlL01T0024T", "05DP001"),
+                "liquid_precip": ("01025SlL00T0024T", "05DP001"),
+                "SWE": ("11034tS__T0001T", "05HP001"),
+                "snow_depth": ("11036tS__T0001T", "05HP001"),
+                "runoff": ("11044bS__T0024T", "05DP000"),
+                "sub_pack": ("11050lL00T0024T", "05DP000"),
+                "sub_blow": ("11039lL00T0024T", "05DP000"),
+                "sp_temp": ("11038wS__A0024T", "05DP001")
+                }
+
+#reduction of SNODAS polygons into Grid polygons for each SNODAS variable, as in agg_by_poly_index. fmax and fmin skip
+#missing values, and both are associative, so reducing blocks of blocks gives the reduction of the SNODAS polygons
+SNODAS_REDUCTIONS = {"solid_precip": np.fmax, "liquid_precip": np.fmax, "SWE": np.fmax, "snow_depth": np.fmax,
+                     "runoff": np.fmax, "sub_pack": np.fmax, "sub_blow": np.fmin, "sp_temp": np.fmin}
+
+@profiled
+def join_snodas_folder(date, file_pre_suf, x_slice, y_slice, flat_size, snodas_dir="data/raw/snodas_params",
+                       binary_dir="data/raw/binary_files", cells=None):
     '''
     For a given date and SNODAS variable, slice dowloaded array according to coverage area
     :param date: Datetime
@@ -15,21 +36,24 @@ def join_snodas_folder(date, file_pre_suf, x_slice, y_slice, flat_size):
     :param x_slice: Slice object. horizontal slice
     :param y_slice: Slice object. vertical slice
     :param flat_size: Int. size of flattened sliced matrix
+    :param snodas_dir: String. Path, relative to ROOT_DIR or absolute, of directory of unpacked SNODAS files
+    :param binary_dir: String. Path, relative to ROOT_DIR or absolute, of directory for decompressed binary files
+    :param cells: Ndarray. Flat positions, within the sliced matrix, of the SNODAS polygons kept. All if None
     :return: Ndarray
     '''
     month_num = to_padded_num(date.month)
     year = date.year
     day = to_padded_num(date.day)
 
-    snodas_folder = os.path.join(ROOT_DIR, "data/raw/snodas_params", f"{year}{month_num}{day}")
+    snodas_folder = os.path.join(ROOT_DIR, snodas_dir, f"{year}{month_num}{day}")
 
     snodas_file = os.path.join(snodas_folder,
                                f"zz_ssmv{file_pre_suf[0]}TNATS{year}{month_num}{day}{file_pre_suf[1]}.dat.gz")
 
-    if not os.path.exits(os.path.join(ROOT_DIR, 'data/raw/binary_files')):
-        os.makedirs(os.path.join(ROOT_DIR, 'data/raw/binary_files'))
+    if not os.path.exists(os.path.join(ROOT_DIR, binary_dir)):
+        os.makedirs(os.path.join(ROOT_DIR, binary_dir))
 
-    b_path = os.path.join(ROOT_DIR, 'data/raw/binary_files',
+    b_path = os.path.join(ROOT_DIR, binary_dir,
                           f"zz_ssmv{file_pre_suf[0]}TNATS{year}{month_num}{day}{file_pre_suf[1]}.dat")
     try:
         if not os.path.exists(b_path):
@@ -45,22 +69,23 @@ def join_snodas_folder(date, file_pre_suf, x_slice, y_slice, flat_size):
         #clear binary files after loading to numpy
         os.remove(b_path)
 
-        return new_grid
+        return new_grid if cells is None else new_grid[cells]
 
     except Exception as e:
-        logging.info(str(e))
-        print("error", str(e))
-        logging.info(
+        logger.warning(str(e))
+        logger.warning(
             f"problem reading binary file:  zz_ssmv{file_pre_suf[0]}TNATS{year}{month_num}{day}{file_pre_suf[1]}.dat")
-        empty = np.empty(flat_size)
+        empty = np.empty(flat_size if cells is None else cells.size)
         empty.fill(np.nan)
         return empty
 
-def snodas_iowa_with_poly_index(grid, date_file):
+@profiled
+def snodas_iowa_with_poly_index(grid, date_file, snodas_dir="data/raw/snodas_params"):
     '''
     Create Dataframe of SNODAS variables by day across every storm date in Winter Iowa Salt data set.
     :param grid: Grid object. Initialized with Iowa parameters.
     :param date_file: String. Absolute path to file containing list of dates. .pkd format
+    :param snodas_dir: String. Path, relative to ROOT_DIR or absolute, of directory of unpacked SNODAS files
     :return: DataFrame.
     '''
 
@@ -71,16 +96,6 @@ def snodas_iowa_with_poly_index(grid, date_file):
     with open(date_file, 'rb') as f:
         dates = np.array(dill.load(f))
 
-    params_dict = {"solid_precip": ("01025SlL01T0024T", "05DP001"),
-                   "liquid_precip": ("01025SlL00T0024T", "05DP001"),
-                   "SWE": ("11034tS__T0001T", "05HP001"),
-                   "snow_depth": ("11036tS__T0001T", "05HP001"),
-                   "runoff": ("11044bS__T0024T", "05DP000"),
-                   "sub_pack": ("11050lL00T0024T", "05DP000"),
-                   "sub_blow": ("11039lL00T0024T", "05DP000"),
-                   "sp_temp": ("11038wS__A0024T", "05DP001")
-                   }
-
     snodas_params_df = pd.DataFrame()
     for d in dates:
         date = pd.to_datetime(d)
@@ -91,12 +106,13 @@ def snodas_iowa_with_poly_index(grid, date_file):
         snodas_date.repeat(flat_size, axis=0)
         temp_df = pd.DataFrame({"poly_index": grid.poly_index, "snodas": grid.reference_index, "date": snodas_date})
 
-        for k, v in params_dict.items():
-            temp_df[k] = join_snodas_folder(date, v, x_slice, y_slice, flat_size)
+        for k, v in SNODAS_FILES.items():
+            temp_df[k] = join_snodas_folder(date, v, x_slice, y_slice, flat_size, snodas_dir, cells=grid.cells)
         snodas_params_df = pd.concat([snodas_params_df, temp_df], axis=0, ignore_index=True)
     return snodas_params_df
 
-def snodas_regional_with_poly_index(grid, start_date, end_date):
+@profiled
+def snodas_regional_with_poly_index(grid, start_date, end_date, snodas_dir="data/raw/snodas_params"):
     '''Create Dataframe of SNODAS variables, by day, for a FY calendar quarter. poly_index corresponds to poly_index of
     grid of polygons of size, poly_size
     :param uppleft: upper left coordinates of corresponding grid of polygons
@@ -104,42 +120,126 @@ def snodas_regional_with_poly_index(grid, start_date, end_date):
     :param poly_size: size of corresponding grid of polygons
     :param start_date: first day of FY quarter
     :param end_date: last day of FY quarter
+    :param snodas_dir: String. Path, relative to ROOT_DIR or absolute, of directory of unpacked SNODAS files
     :return: Dataframe
     '''
 
+    return snodas_regional_pyramid([grid], start_date, end_date, snodas_dir)[0]
+
+@profiled
+def snodas_regional_pyramid(grids, start_date, end_date, snodas_dir="data/raw/snodas_params"):
+    '''
+    Create Dataframes of SNODAS variables, by day, for a FY calendar quarter at every level of a grid pyramid. Each
+    day is read once for all levels
+    :param grids: List of Grid objects. Levels of grid_pyramid, sorted by poly_size
+    :param start_date: first day of FY quarter
+    :param end_date: last day of FY quarter
+    :param snodas_dir: String. Path, relative to ROOT_DIR or absolute, of directory of unpacked SNODAS files
+    :return: List of DataFrames, one per level
+    '''
+    days = [snodas_day_pyramid(grids, date, snodas_dir) for date in pd.date_range(start=start_date, end=end_date)]
+    return [pd.concat([day[level] for day in days], axis=0, ignore_index=True) for level in range(len(grids))]
+
+@profiled
+def block_reduce(values, block, reduce):
+    '''
+    Reduce a matrix of values over square blocks
+    :param values: Ndarray. Shape (rows, columns), both multiples of block
+    :param block: Int. Block width and height
+    :param reduce: ufunc. Reduction of the values of a block, e.g. np.fmax
+    :return: Ndarray. Shape (rows // block, columns // block)
+    '''
+    rows, columns = values.shape
+    return reduce.reduce(values.reshape(rows // block, block, columns // block, block), axis=(1, 3))
+
+@profiled
+def snodas_day_pyramid(grids, date, snodas_dir="data/raw/snodas_params"):
+    '''
+    Create Dataframes of SNODAS variables of one day aggregated by polygon of every level of a grid pyramid. The
+    SNODAS raster of each variable is read once over the area of the pyramid and reduced into the polygons of the
+    finest level, then each coarser level is reduced from the level below
+    :param grids: List of Grid objects. Grids over the same SNODAS polygons, sorted by poly_size, each poly_size
+    dividing the next, e.g. grid_pyramid
+    :param date: Datetime
+    :param snodas_dir: String. Path, relative to ROOT_DIR or absolute, of directory of unpacked SNODAS files
+    :return: List of DataFrames, one per level. Columns = ['date', 'poly_index'] + SNODAS variables, rows are the
+    polygons of the level sorted by poly_index
+    '''
+    grid = grids[0]
+    snodas_date = np.datetime64(f'{date.year}-{to_padded_num(date.month)}-{to_padded_num(date.day)}T00:00', 'ns')
+    poly_index = [pd.unique(level.poly_index) for level in grids]
+
+    levels = [{"date": snodas_date, "poly_index": index} for index in poly_index]
+    for k, raster in snodas_day_rasters(grid, date, snodas_dir).items():
+        #row-major polygons of a level are at position poly_index - 1 of the flattened reduced matrix
+        reduced = raster
+        finer_size = 1
+        for level, index, level_grid in zip(levels, poly_index, grids):
+            reduced = block_reduce(reduced, level_grid.poly_size // finer_size, SNODAS_REDUCTIONS[k])
+            finer_size = level_grid.poly_size
+            level[k] = reduced.reshape(reduced.size)[index - 1]
+    logger.debug("SNODAS %s: %d SNODAS polygons into %s polygons", date.date(), grid.y_height * grid.x_width,
+                 ", ".join(str(index.size) for index in poly_index))
+    return [pd.DataFrame(level) for level in levels]
+
+@profiled
+def snodas_day_rasters(grid, date, snodas_dir="data/raw/snodas_params"):
+    '''
+    SNODAS variables of one day over the SNODAS polygons of the area of grid, masked or not
+    :param grid: Grid object
+    :param date: Datetime
+    :param snodas_dir: String. Path, relative to ROOT_DIR or absolute, of directory of unpacked SNODAS files
+    :return: Dictionary. keys = SNODAS variable, values = Ndarray of shape (y_height, x_width), NaN where missing
+    '''
     y_slice = slice(grid.y_start, grid.y_height + grid.y_start)
     x_slice = slice(grid.x_start, grid.x_width + grid.x_start)
     flat_size = grid.y_height * grid.x_width
+    rasters = {}
+    for k, v in SNODAS_FILES.items():
+        values = join_snodas_folder(date, v, x_slice, y_slice, flat_size, snodas_dir).astype('float64')
+        values[values == -9999] = np.nan
+        rasters[k] = values.reshape(grid.y_height, grid.x_width)
+    return rasters
 
-    dates = pd.date_range(start=start_date, end=end_date)
-
-    params_dict = {"solid_precip": ("01025SlL01T0024T", "05DP001"),
-                    "liquid_precip": ("01025SlL00T0024T", "05DP001"),
-                       "SWE": ("11034tS__T0001T", "05HP001"),
-                       "snow_depth": ("11036tS__T0001T", "05HP001"),
-                       "runoff": ("11044bS__T0024T", "05DP000"),
-                       "sub_pack": ("11050lL00T0024T", "05DP000"),
-                       "sub_blow": ("11039lL00T0024T", "05DP000"),
-                       "sp_temp": ("11038wS__A0024T", "05DP001")
-                       }
-
-    snodas_params_df = pd.DataFrame()
-    for date in dates:
-        month_num = to_padded_num(date.month)
-        year = date.year
-        day = to_padded_num(date.day)
-        snodas_date = np.array(np.datetime64(f'{year}-{month_num}-{day}T00:00'))
-        snodas_date.repeat(flat_size, axis=0)
-        temp_df = pd.DataFrame({"poly_index": grid.poly_index, "snodas": grid.reference_index, "date": snodas_date})
+@profiled
+def snodas_day_tiles(grid, tiles, date, snodas_dir="data/raw/snodas_params"):
+    '''
+    DataFrames of SNODAS variables of one day aggregated by polygon of grid, one per tile. The day is read once and
+    each tile is reduced from its window of the SNODAS rasters only, so no DataFrame of the whole grid is built
+    :param grid: Grid object
+    :param tiles: List of Tile. Tiles of grid, see Grid.tiles
+    :param date: Datetime
+    :param snodas_dir: String. Path, relative to ROOT_DIR or absolute, of directory of unpacked SNODAS files
+    :return: Generator of (Tile, DataFrame). Columns = ['date', 'poly_index'] + SNODAS variables, rows are the
+    polygons of the tile sorted by poly_index
+    '''
+    snodas_date = np.datetime64(f'{date.year}-{to_padded_num(date.month)}-{to_padded_num(date.day)}T00:00', 'ns')
+    rasters = snodas_day_rasters(grid, date, snodas_dir)
+    size = grid.poly_size
+    for tile in tiles:
+        poly_index = grid.tile_poly_index(tile)
+        rows, columns = grid.poly_position(poly_index)
+        #position of each polygon in the flattened reduced window of the tile
+        position = (rows - tile.rows.start) * (tile.columns.stop - tile.columns.start) + columns - tile.columns.start
+        tile_df = {"date": snodas_date, "poly_index": poly_index}
+        for k, raster in rasters.items():
+            window = raster[tile.rows.start * size:tile.rows.stop * size,
+                            tile.columns.start * size:tile.columns.stop * size]
+            tile_df[k] = block_reduce(window, size, SNODAS_REDUCTIONS[k]).reshape(-1)[position]
+        yield tile, pd.DataFrame(tile_df)
 
-        for k, v in params_dict.items():
-            temp_df[k] = join_snodas_folder(date, v, x_slice, y_slice, flat_size)
-        print(temp_df.head())
-        print(temp_df.dtypes)
-        temp_df = agg_by_poly_index(temp_df)
-        snodas_params_df = pd.concat([snodas_params_df, temp_df], axis=0, ignore_index=True)
-    return snodas_params_df
+@profiled
+def snodas_day_with_poly_index(grid, date, snodas_dir="data/raw/snodas_params"):
+    '''
+    Create Dataframe of SNODAS variables of one day aggregated by polygon of grid
+    :param grid: Grid object
+    :param date: Datetime
+    :param snodas_dir: String. Path, relative to ROOT_DIR or absolute, of directory of unpacked SNODAS files
+    :return: DataFrame
+    '''
+    return snodas_day_pyramid([grid], date, snodas_dir)[0]
 
+@profiled
 def agg_by_poly_index(data_frame):
     '''
     Aggregate SNODAS variables by Grid polygons
@@ -5,24 +5,22 @@ import os
 import time
 import logging
 import tarfile
-from definitions import ROOT_DIR, EMAIL_ADDRESS
+from definitions import ROOT_DIR, EMAIL_ADDRESS, SNODAS_FTP_HOST, SNODAS_FTP_PORT, SNODAS_FTP_PAUSE
 import dill
 from utility import to_padded_num, to_month_tag
 
+#handlers are configured by the calling script (see utility.configure_logging) rather than at import
 snodas_client_logger = logging.getLogger('snodas_client')
-snodas_client_logger.setLevel(logging.DEBUG) #set cut off for logging to lowest severity
-snodas_client_handler = logging.FileHandler('../snodas_client.log')
-snodas_client_formatter = logging.Formatter(fmt='%(asctime)s %(levelname)-8s %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
-snodas_client_handler.setFormatter(snodas_client_formatter)
-snodas_client_logger.addHandler(snodas_client_handler)
 
-def snodas_download_day(year, day, month, dest_dir):
+def snodas_download_day(year, day, month, dest_dir, host=SNODAS_FTP_HOST, port=SNODAS_FTP_PORT):
     '''
     Create directory and download SNODAS files corresponding to one day.
     :param year: four digit year
     :param month: capitalized three letter month abbreviation or integer month
     :param day: non-zero padded integer for day of month
     :param dest_dir: String. relative path of directory for cacheing SNODAS tar files
+    :param host: String. FTP server hosting SNODAS archive
+    :param port: Int. FTP server port
     :return: None
     '''
     month_name = to_month_tag(month)
@@ -41,7 +39,7 @@ def snodas_download_day(year, day, month, dest_dir):
     if os.path.exists(os.path.join(absolute_destdir, file_name)):
         snodas_client_logger.info(f"file {file_name} already saved")
         return
-    if not os.path.exits(absolute_destdir):
+    if not os.path.exists(absolute_destdir):
         os.makedirs(absolute_destdir)
     # 2. Set the path to the FTP directory that contains the data you wish to download.
     directory = f'/DATASETS/NOAA/G02158/unmasked/{year}/{month_name}'
@@ -54,11 +52,9 @@ def snodas_download_day(year, day, month, dest_dir):
     ############################################
     ### Don't need to change this code below ###
     ############################################
-    # FTP server
-    ftpdir = 'sidads.colorado.edu'
-
     # Connect and log in to the FTP
-    ftp = FTP(ftpdir)
+    ftp = FTP()
+    ftp.connect(host, port)
     ftp.login('anonymous', password)
 
     # Change to the directory where the files are on the FTP
@@ -69,29 +65,36 @@ def snodas_download_day(year, day, month, dest_dir):
     files = ftp.nlst()
     files = files[2:]
 
-    # Change to the destination directory on own computer where you want to save the files
-    os.chdir(absolute_destdir)
-
-    # Download all the files within the FTP directory
+    # Download all the files within the FTP directory. Written to absolute path rather than changing the working
+    # directory of the calling process. A failed transfer removes the partial file, which would otherwise be taken as
+    # already saved
     if file_name in files:
-        ftp.retrbinary('RETR ' + file_name, open(file_name, 'wb').write)
+        try:
+            with open(os.path.join(absolute_destdir, file_name), 'wb') as f:
+                ftp.retrbinary('RETR ' + file_name, f.write)
+        except Exception:
+            os.remove(os.path.join(absolute_destdir, file_name))
+            raise
     else:
         snodas_client_logger.error(file_name + " may not be on snodas server")
 
     # Close the FTP connection
     ftp.quit()
 
-def snodas_download_quarter(start, end, dest_dir):
+def snodas_download_quarter(start, end, dest_dir, host=SNODAS_FTP_HOST, port=SNODAS_FTP_PORT, pause=SNODAS_FTP_PAUSE):
     '''
     Download SNODAS files for every day in a date range.
     :param start: Datetime. Start date.
     :param end: Datetime. End date.
+    :param host: String. FTP server hosting SNODAS archive
+    :param port: Int. FTP server port
+    :param pause: Float. Seconds between consecutive daily downloads
     :return: None
     '''
     dates = pd.date_range(start=start, end=end)
     for date in dates:
-        snodas_download_day(date.year, date.day, date.month, dest_dir)
-        time.sleep(10)
+        snodas_download_day(date.year, date.day, date.month, dest_dir, host, port)
+        time.sleep(pause)
 
 def snodas_unpack_tar_quarter(start, end, tar_dir, unpacked_dir):
     '''
@@ -142,10 +145,13 @@ def save_tar(year, day, month, tar_dir, unpacked_dir):
     else:
         snodas_client_logger.error(f"unpacking {file_name} failed, file may not exist")
 
-def snodas_download(date_file, dest_dir):
+def snodas_download(date_file, dest_dir, host=SNODAS_FTP_HOST, port=SNODAS_FTP_PORT, pause=SNODAS_FTP_PAUSE):
     '''
     Download SNODAS files for every day contained in list of dates.
     :param date_file: String. Path to file containing list of dates in .pkd format
+    :param host: String. FTP server hosting SNODAS archive
+    :param port: Int. FTP server port
+    :param pause: Float. Seconds between consecutive daily downloads
     :return: None
     '''
     with open(date_file, 'rb') as f:
@@ -153,8 +159,8 @@ def snodas_download(date_file, dest_dir):
 
     for d in date_list:
         date = pd.to_datetime(d)
-        snodas_download_day(date.year, date.day, date.month, dest_dir)
-        time.sleep(10)
+        snodas_download_day(date.year, date.day, date.month, dest_dir, host, port)
+        time.sleep(pause)
 
 def snodas_unpack_all(date_file, tar_dir, unpacked_dir):
     '''
@@ -0,0 +1,220 @@
+import re
+import numpy as np
+import pandas as pd
+from definitions import SNODAS_VARIABLES, MIN_SOLID, THAW_SP_TEMP
+from storage import read_frame
+
+def lag_suffix(lag):
+    '''
+    Column suffix for SNODAS variables lagged by a number of days. Lag 1 keeps the _PREV suffix used by the salt model
+    :param lag: Int. Number of days prior to storm date
+    :return: String
+    '''
+    if lag == 0:
+        return ""
+    if lag == 1:
+        return "_PREV"
+    return f"_PREV{lag}"
+
+def rolling_columns(windows):
+    '''
+    Column names of rolling SNODAS features for a set of windows
+    :param windows: Tuple. Windows, in days ending on storm date
+    :return: List
+    '''
+    if not windows:
+        return []
+    return [f"solid_precip_{w}D" for w in windows] + [f"freeze_thaw_{w}D" for w in windows] + ['days_since_snow']
+
+def rolling_windows(columns):
+    '''
+    Windows of the rolling SNODAS features among a set of feature columns, e.g. the columns of a fitted salt model
+    :param columns: List. Column names
+    :return: Tuple. Windows, in days, sorted
+    '''
+    matches = (re.fullmatch(r"(?:solid_precip|freeze_thaw)_(\d+)D", column) for column in columns)
+    return tuple(sorted({int(match.group(1)) for match in matches if match}))
+
+def window_lags(lags, windows):
+    '''
+    Lags of the SNODAS rows needed for lag features and rolling features, i.e. every day of the largest window
+    :param lags: Tuple. Lags, in days, of SNODAS features
+    :param windows: Tuple. Windows, in days, of rolling SNODAS features
+    :return: Tuple. Lags, in days, sorted. Includes 0, the storm date, with windows
+    '''
+    return tuple(sorted(set(lags) | set(range(max(windows, default=0)))))
+
+def key_codes(dates, poly_index):
+    '''
+    Integer codes of (date, poly_index) keys, used to semi-join SNODAS rows against a set of keys
+    :param dates: Array-like of datetimes
+    :param poly_index: Array-like of poly_index values
+    :return: Ndarray of int64
+    '''
+    days = np.asarray(dates, dtype='datetime64[D]').astype('int64')
+    return (days << 32) | np.asarray(poly_index, dtype='int64')
+
+def lag_rows(frames, dates, poly_index, lags, variables=SNODAS_VARIABLES):
+    '''
+    Rows of SNODAS frames at the (date - lag, poly_index) keys of a set of storm rows, for each lag. Frames are
+    semi-joined against the keys one at a time, so a SNODAS file can be streamed in chunks and only the rows needed
+    for lagged features are held in memory
+    :param frames: Iterable of DataFrames. SNODAS variables by date and poly_index
+    :param dates: Array-like of datetimes of storm rows
+    :param poly_index: Array-like of poly_index values of storm rows
+    :param lags: Tuple. Lags, in days prior to date
+    :param variables: List. Names of SNODAS variables to keep
+    :return: DataFrame. Columns = ['date', 'poly_index'] + variables
+    '''
+    dates = np.asarray(dates, dtype='datetime64[D]')
+    keys = np.unique(np.concatenate([key_codes(dates - np.timedelta64(lag, 'D'), poly_index) for lag in lags]))
+    columns = ['date', 'poly_index'] + list(variables)
+    rows = [frame.loc[np.isin(key_codes(frame['date'], frame['poly_index']), keys), columns] for frame in frames]
+    return pd.concat(rows, ignore_index=True) if rows else pd.DataFrame(columns=columns)
+
+class SnodasStore(object):
+    '''
+    SnodasStore holds SNODAS variables aggregated by Grid polygon in a dense (date, poly_index, variable) array.
+    Same-day and N-day-lag features are looked up by array offset rather than by merging the SNODAS table with itself
+    '''
+    def __init__(self, snodas_params_df, variables=SNODAS_VARIABLES, dtype='float64'):
+        '''
+        Initialize SnodasStore object
+        :param snodas_params_df: DataFrame. SNODAS variables by date and poly_index, as produced by agg_by_poly_index
+        :param variables: List. Names of SNODAS variables to hold in store
+        :param dtype: String. dtype of dense value array
+        '''
+        self.variables = list(variables)
+
+        dates = pd.to_datetime(snodas_params_df['date']).to_numpy().astype('datetime64[D]')
+        poly_index = snodas_params_df['poly_index'].to_numpy()
+
+        self.dates = np.unique(dates) #dates held in store, sorted
+        self.poly_index = np.unique(poly_index) #poly_index values held in store, sorted
+        self.start_date = self.dates[0]
+
+        #lookup from day offset (days since start_date) to row of value array. -1 where date is not held in store
+        day_offsets = (self.dates - self.start_date).astype('int64')
+        self._day_row = np.full(day_offsets[-1] + 1, -1, dtype='int64')
+        self._day_row[day_offsets] = np.arange(self.dates.size)
+
+        self.values = np.full((self.dates.size, self.poly_index.size, len(self.variables)), np.nan, dtype=dtype)
+        rows = self._day_row[(dates - self.start_date).astype('int64')]
+        cols = np.searchsorted(self.poly_index, poly_index)
+        self.values[rows, cols, :] = snodas_params_df[self.variables].to_numpy(dtype=dtype)
+
+    @classmethod
+    def from_file(cls, snodas_input, variables=SNODAS_VARIABLES, dtype='float64', filters=None):
+        '''
+        Initialize SnodasStore object from SNODAS file. Only the date, poly_index and variable columns are read
+        :param snodas_input: String. Path of file containing SNODAS variables by date and poly_index
+        :param filters: List of (column, op, value) tuples. Only rows satisfying every filter are held in store
+        :return: SnodasStore
+        '''
+        return cls(read_frame(snodas_input, schema='snodas_params', columns=['date', 'poly_index'] + list(variables),
+                              filters=filters), variables, dtype)
+
+    def _positions(self, dates, poly_index, lag):
+        '''
+        Translate (date - lag, poly_index) keys into positions in value array
+        :param dates: Array-like of datetimes
+        :param poly_index: Array-like of poly_index values
+        :param lag: Int. Number of days prior to date
+        :return: rows, cols, found. found is False where key is not held in store
+        '''
+        day_offsets = (np.asarray(dates, dtype='datetime64[D]') - self.start_date).astype('int64') - lag
+        in_range = (day_offsets >= 0) & (day_offsets < self._day_row.size)
+        rows = np.where(in_range, self._day_row[np.clip(day_offsets, 0, self._day_row.size - 1)], -1)
+
+        poly_index = np.asarray(poly_index)
+        cols = np.clip(np.searchsorted(self.poly_index, poly_index), 0, self.poly_index.size - 1)
+        found = (rows >= 0) & (self.poly_index[cols] == poly_index)
+        return rows, cols, found
+
+    def block(self, dates, poly_index, lag=0):
+        '''
+        Feature block of SNODAS variables for each (date - lag, poly_index) key. Keys not held in store are NaN
+        :param dates: Array-like of datetimes
+        :param poly_index: Array-like of poly_index values
+        :param lag: Int. Number of days prior to date
+        :return: Ndarray. Shape (number of keys, number of variables)
+        '''
+        rows, cols, found = self._positions(dates, poly_index, lag)
+        block = self.values[np.where(found, rows, 0), cols, :]
+        block[~found] = np.nan
+        return block
+
+    def features(self, dates, poly_index, lags=(0, 1)):
+        '''
+        DataFrame of SNODAS features for each (date, poly_index) key, one group of columns per lag. Lagged columns are
+        suffixed with lag_suffix(lag)
+        :param dates: Array-like of datetimes
+        :param poly_index: Array-like of poly_index values
+        :param lags: Tuple. Lags, in days, to include. 0 is the same day
+        :return: DataFrame
+        '''
+        blocks = [self.block(dates, poly_index, lag) for lag in lags]
+        columns = [f"{v}{lag_suffix(lag)}" for lag in lags for v in self.variables]
+        return pd.DataFrame(np.concatenate(blocks, axis=1), columns=columns)
+
+    def _calendar(self, variable):
+        '''
+        Values of a variable on every calendar day from start_date to the last date held in store
+        :param variable: String. Name of SNODAS variable
+        :return: Ndarray. Shape (number of calendar days, number of polygons). NaN on days not held in store
+        '''
+        calendar = np.full((self._day_row.size, self.poly_index.size), np.nan)
+        held = self._day_row >= 0
+        calendar[held] = self.values[self._day_row[held], :, self.variables.index(variable)]
+        return calendar
+
+    def rolling_features(self, dates, poly_index, windows, min_solid_precip=MIN_SOLID, thaw_temp=THAW_SP_TEMP):
+        '''
+        DataFrame of rolling SNODAS features for each (date, poly_index) key. Features are differences of cumulative
+        sums along the calendar day axis of the store, so every window of every key is looked up by array offset rather
+        than rolled by group. For a window of w days ending on date:
+            solid_precip_<w>D: sum of solid_precip
+            freeze_thaw_<w>D: number of consecutive days of the window over which sp_temp crosses thaw_temp
+        and days_since_snow: days since the last day before date with solid_precip of at least min_solid_precip, up to
+        the largest window. Days not held in store count as days without snowfall or transitions. Store must hold
+        solid_precip and sp_temp
+        :param dates: Array-like of datetimes
+        :param poly_index: Array-like of poly_index values
+        :param windows: Tuple. Windows, in days ending on date
+        :param min_solid_precip: Int. Minimum amount of solid precipitation of a day with snowfall
+        :param thaw_temp: Float. sp_temp, in K, of a thawing snowpack
+        :return: DataFrame. Columns = rolling_columns(windows). NaN where key is outside of store
+        '''
+        days = (np.asarray(dates, dtype='datetime64[D]') - self.start_date).astype('int64')
+        poly_index = np.asarray(poly_index)
+        cols = np.clip(np.searchsorted(self.poly_index, poly_index), 0, self.poly_index.size - 1)
+        found = (days >= 0) & (days < self._day_row.size) & (self.poly_index[cols] == poly_index)
+        days = np.clip(days, 0, self._day_row.size - 1)
+
+        #cumulative sums with a leading row of zeros: days (d - w, d] sum to cumulative[d + 1] - cumulative[d + 1 - w]
+        solid_precip = self._calendar('solid_precip')
+        precip_sum = np.concatenate([np.zeros((1, self.poly_index.size)),
+                                     np.cumsum(np.nan_to_num(solid_precip), axis=0)])
+        sp_temp = self._calendar('sp_temp')
+        thawed = sp_temp >= thaw_temp
+        transitions = np.zeros(sp_temp.shape)
+        transitions[1:] = (thawed[1:] != thawed[:-1]) & ~np.isnan(sp_temp[1:]) & ~np.isnan(sp_temp[:-1])
+        transition_sum = np.concatenate([np.zeros((1, self.poly_index.size)), np.cumsum(transitions, axis=0)])
+
+        features = {}
+        for w in windows:
+            features[f"solid_precip_{w}D"] = precip_sum[days + 1, cols] - precip_sum[np.maximum(days + 1 - w, 0), cols]
+        for w in windows:
+            #transitions of a window are those between its w days, i.e. onto the days (d - w + 1, d]
+            features[f"freeze_thaw_{w}D"] = (transition_sum[days + 1, cols] -
+                                             transition_sum[np.maximum(days + 2 - w, 0), cols])
+        horizon = max(windows)
+        #running maximum of the day of snowfall gives the last day of snowfall up to each day
+        last_snow = np.maximum.accumulate(np.where(solid_precip >= min_solid_precip,
+                                                   np.arange(self._day_row.size)[:, np.newaxis], -horizon - 1), axis=0)
+        prior_snow = np.where(days > 0, last_snow[np.maximum(days - 1, 0), cols], -horizon - 1)
+        features['days_since_snow'] = np.minimum(days - prior_snow, horizon).astype('float64')
+
+        rolling_df = pd.DataFrame(features, columns=rolling_columns(windows))
+        rolling_df[~found] = np.nan
+        return rolling_df
@@ -0,0 +1,253 @@
+import os
+import glob
+import fnmatch
+import pandas as pd
+import geopandas as gpd
+import pyarrow.parquet as pq
+from definitions import SNODAS_VARIABLES
+from profiling import add_rows_in
+
+'''
+I/O layer for pipeline targets. The format of a target is determined by its file extension:
+    .csv: geometry stored in wkt format, dtypes set from schema on read
+    .parquet: typed columnar storage. Geometry is stored as GeoParquet
+Readers support column projection (columns) and predicate pushdown (filters). Filters use the pyarrow format, a list
+of (column, op, value) tuples that are combined with AND. For csv files filters are applied chunk by chunk after reading
+'''
+FORMATS = ('csv', 'parquet')
+
+SNODAS_SCHEMA = {'date': 'datetime64[ns]', 'poly_index': 'int64', **{v: 'float64' for v in SNODAS_VARIABLES}}
+ROAD_FEATURES_SCHEMA = {'poly_index': 'int64', 'STATE': 'object', 'WITHIN_POLY_*': 'float64'}
+SALT_OVERLAY_SCHEMA = {'STORM_DATE': 'datetime64[ns]', 'PREV_DATE': 'datetime64[ns]', 'poly_index': 'int64',
+                       'WITHIN_POLY_SOLIDSALT': 'float64', 'WITHIN_POLY_TOTALSALT': 'float64'}
+
+#explicit schemas of pipeline targets. Keys of a schema are column names or fnmatch patterns of column names. Columns
+#not covered by a schema keep their stored or inferred dtype
+SCHEMAS = {
+    'grid': {'geometry': 'geometry', 'poly_index': 'int64'},
+    'roads': {'geometry': 'geometry', 'CLASS': 'int64', 'LANES': 'float64'},
+    'salt': {'geometry': 'geometry', 'QUANTITY_SOLID': 'float64', 'TOTAL_SALT_QUANTITY': 'float64'},
+    'salt_storm_dates': {'geometry': 'geometry', 'QUANTITY_SOLID': 'float64', 'TOTAL_SALT_QUANTITY': 'float64',
+                         'LAST_PASS': 'datetime64[ns]', 'STORM_DATE': 'datetime64[ns]',
+                         'PREV_DATE': 'datetime64[ns]'},
+    'salt_overlay': SALT_OVERLAY_SCHEMA,
+    'snodas_params': SNODAS_SCHEMA,
+    'road_overlay': {'geometry': 'geometry', 'poly_index': 'int64', 'CLASS': 'int64', 'LANES': 'float64',
+                     'STATE': 'object', 'ORIG_*': 'float64', 'WITHIN_POLY_*': 'float64'},
+    'road_features': ROAD_FEATURES_SCHEMA,
+    'winter_iowa_joined': {**SALT_OVERLAY_SCHEMA, **ROAD_FEATURES_SCHEMA,
+                           **{f"{v}*": 'float64' for v in SNODAS_VARIABLES}, 'freeze_thaw_*': 'float64',
+                           'days_since_snow': 'float64'},
+    'depot_distances': {'poly_index': 'int64', '*depot_distance': 'float64'},
+    'salt_predictions': {'quarter': 'object', 'poly_index': 'int64', 'salt': 'float64'},
+    'solid_precip': {'quarter': 'object', 'poly_index': 'int64', 'solid_precip': 'float64'},
+    'storm_events': {'event_id': 'int64', 'start_date': 'datetime64[ns]', 'end_date': 'datetime64[ns]',
+                     'duration': 'int64', 'footprint': 'int64', 'cell_days': 'int64', '*solid_precip': 'float64'},
+    'storm_event_cells': {'date': 'datetime64[ns]', 'poly_index': 'int64', 'event_id': 'int64', 'event_*': 'int64',
+                          'event_solid_precip': 'float64'},
+}
+
+def file_format(path):
+    '''
+    Format of a target, determined by file extension
+    :param path: String. Path of file
+    :return: String. One of FORMATS
+    '''
+    fmt = os.path.splitext(path)[1].lstrip('.').lower()
+    if fmt not in FORMATS:
+        raise ValueError(f"unsupported file format: {path}")
+    return fmt
+
+def with_format(path, fmt):
+    '''
+    Replace extension of path with extension of format
+    :param path: String. Path of file
+    :param fmt: String. One of FORMATS
+    :return: String
+    '''
+    return f"{os.path.splitext(path)[0]}.{fmt}"
+
+def find_frame(path):
+    '''
+    Return path if it exists, otherwise the path of the same target saved in another format, if one exists
+    :param path: String. Path of file
+    :return: String
+    '''
+    if os.path.exists(path):
+        return path
+    for fmt in FORMATS:
+        if os.path.exists(with_format(path, fmt)):
+            return with_format(path, fmt)
+    return path
+
+def glob_frames(pattern, prefer='parquet'):
+    '''
+    Paths of pipeline targets, in any supported format, that match a glob pattern without file extension. A target
+    saved in more than one format, e.g. after a format switch or export_csv, is returned once, in the preferred format
+    :param pattern: String. Glob pattern of path, excluding file extension
+    :param prefer: String. One of FORMATS, format kept when a target exists in several formats
+    :return: List. Sorted paths
+    '''
+    targets = {}
+    for fmt in sorted(FORMATS, key=lambda fmt: fmt != prefer):
+        for f in glob.glob(f"{pattern}.{fmt}"):
+            targets.setdefault(os.path.splitext(f)[0], f)
+    return sorted(targets.values())
+
+def _schema(schema):
+    return SCHEMAS.get(schema) if isinstance(schema, str) else schema
+
+def _column_dtype(column, schema):
+    if column in schema:
+        return schema[column]
+    for pattern, dtype in schema.items():
+        if fnmatch.fnmatchcase(column, pattern):
+            return dtype
+    return None
+
+def apply_schema(data_frame, schema):
+    '''
+    Cast columns of DataFrame to the dtypes of a schema. Geometry columns are left as they are
+    :param data_frame: DataFrame
+    :param schema: String or Dictionary. Name of schema in SCHEMAS, or schema
+    :return: DataFrame
+    '''
+    schema = _schema(schema)
+    if not schema:
+        return data_frame
+    casts = {}
+    for column in data_frame.columns:
+        dtype = _column_dtype(column, schema)
+        if dtype is not None and dtype != 'geometry' and data_frame[column].dtype != dtype:
+            casts[column] = dtype
+    return data_frame.astype(casts) if casts else data_frame
+
+def _apply_filters(data_frame, filters):
+    '''
+    Apply pyarrow-style filters to DataFrame
+    :param data_frame: DataFrame
+    :param filters: List of (column, op, value) tuples
+    :return: DataFrame
+    '''
+    keep = pd.Series(True, index=data_frame.index)
+    for column, op, value in filters:
+        values = data_frame[column]
+        if op in ('=', '=='):
+            keep &= values == value
+        elif op == '!=':
+            keep &= values != value
+        elif op == '<':
+            keep &= values < value
+        elif op == '<=':
+            keep &= values <= value
+        elif op == '>':
+            keep &= values > value
+        elif op == '>=':
+            keep &= values >= value
+        elif op == 'in':
+            keep &= values.isin(value)
+        elif op == 'not in':
+            keep &= ~values.isin(value)
+        else:
+            raise ValueError(f"unsupported filter operator: {op}")
+    return data_frame[keep]
+
+def _read_csv(path, schema, columns, filters, chunksize=1000000):
+    usecols = list(columns) if columns is not None else None
+    if filters:
+        #read whole rows needed for filtering, then project
+        filter_columns = [f[0] for f in filters]
+        read_columns = None if usecols is None else list(dict.fromkeys(usecols + filter_columns))
+        frames = []
+        for chunk in pd.read_csv(path, usecols=read_columns, chunksize=chunksize):
+            chunk = _apply_filters(apply_schema(chunk, schema), filters)
+            frames.append(chunk if usecols is None else chunk[usecols])
+        data_frame = pd.concat(frames, ignore_index=True)
+    else:
+        data_frame = apply_schema(pd.read_csv(path, usecols=usecols), schema)
+    return data_frame
+
+def _read_parquet(path, columns, filters, geometry):
+    if geometry and b'geo' in (pq.read_schema(path).metadata or {}):
+        return gpd.read_parquet(path, columns=columns, filters=filters)
+    data_frame = pd.read_parquet(path, columns=columns, filters=filters)
+    if 'geometry' in data_frame.columns:
+        #GeoParquet geometry is stored as wkb; return wkt as the csv reader does
+        data_frame['geometry'] = gpd.GeoSeries.from_wkb(data_frame['geometry']).to_wkt()
+    return data_frame
+
+def to_geodataframe(data_frame, crs=None):
+    '''
+    Create GeoDataFrame from DataFrame whose geometry column holds wkt strings or geometries
+    :param data_frame: DataFrame
+    :param crs: Coordinate reference system of geometry
+    :return: GeoDataFrame
+    '''
+    data_frame = data_frame.copy() if not isinstance(data_frame, gpd.GeoDataFrame) else data_frame
+    if not isinstance(data_frame['geometry'].dtype, gpd.array.GeometryDtype):
+        data_frame['geometry'] = gpd.GeoSeries.from_wkt(data_frame['geometry'])
+    return gpd.GeoDataFrame(data_frame, geometry='geometry', crs=crs)
+
+def read_frame(path, schema=None, columns=None, filters=None, geometry=False):
+    '''
+    Read pipeline target into DataFrame. A directory is read as the concatenation of its partitions
+    :param path: String. Path of file or directory of partitions
+    :param schema: String or Dictionary. Name of schema in SCHEMAS, or schema, used to set dtypes of csv files
+    :param columns: List. Columns to read. All columns are read if None
+    :param filters: List of (column, op, value) tuples. Only rows satisfying every filter are returned
+    :param geometry: Boolean. Return GeoDataFrame with parsed geometry rather than geometry in wkt format
+    :return: DataFrame or GeoDataFrame
+    '''
+    if os.path.isdir(path):
+        partitions = sorted(f for fmt in FORMATS for f in glob.glob(os.path.join(path, f"*.{fmt}")))
+        return pd.concat((read_frame(f, schema, columns, filters, geometry) for f in partitions), ignore_index=True)
+
+    if file_format(path) == 'parquet':
+        data_frame = _read_parquet(path, columns, filters, geometry)
+    else:
+        data_frame = _read_csv(path, schema, columns, filters)
+
+    if geometry and not isinstance(data_frame, gpd.GeoDataFrame):
+        data_frame = to_geodataframe(data_frame)
+    add_rows_in(len(data_frame))
+    return data_frame
+
+def iter_frames(path, schema=None, columns=None, chunksize=1000000):
+    '''
+    Read pipeline target in chunks of rows. A directory is read partition by partition
+    :param path: String. Path of file or directory of partitions
+    :param schema: String or Dictionary. Name of schema in SCHEMAS, or schema, used to set dtypes of csv files
+    :param columns: List. Columns to read. All columns are read if None
+    :param chunksize: Int. Number of rows per chunk
+    :return: Generator of DataFrames
+    '''
+    if os.path.isdir(path):
+        for partition in sorted(f for fmt in FORMATS for f in glob.glob(os.path.join(path, f"*.{fmt}"))):
+            yield from iter_frames(partition, schema, columns, chunksize)
+    elif file_format(path) == 'parquet':
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize, columns=columns):
+            add_rows_in(batch.num_rows)
+            yield batch.to_pandas()
+    else:
+        for chunk in pd.read_csv(path, usecols=columns, chunksize=chunksize):
+            add_rows_in(len(chunk))
+            yield apply_schema(chunk, schema)
+
+def write_frame(data_frame, path, schema=None):
+    '''
+    Write DataFrame to pipeline target. Geometry in wkt format is written as GeoParquet to parquet files
+    :param data_frame: DataFrame or GeoDataFrame
+    :param path: String. Path of file
+    :param schema: String or Dictionary. Name of schema in SCHEMAS, or schema, used to set dtypes before writing
+    :return: None
+    '''
+    data_frame = apply_schema(data_frame, schema)
+    if file_format(path) == 'parquet':
+        if 'geometry' in data_frame.columns:
+            to_geodataframe(data_frame).to_parquet(path, index=False)
+        else:
+            data_frame.to_parquet(path, index=False)
+    else:
+        if isinstance(data_frame, gpd.GeoDataFrame):
+            data_frame = data_frame.to_wkt()
+        data_frame.to_csv(path, index=False)
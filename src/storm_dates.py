@@ -2,6 +2,7 @@ import os
 from salt import parse_dates
 import argparse
 from definitions import ROOT_DIR
+from storage import write_frame
 
 def add_storm_dates(input_file, output_file):
     '''
@@ -10,7 +11,8 @@ def add_storm_dates(input_file, output_file):
     :param output_file: String. Relative path to output file
     :return: None
     '''
-    parse_dates(salt_input=os.path.join(ROOT_DIR, input_file)).to_csv(os.path.join(ROOT_DIR, output_file), index=False)
+    write_frame(parse_dates(salt_input=os.path.join(ROOT_DIR, input_file)), os.path.join(ROOT_DIR, output_file),
+                schema='salt_storm_dates')
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Determine storm dates from winter Iowa salt data and add to data')
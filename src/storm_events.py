@@ -0,0 +1,123 @@
+import argparse
+import os
+import glob
+import logging
+import numpy as np
+import pandas as pd
+from scipy import ndimage
+from definitions import ROOT_DIR, REGIONAL_UPPER_LEFT, REGIONAL_BOTTOM_RIGHT, POLY_SIZE, MIN_SOLID
+from grid import Grid, Point
+from storage import read_frame, write_frame
+from utility import configure_logging
+from profiling import profiled
+
+logger = logging.getLogger(__name__)
+
+#storm event features of a storm cell, joined to storm rows by salt_model.storm_features
+EVENT_FEATURES = ['event_day', 'event_duration', 'event_footprint', 'event_cell_days', 'event_solid_precip']
+
+def label_storm_events(days, rows, columns, poly_shape, connectivity=2):
+    '''
+    Label connected components of storm cells in (day, row, column) space. Days are split into runs of consecutive
+    days, and each run is labeled as one boolean day x row x column array, so cells of days separated by a day without
+    storm cells are never connected and memory is bounded by the longest run
+    :param days: Ndarray. Day number of each storm cell
+    :param rows: Ndarray. Grid polygon row of each storm cell
+    :param columns: Ndarray. Grid polygon column of each storm cell
+    :param poly_shape: Tuple. Number of rows and columns of Grid polygons
+    :param connectivity: Int. 1 connects cells sharing a face in (day, row, column), 2 adds cells sharing an edge,
+    including diagonal neighbors on the same day, and 3 adds cells sharing a corner
+    :return: Ndarray. Event id, from 1, of each storm cell
+    '''
+    unique_days, day_of_cell = np.unique(days, return_inverse=True)
+    run_of_day = np.concatenate(([0], np.cumsum(np.diff(unique_days) > 1)))
+    run_start = np.searchsorted(run_of_day, np.arange(run_of_day[-1] + 2))
+    structure = ndimage.generate_binary_structure(3, connectivity)
+
+    cell_order = np.argsort(day_of_cell, kind='stable')
+    day_bounds = np.searchsorted(day_of_cell[cell_order], run_start)
+    events = np.zeros(days.size, dtype='int64')
+    n_events = 0
+    for run in range(run_start.size - 1):
+        cells = cell_order[day_bounds[run]:day_bounds[run + 1]]
+        day = day_of_cell[cells] - run_start[run]
+        snow = np.zeros((run_start[run + 1] - run_start[run],) + tuple(poly_shape), dtype=bool)
+        snow[day, rows[cells], columns[cells]] = True
+        labels, n = ndimage.label(snow, structure)
+        events[cells] = labels[day, rows[cells], columns[cells]] + n_events
+        n_events += n
+    logger.debug("%d storm cells, %d runs of days, %d events", days.size, run_start.size - 1, n_events)
+    return events
+
+@profiled
+def storm_events(snodas_inputs, grid, min_solid_precip=MIN_SOLID, connectivity=2):
+    '''
+    Segment storm cells (polygon days with solid precipitation of at least min_solid_precip) of quarterly SNODAS files
+    into storm events, i.e. groups of storm cells connected across adjacent grid polygons and consecutive days. Only
+    storm rows are read
+    :param snodas_inputs: List. Paths of quarterly SNODAS files
+    :param grid: Grid object. Grid of poly_index of SNODAS files
+    :param min_solid_precip: Int. Minimum amount of solid precipitation per day per polygon
+    :param connectivity: Int. Connectivity of label_storm_events
+    :return: (DataFrame, DataFrame). Events, columns = ['event_id', 'start_date', 'end_date', 'duration',
+    'footprint', 'cell_days', 'solid_precip', 'max_solid_precip'], with footprint the number of distinct polygons; and
+    storm cells, columns = ['date', 'poly_index', 'event_id'] + EVENT_FEATURES
+    '''
+    cells_df = pd.concat([read_frame(f, schema='snodas_params', columns=['date', 'poly_index', 'solid_precip'],
+                                     filters=[('solid_precip', '>=', min_solid_precip)]) for f in snodas_inputs],
+                         ignore_index=True)
+    #12/31 and 01/01 are in both the Q4 and the following Q1 file
+    cells_df = cells_df.drop_duplicates(['date', 'poly_index']).sort_values(['date', 'poly_index'], ignore_index=True)
+    rows, columns = grid.poly_position(cells_df['poly_index'].to_numpy())
+    cells_df['event_id'] = label_storm_events(cells_df['date'].to_numpy(dtype='datetime64[D]').astype('int64'), rows,
+                                              columns, grid.poly_shape(), connectivity)
+
+    events_df = cells_df.groupby('event_id', as_index=False, sort=True).aggregate(
+        start_date=('date', 'min'), end_date=('date', 'max'), footprint=('poly_index', 'nunique'),
+        cell_days=('poly_index', 'size'), solid_precip=('solid_precip', 'sum'),
+        max_solid_precip=('solid_precip', 'max'))
+    events_df.insert(3, 'duration', (events_df['end_date'] - events_df['start_date']).dt.days + 1)
+
+    event = events_df.set_index('event_id').loc[cells_df['event_id']]
+    cells_df['event_day'] = (cells_df['date'].to_numpy() - event['start_date'].to_numpy()) // np.timedelta64(1, 'D') + 1
+    for feature, column in (('event_duration', 'duration'), ('event_footprint', 'footprint'),
+                            ('event_cell_days', 'cell_days'), ('event_solid_precip', 'solid_precip')):
+        cells_df[feature] = event[column].to_numpy()
+    logger.info(f"{len(cells_df)} storm cells in {len(events_df)} storm events")
+    return events_df, cells_df[['date', 'poly_index', 'event_id'] + EVENT_FEATURES]
+
+def save_storm_events(glob_pattern, events_file, cells_file, min_solid_precip=MIN_SOLID, connectivity=2,
+                      upper_left=REGIONAL_UPPER_LEFT, bottom_right=REGIONAL_BOTTOM_RIGHT, poly_size=POLY_SIZE):
+    '''
+    Write storm events and storm event features of storm cells of quarterly SNODAS files
+    :param glob_pattern: String. Relative glob pattern of quarterly SNODAS files
+    :param events_file: String. Relative path of storm events file
+    :param cells_file: String. Relative path of storm event features by date and poly_index
+    :param min_solid_precip: Int. Minimum amount of solid precipitation per day per polygon
+    :param connectivity: Int. Connectivity of label_storm_events
+    :param upper_left: Tuple. Upper left coordinates of grid of SNODAS files
+    :param bottom_right: Tuple. Bottom right coordinates of grid of SNODAS files
+    :param poly_size: Int. Size of grid polygon dimensions in SNODAS units
+    :return: None
+    '''
+    grid = Grid(Point(*upper_left), Point(*bottom_right), poly_size)
+    events_df, cells_df = storm_events(sorted(glob.glob(os.path.join(ROOT_DIR, glob_pattern))), grid,
+                                       min_solid_precip, connectivity)
+    write_frame(events_df, os.path.join(ROOT_DIR, events_file), schema='storm_events')
+    write_frame(cells_df, os.path.join(ROOT_DIR, cells_file), schema='storm_event_cells')
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Segment storm cells of quarterly SNODAS files into storm events '
+                                                 'connected across adjacent polygons and consecutive days')
+    # CLI arguments with short and long flags
+    parser.add_argument('-g', '--globpattern', help='Glob file pattern of quarterly SNODAS files')
+    parser.add_argument('-o', '--output', help='Storm events file')
+    parser.add_argument('-c', '--celloutput', help='Storm event features by date and poly_index file')
+    parser.add_argument('-m', '--minsolid', type=int, default=MIN_SOLID,
+                        help='Minimum solid precipitation of storm cell')
+    parser.add_argument('-cn', '--connectivity', type=int, default=2, choices=(1, 2, 3),
+                        help='1: face, 2: edge, 3: corner neighbors in (day, row, column)')
+    args = parser.parse_args()
+    configure_logging()
+
+    save_storm_events(args.globpattern, args.output, args.celloutput, args.minsolid, args.connectivity)
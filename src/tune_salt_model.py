@@ -0,0 +1,241 @@
+import argparse
+import os
+import json
+import hashlib
+import itertools
+import logging
+import dill
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from threadpoolctl import threadpool_limits
+from sklearn.ensemble import HistGradientBoostingRegressor
+from sklearn.model_selection import GroupKFold
+from definitions import ROOT_DIR, MIN_SOLID
+from salt_model import FEATURE_NAMES, TREE_PARAMS, total_salt_per_polygon
+from storage import read_frame
+from utility import winter_season, file_hash, configure_logging
+from profiling import profiled
+
+logger = logging.getLogger(__name__)
+
+'''
+Hyperparameter search for the salt model with grouped K-fold cross-validation by winter season. Features of the joined
+Iowa winter data are binned once into uint8 codes (255 = missing) with quantile bin edges, like the bins of
+HistGradientBoostingRegressor, and cached as .npy files that worker processes memory-map. Each (candidate, fold) task
+fits on the binned codes of the training seasons, so the float features are not re-binned for every fit.
+Candidates are scored on a common set of held-out rows (solid_precip of at least the smallest MIN_SOLID searched):
+rows below a candidate's MIN_SOLID are predicted as 0 salt, as in the quarterly predictions. The score is the weighted
+absolute percentage error of salt totals by polygon and held-out season
+'''
+MISSING_BIN = 255
+CACHE_FILES = ('bins', 'salt', 'season', 'poly_index', 'solid_precip')
+
+def bin_edges(values, max_bins=MISSING_BIN, subsample=200000, seed=0):
+    '''
+    Upper bin thresholds of one feature. Midpoints between distinct values if there are at most max_bins of them,
+    otherwise quantiles of a subsample
+    :param values: Ndarray. Feature values, NaN for missing
+    :param max_bins: Int. Maximum number of bins of non-missing values
+    :param subsample: Int. Number of values used to compute quantiles
+    :param seed: Int. Random seed of subsample
+    :return: Ndarray. Thresholds, value x is in bin i if threshold[i - 1] < x <= threshold[i]
+    '''
+    values = values[~np.isnan(values)]
+    if values.size > subsample:
+        values = np.random.default_rng(seed).choice(values, subsample, replace=False)
+    distinct = np.unique(values)
+    if distinct.size <= max_bins:
+        return (distinct[:-1] + distinct[1:]) / 2
+    return np.unique(np.quantile(values, np.linspace(0, 1, max_bins + 1)[1:-1], method='midpoint'))
+
+def bin_features(X):
+    '''
+    Bin feature matrix into uint8 codes. Missing values are coded MISSING_BIN
+    :param X: Ndarray. Shape (number of rows, number of features)
+    :return: Ndarray of uint8, same shape as X
+    '''
+    codes = np.empty(X.shape, dtype='uint8')
+    for j in range(X.shape[1]):
+        codes[:, j] = np.searchsorted(bin_edges(X[:, j]), X[:, j], side='left')
+        codes[np.isnan(X[:, j]), j] = MISSING_BIN
+    return codes
+
+def input_hash(data_input):
+    '''
+    Content hash of joined Iowa winter data, a file or a directory of season partitions
+    :param data_input: String. Path of file or directory
+    :return: String. Hex digest
+    '''
+    if not os.path.isdir(data_input):
+        return file_hash(data_input)
+    digest = hashlib.sha256()
+    for f in sorted(os.listdir(data_input)):
+        digest.update(f"{f}:{file_hash(os.path.join(data_input, f))}".encode())
+    return digest.hexdigest()
+
+@profiled
+def cache_binned_features(data_input, cache_dir, min_solid):
+    '''
+    Bin the features of joined Iowa winter data and save them, with labels, seasons, poly_index and solid_precip, as
+    .npy files. The cache is reused while the data and min_solid are unchanged
+    :param data_input: String. Path to file, or directory of season partitions, containing Iowa Winter Salt Data set
+    :param cache_dir: String. Path of cache directory
+    :param min_solid: Float. Smallest MIN_SOLID searched. Rows with less solid precipitation are not cached
+    :return: Dictionary. keys = CACHE_FILES, values = read-only memory-mapped ndarrays
+    '''
+    meta = {'input_hash': input_hash(data_input), 'min_solid': min_solid, 'features': FEATURE_NAMES}
+    meta_file = os.path.join(cache_dir, 'meta.json')
+    cached = None
+    if os.path.exists(meta_file):
+        with open(meta_file) as f:
+            cached = json.load(f)
+    if cached != meta:
+        logger.info(f"binning features of {data_input}")
+        os.makedirs(cache_dir, exist_ok=True)
+        salt_df = read_frame(data_input, schema='winter_iowa_joined')
+        salt_df = salt_df[salt_df['solid_precip'] >= min_solid]
+        arrays = {'bins': bin_features(salt_df[FEATURE_NAMES].to_numpy(dtype='float64')),
+                  'salt': salt_df['WITHIN_POLY_TOTALSALT'].to_numpy(dtype='float64'),
+                  'season': winter_season(salt_df['STORM_DATE']),
+                  'poly_index': salt_df['poly_index'].to_numpy(dtype='int64'),
+                  'solid_precip': salt_df['solid_precip'].to_numpy(dtype='float64')}
+        for name in CACHE_FILES:
+            np.save(os.path.join(cache_dir, f"{name}.npy"), arrays[name])
+        with open(meta_file, 'w') as f:
+            json.dump(meta, f, indent=1)
+    return {name: np.load(os.path.join(cache_dir, f"{name}.npy"), mmap_mode='r') for name in CACHE_FILES}
+
+def search_candidates(grid):
+    '''
+    Every combination of the values of a search grid
+    :param grid: Dictionary. keys = parameter names, values = lists of values
+    :return: List of Dictionaries
+    '''
+    return [dict(zip(grid, values)) for values in itertools.product(*grid.values())]
+
+def wape(salt, prediction, season, poly_index):
+    '''
+    Weighted absolute percentage error of salt totals by season and polygon
+    :return: Float
+    '''
+    totals = pd.DataFrame({'season': season, 'poly_index': poly_index, 'salt': salt, 'prediction': prediction}) \
+        .groupby(['season', 'poly_index']).sum()
+    return float(np.abs(totals['prediction'] - totals['salt']).sum() / totals['salt'].sum())
+
+#binned features memory-mapped by a tuning worker process, set once by _init_tuning_worker
+_cache = {}
+
+def _init_tuning_worker(cache_dir, threads):
+    '''
+    Initializer of tuning worker processes. Memory-maps the cached binned features, which are shared through the page
+    cache rather than copied to every worker
+    '''
+    _cache.update({name: np.load(os.path.join(cache_dir, f"{name}.npy"), mmap_mode='r') for name in CACHE_FILES})
+    #limit OpenMP threads of HistGradientBoostingRegressor so workers do not oversubscribe cores
+    _cache['threads'] = threadpool_limits(threads)
+
+def _features(rows):
+    X = _cache['bins'][rows].astype('float32')
+    X[X == MISSING_BIN] = np.nan
+    return X
+
+def _fit_fold(candidate, train_seasons, test_seasons, seed):
+    '''
+    Fit one candidate on the training seasons of a fold and score it on the held-out seasons
+    :param candidate: Dictionary. Tree hyperparameters and min_solid
+    :return: Dictionary. Fold scores
+    '''
+    tree_params = {k: v for k, v in candidate.items() if k != 'min_solid'}
+    kept = _cache['solid_precip'] >= candidate['min_solid']
+    train = np.flatnonzero(np.isin(_cache['season'], train_seasons) & kept)
+    test = np.flatnonzero(np.isin(_cache['season'], test_seasons))
+
+    estimator = HistGradientBoostingRegressor(loss='poisson', random_state=seed, **{**TREE_PARAMS, **tree_params})
+    estimator.fit(_features(train), _cache['salt'][train])
+    #rows below min_solid are not storm rows of the candidate and are predicted as 0 salt
+    prediction = np.zeros(test.size)
+    prediction[kept[test]] = estimator.predict(_features(test[kept[test]]))
+    salt = _cache['salt'][test]
+    return {'wape': wape(salt, prediction, _cache['season'][test], _cache['poly_index'][test]),
+            'mae': float(np.abs(prediction - salt).mean()),
+            'total_error': float(prediction.sum() / salt.sum() - 1), 'n_iter': estimator.n_iter_}
+
+@profiled
+def tune_salt_model(data_input, grid, cache_dir, n_splits=5, workers=1, seed=0):
+    '''
+    Grouped K-fold cross-validation by winter season of every candidate of a search grid, with (candidate, fold) tasks
+    run by a pool of worker processes
+    :param data_input: String. Path to file, or directory of season partitions, containing Iowa Winter Salt Data set
+    :param grid: Dictionary. keys = HistGradientBoostingRegressor parameters and min_solid, values = lists of values
+    :param cache_dir: String. Path of binned feature cache directory
+    :param n_splits: Int. Number of folds. Seasons are split between folds
+    :param workers: Int. Number of worker processes
+    :param seed: Int. Random seed of estimators
+    :return: DataFrame. One row per candidate with mean and standard deviation of fold scores, best first
+    '''
+    arrays = cache_binned_features(data_input, cache_dir, min(grid['min_solid']))
+    seasons = np.unique(arrays['season'])
+    if seasons.size < n_splits:
+        raise ValueError(f"{seasons.size} seasons cannot be split into {n_splits} folds")
+    folds = [(seasons[train], seasons[test])
+             for train, test in GroupKFold(n_splits=n_splits).split(seasons, groups=seasons)]
+    candidates = search_candidates(grid)
+    tasks = list(itertools.product(range(len(candidates)), range(len(folds))))
+    logger.info(f"{len(candidates)} candidates x {len(folds)} folds over {seasons.size} seasons")
+
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_tuning_worker,
+                             initargs=(cache_dir, threads)) as executor:
+        scores = list(executor.map(_fit_fold, [candidates[c] for c, _ in tasks], [folds[f][0] for _, f in tasks],
+                                   [folds[f][1] for _, f in tasks], [seed] * len(tasks)))
+
+    results = pd.DataFrame([{**candidates[c], 'fold': f, **score} for (c, f), score in zip(tasks, scores)])
+    summary = results.groupby(list(grid), as_index=False).agg(
+        wape=('wape', 'mean'), wape_std=('wape', 'std'), mae=('mae', 'mean'), total_error=('total_error', 'mean'),
+        n_iter=('n_iter', 'mean'))
+    return summary.sort_values(['wape', 'mae'], ignore_index=True)
+
+def save_tuned_salt_model(winter_iowa_salt_data_path, results_file, output_file, grid, cache_dir, n_splits=5,
+                          workers=1):
+    '''
+    Tune the salt model, save the results table, and refit and save the best candidate on all seasons
+    :param winter_iowa_salt_data_path: String. Relative path of joined Iowa winter data
+    :param results_file: String. Relative path of csv file of cross-validation results
+    :param output_file: String. Relative path of .pkd file of best fitted pipeline
+    :return: None
+    '''
+    data_input = os.path.join(ROOT_DIR, winter_iowa_salt_data_path)
+    results = tune_salt_model(data_input, grid, os.path.join(ROOT_DIR, cache_dir), n_splits, workers)
+    results.to_csv(os.path.join(ROOT_DIR, results_file), index=False)
+
+    #read by column so that integer parameters keep their dtype
+    best = {k: results[k].iloc[0].item() for k in grid}
+    logger.info(f"best candidate {best}: wape {results['wape'].iloc[0]:.4f}")
+    min_solid = best.pop('min_solid')
+    fitted_salt_model = total_salt_per_polygon(data_input, min_solid, **best)
+    with open(os.path.join(ROOT_DIR, output_file), 'wb') as f:
+        dill.dump(fitted_salt_model, f)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Tune salt model with grouped K-fold cross-validation by winter '
+                                                 'season and save results and best fitted model')
+    # CLI arguments with short and long flags
+    parser.add_argument('-i', '--input', help='Winter Iowa salt data file path')
+    parser.add_argument('-r', '--results', default='models/salt_model_tuning.csv', help='Results csv file')
+    parser.add_argument('-o', '--output', default='models/tuned_salt_model.pkd', help='Best fitted model file')
+    parser.add_argument('-c', '--cachedir', default='data/interim/salt_model_bins', help='Binned feature cache')
+    parser.add_argument('-k', '--folds', type=int, default=5, help='Number of season folds')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='Number of worker processes')
+    parser.add_argument('--maxleafnodes', type=int, nargs='+', default=[31, 63, 140, 255])
+    parser.add_argument('--minsamplesleaf', type=int, nargs='+', default=[15, 50])
+    parser.add_argument('--learningrate', type=float, nargs='+', default=[0.1])
+    parser.add_argument('--maxiter', type=int, nargs='+', default=[100])
+    parser.add_argument('--minsolid', type=float, nargs='+', default=[1, MIN_SOLID, 4])
+    args = parser.parse_args()
+    configure_logging()
+
+    search_grid = {'max_leaf_nodes': args.maxleafnodes, 'min_samples_leaf': args.minsamplesleaf,
+                   'learning_rate': args.learningrate, 'max_iter': args.maxiter, 'min_solid': args.minsolid}
+    save_tuned_salt_model(args.input, args.results, args.output, search_grid, args.cachedir, args.folds,
+                          args.workers)
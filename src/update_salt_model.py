@@ -0,0 +1,106 @@
+import argparse
+import os
+import glob
+import json
+import logging
+import dill
+import numpy as np
+from sklearn.metrics import mean_poisson_deviance
+from definitions import ROOT_DIR, MIN_SOLID
+from salt_model import continue_boosting
+from storage import read_frame, write_frame, FORMATS
+from utility import winter_season, configure_logging
+
+logger = logging.getLogger(__name__)
+
+def append_to_training_store(data_input, store_dir, fmt='csv'):
+    '''
+    Write joined Iowa winter rows to a training store with one partition per winter season, season=<year>.<fmt>.
+    Partitions of seasons in data_input replace stored partitions of the same season, so an in-season refresh of the
+    newest season can be appended repeatedly
+    :param data_input: String. Path to file, or directory of season partitions, of joined Iowa winter data
+    :param store_dir: String. Path of training store directory
+    :param fmt: String. File format of partitions
+    :return: List. Seasons written
+    '''
+    os.makedirs(store_dir, exist_ok=True)
+    salt_df = read_frame(data_input, schema='winter_iowa_joined')
+    seasons = winter_season(salt_df['STORM_DATE'])
+    for season in np.unique(seasons):
+        for f in glob.glob(os.path.join(store_dir, f"season={season}.*")):
+            os.remove(f)
+        write_frame(salt_df[seasons == season], os.path.join(store_dir, f"season={season}.{fmt}"),
+                    schema='winter_iowa_joined')
+    return [int(season) for season in np.unique(seasons)]
+
+def update_salt_model(fitted_salt_model_path, data_input, store_dir, output_file, holdout_season=None, n_iter=20,
+                      min_solid=MIN_SOLID, fmt='csv', tolerance=0.):
+    '''
+    Incremental retraining of the salt model. New joined rows are appended to the training store, and boosting is
+    continued from the fitted salt model on the stored seasons except a holdout season. The candidate replaces the
+    fitted model only if its Poisson deviance on the holdout season is no worse than that of the fitted model; the
+    replacement continues boosting on all stored seasons, holdout included. The holdout season must be out of sample
+    for both models, so seasons in the training_seasons of the fitted model are rejected
+    :param fitted_salt_model_path: String. Relative path of fitted salt model .pkd file
+    :param data_input: String. Relative path of joined Iowa winter data of the new season
+    :param store_dir: String. Relative path of training store directory
+    :param output_file: String. Relative path of updated model .pkd file
+    :param holdout_season: Int. Season compared before replacing the model. Defaults to the newest appended season
+    :param n_iter: Int. Maximum number of boosting iterations added
+    :param min_solid: Int. Minimum amount of solid precipitation per day per polygon
+    :param fmt: String. File format of training store partitions
+    :param tolerance: Float. Relative increase of holdout deviance accepted
+    :return: Dictionary. Holdout comparison
+    '''
+    new_seasons = append_to_training_store(os.path.join(ROOT_DIR, data_input), os.path.join(ROOT_DIR, store_dir), fmt)
+    store_df = read_frame(os.path.join(ROOT_DIR, store_dir), schema='winter_iowa_joined')
+    seasons = winter_season(store_df['STORM_DATE'])
+    if holdout_season is None:
+        holdout_season = max(new_seasons)
+
+    with open(os.path.join(ROOT_DIR, fitted_salt_model_path), 'rb') as f:
+        fitted_salt_model = dill.load(f)
+    training_seasons = getattr(fitted_salt_model, 'training_seasons', None)
+    if training_seasons is None:
+        logger.warning(f"fitted salt model does not record its training seasons, holdout season {holdout_season} "
+                       f"may be in sample")
+    elif holdout_season in training_seasons:
+        raise ValueError(f"holdout season {holdout_season} is a training season of the fitted salt model "
+                         f"{training_seasons}; its deviance would be in sample")
+    if not (seasons != holdout_season).any():
+        raise ValueError(f"no stored season other than holdout season {holdout_season} to boost the candidate on")
+    candidate = continue_boosting(fitted_salt_model, store_df[seasons != holdout_season], min_solid, n_iter)
+
+    holdout_df = store_df[(seasons == holdout_season) & (store_df['solid_precip'] >= min_solid)]
+    y = holdout_df['WITHIN_POLY_TOTALSALT']
+    comparison = {'new_seasons': new_seasons, 'holdout_season': holdout_season, 'holdout_rows': len(holdout_df),
+                  'current_deviance': mean_poisson_deviance(y, fitted_salt_model.predict(holdout_df)),
+                  'candidate_deviance': mean_poisson_deviance(y, candidate.predict(holdout_df))}
+    comparison['replaced'] = bool(comparison['candidate_deviance'] <=
+                                  comparison['current_deviance'] * (1 + tolerance))
+    logger.info(json.dumps(comparison))
+
+    if comparison['replaced']:
+        updated_salt_model = continue_boosting(fitted_salt_model, store_df, min_solid, n_iter)
+        with open(os.path.join(ROOT_DIR, output_file), 'wb') as f:
+            dill.dump(updated_salt_model, f)
+    return comparison
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Append new season of joined Winter Iowa data to training store and '
+                                                 'continue boosting the salt model if holdout quality holds')
+    # CLI arguments with short and long flags
+    parser.add_argument('-s', '--saltmodelfile', help='Fitted salt model file path')
+    parser.add_argument('-i', '--input', help='Joined Winter Iowa data of new season')
+    parser.add_argument('-st', '--store', default='data/processed/salt_training_store', help='Training store directory')
+    parser.add_argument('-o', '--output', help='Updated model file. Defaults to fitted salt model file')
+    parser.add_argument('-ho', '--holdout', type=int, default=None,
+                        help='Holdout season, e.g. 2021 for winter 2020-21. Defaults to the newest appended season')
+    parser.add_argument('-n', '--iterations', type=int, default=20, help='Maximum boosting iterations added')
+    parser.add_argument('-t', '--tolerance', type=float, default=0., help='Relative holdout deviance increase accepted')
+    parser.add_argument('-f', '--format', default='csv', choices=FORMATS, help='File format of store partitions')
+    args = parser.parse_args()
+    configure_logging()
+
+    print(update_salt_model(args.saltmodelfile, args.input, args.store, args.output or args.saltmodelfile,
+                            args.holdout, args.iterations, MIN_SOLID, args.format, args.tolerance))
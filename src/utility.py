@@ -1,4 +1,9 @@
 import numpy as np
+import pandas as pd
+import os
+import re
+import hashlib
+import logging
 
 def to_padded_num(d):
     zero_padded = {1: "01", 2: "02", 3: "03", 4: "04", 5: "05", 6: "06", 7: "07", 8: "08", 9: "09"}
@@ -20,4 +25,59 @@ def dat_to_numpy(fname):
     '''takes the name of an individual day data file and returns a numpy of values'''
     # values are in big endian format
     #tested with fname = "20221001"
-    return np.fromfile(fname, dtype=np.dtype('>h')).astype(np.int32)
\ No newline at end of file
+    return np.fromfile(fname, dtype=np.dtype('>h')).astype(np.int32)
+
+def winter_season(dates):
+    '''Winter season of each date, labelled by the year of the January it contains. Seasons run July through June
+    :param dates: Array-like of datetimes
+    :return: ndarray of ints'''
+    dates = pd.DatetimeIndex(dates)
+    return (dates.year + (dates.month >= 7)).to_numpy()
+
+def quarter_from_path(path):
+    '''FY quarter tag, e.g. Q12019, contained in the file name of a quarterly data set
+    :param path: String. Path of quarterly file
+    :return: String'''
+    return re.search(r"Q[1-4]\d{4}", os.path.basename(path)).group(0)
+
+def quarter_dates(quarter):
+    '''First and last day of the SNODAS window of a FY quarter. Q1 runs 12/31 through 04/01 and Q4 09/30 through 01/01
+    :param quarter: String. Quarter tag, e.g. Q12019
+    :return: (String, String). Dates in mm/dd/yyyy format'''
+    year = int(quarter[2:])
+    if quarter[:2] == 'Q1':
+        return f"12/31/{year - 1}", f"04/01/{year}"
+    return f"09/30/{year}", f"01/01/{year + 1}"
+
+def quarters_of_date(date):
+    '''FY quarter tags of the SNODAS windows containing a date. 12/31 and 01/01 are in the windows of both Q4 and the
+    following Q1
+    :param date: Datetime
+    :return: List. Quarter tags in date order, empty if the date is outside every window'''
+    date = pd.Timestamp(date)
+    candidates = [f"Q4{date.year - 1}", f"Q1{date.year}", f"Q4{date.year}", f"Q1{date.year + 1}"]
+    return [quarter for quarter in candidates
+            if pd.Timestamp(quarter_dates(quarter)[0]) <= date <= pd.Timestamp(quarter_dates(quarter)[1])]
+
+def file_hash(path, block_size=1 << 20):
+    '''SHA-256 hash of the content of a file
+    :param path: String. Path of file
+    :param block_size: Int. Number of bytes read at a time
+    :return: String. Hex digest'''
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def configure_logging(log_file=None, level=logging.INFO):
+    '''
+    Configure root logger of a pipeline script. Modules only create loggers; handlers are added here
+    :param log_file: String. Path of log file. Log records are written to stderr if None
+    :param level: Int. Logging level
+    :return: None
+    '''
+    handler = logging.FileHandler(log_file) if log_file else logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(fmt='%(asctime)s %(levelname)-8s %(name)s %(message)s',
+                                           datefmt='%Y-%m-%d %H:%M:%S'))
+    logging.basicConfig(level=level, handlers=[handler])
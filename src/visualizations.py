@@ -1,15 +1,13 @@
 import matplotlib.pyplot as plt
-import geopandas as gpd
 import contextily as cx
+from storage import to_geodataframe
 
 def solid_plots(quarter, previous_quarter, solid_df, grid_df):
 
     solid_vmin = solid_df['solid_precip'].min()
     solid_vmax = solid_df['solid_precip'].max()
 
-    data = solid_df.merge(grid_df, how='left', on='poly_index')
-    data['geometry'] = gpd.GeoSeries.from_wkt(data['geometry'])
-    data = gpd.GeoDataFrame(data, geometry='geometry')
+    data = to_geodataframe(solid_df.merge(grid_df, how='left', on='poly_index'))
 
     data = data.set_crs("EPSG:4326")
     data = data.to_crs("EPSG:3857")
@@ -48,9 +46,7 @@ def salt_plots(quarter, previous_quarter, salt_df, grid_df):
     salt_vmin = salt_df['salt'].min()
     salt_vmax = salt_df['salt'].max()
 
-    data = salt_df.merge(grid_df, how='left', on='poly_index')
-    data['geometry'] = gpd.GeoSeries.from_wkt(data['geometry'])
-    data = gpd.GeoDataFrame(data, geometry='geometry')
+    data = to_geodataframe(salt_df.merge(grid_df, how='left', on='poly_index'))
 
     data = data.set_crs("EPSG:4326")
     data = data.to_crs("EPSG:3857")
@@ -87,6 +83,8 @@ def sales_growth(quarter, previous_quarter, predictions):
     predicted_sales = predictions[(predictions['quarter']==quarter)]['predicted'].iloc[0]/(2000*1000)
     prior_sales = predictions[(predictions['quarter']==previous_quarter)]['actual'].iloc[0]/(2000*1000)
     actual_sales = predictions[(predictions['quarter']==quarter)]['actual'].iloc[0]/(2000*1000)
+    #bootstrap percentile band of expected volume, if sales estimates were written with one
+    bands = sorted((c for c in predictions.columns if c.startswith('predicted_p')), key=lambda c: float(c[11:]))
 
     fig, ax = plt.subplots(layout='constrained')
 
@@ -118,8 +116,14 @@ def sales_growth(quarter, previous_quarter, predictions):
     ax.set_xticks((.5, 1),  (previous_quarter, quarter))
     ax.plot([.5, 1],[prior_sales, actual_sales], color='blue')
     ax.plot([.5, 1], [prior_sales, predicted_sales], color='orange')
+    if bands:
+        lower, upper = (predictions[(predictions['quarter']==quarter)][c].iloc[0]/(2000*1000)
+                        for c in (bands[0], bands[-1]))
+        ax.errorbar(1.1, predicted_sales, yerr=[[predicted_sales - lower], [upper - predicted_sales]], color='black',
+                    capsize=4, label=f'Expected Range (p{bands[0][11:]}-p{bands[-1][11:]})')
     ax.legend(loc='upper left', ncols=2)
-    ax.set_ylim(0, max(predicted_sales, actual_sales, prior_sales)*1.25)
+    ax.set_ylim(0, max([predicted_sales, actual_sales, prior_sales] +
+                       [predictions[(predictions['quarter']==quarter)][c].iloc[0]/(2000*1000) for c in bands])*1.25)
     return fig
 
 